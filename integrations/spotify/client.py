@@ -1,27 +1,43 @@
-import difflib
-import re
-from typing import List, Optional, Iterator, Dict
-
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Iterator, Dict, Tuple
+
+import requests
 import spotipy
-from spotipy import SpotifyOAuth
+from spotipy import SpotifyException, SpotifyOAuth
 
+from integrations.spotify.http_cache import CachedSession, mount_retries
+from integrations.spotify.matching import TrackMatcher
 from integrations.spotify.models import SpotifyTrack
+from musik_lib.artists import parse_artists
 
 
 NUM_SEARCH_ITEMS = 15
-AND_REGEX = re.compile(" & | and |, | feat | featuring | feat\\. | מארח את ", re.IGNORECASE)
+# Retries of a call that is rate limited by spotify, waiting for its Retry-After header
+MAX_RATE_LIMIT_RETRIES = 5
+# Most track ids the audio features endpoint takes in a request
+AUDIO_FEATURES_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
 
 
 class SpotifyClient:
     """
     Thin wrapper for spotipy client
     so can get resources in a streaming fashion instead of bulk
+
+    With workers > 1, the pages of playlist items are fetched concurrently by a pool of that many threads.
+    With a cache path, GET responses are cached on disk there, see http_cache
     """
     client: spotipy.Spotify
     limit: int
+    workers: int
 
     @classmethod
-    def make_default(cls, limit=50, extra_scope=None):
+    def make_default(cls, limit=50, extra_scope=None, workers=1, cache_path=None):
         base_scope = [
             "user-read-private",
             "user-read-email",
@@ -35,16 +51,22 @@ class SpotifyClient:
                 client_credentials_manager=SpotifyOAuth(
                     scope=scope,
                 ),
+                requests_session=CachedSession(cache_path) if cache_path else mount_retries(requests.Session()),
             ),
             limit=limit,
+            workers=workers,
         )
 
-    def __init__(self, client: spotipy.Spotify, limit):
+    def __init__(self, client: spotipy.Spotify, limit, workers=1):
         self.client = client
         self.limit = limit
+        self.workers = workers
+        self._me = None
 
     def me(self):
-        return self.client.me()
+        if self._me is None:
+            self._me = self.call(self.client.me)
+        return self._me
 
     def user_id(self):
         return self.me()["id"]
@@ -73,35 +95,32 @@ class SpotifyClient:
         )
 
     def search_track(self, track_name, artist_name, duration: str) -> Optional[SpotifyTrack]:
-        def gen_items():
-            response = self.client.search(
-                q=f"{track_name}, {artist_name}",
+        """
+        The best ranked item of the search for the track, see matching;
+        Searches again by the first artist only when there are a few artists and nothing matched
+        """
+        def search(query):
+            response = self.call(
+                self.client.search,
+                q=query,
                 type="track",
                 limit=NUM_SEARCH_ITEMS,
             )
-            items = response.get("tracks", {}).get("items", [])
-            yield from (i for i in items)
-
-            if len(artist_names := artist_name_to_list(artist_name)) > 1:
-                first_artist_name = artist_names[0]
-                response = self.client.search(
-                    q=f"{track_name}, {first_artist_name}",
-                    type="track",
-                    limit=NUM_SEARCH_ITEMS,
-                )
-                items = response.get("tracks", {}).get("items", [])
-                yield from (i for i in items)
-
-        track_filter = make_track_filter(track_name, artist_name, duration)
-        found_item = next(filter(track_filter, gen_items()), None)
-        if not found_item:
+            return response.get("tracks", {}).get("items", [])
+
+        matcher = TrackMatcher(track_name, artist_name, duration)
+        items = search(f"{track_name}, {artist_name}")
+        result = matcher.match(items)
+        if result.best is None and len(artist_names := parse_artists(artist_name).all) > 1:
+            items += search(f"{track_name}, {artist_names[0]}")
+            result = matcher.match(items)
+        if result.best is None:
             raise ValueError(
-                f"Did not find a match for {track_name}, {artist_name} in items"
+                f"Did not find a match for {track_name}, {artist_name} in items\n{result.explain()}"
             )
-        spotify_track = SpotifyTrack.from_spotify_api(found_item)
-        print(
-            f"Found a match for {track_name}, {artist_name} : {spotify_track}"
-        )
+        spotify_track = SpotifyTrack.from_spotify_api(result.best.item)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found a match for %s, %s : %s", track_name, artist_name, result.best.explain())
 
         return spotify_track
 
@@ -113,33 +132,134 @@ class SpotifyClient:
         def gen_items(playlist_items):
             return (i for i in playlist_items)
 
-        playlists = self.client.user_playlists(
+        playlists = self.call(
+                self.client.user_playlists,
                 user=self.me()["id"],
                 limit=self.limit,
             )
         while playlists["next"] is not None:
             yield from gen_items(playlists["items"])
-            playlists = self.client.next(playlists)
+            playlists = self.call(self.client.next, playlists)
         yield from gen_items(playlists["items"])
 
     def playlist_items(self, playlist) -> Iterator[Dict]:
         """
         Returns an iterator of playlist items (Tracks)
         """
+        if self.workers > 1:
+            _, items = next(self.playlists_items([playlist]))
+            yield from items
+            return
+
         def gen_items(items):
             return (i for i in items)
 
-        playlist_items = self.client.playlist_items(
+        playlist_items = self.call(
+            self.client.playlist_items,
             playlist_id=playlist["id"],
             limit=self.limit,
         )
         while playlist_items["next"] is not None:
             yield from gen_items(playlist_items["items"])
-            playlist_items = self.client.next(playlist_items)
+            playlist_items = self.call(self.client.next, playlist_items)
         yield from gen_items(playlist_items["items"])
 
+    def playlists_items(self, playlists: List[Dict]) -> Iterator[Tuple[Dict, List[Dict]]]:
+        """
+        Fetches the items of all playlists concurrently by pages of limit items;
+        The first page of every playlist tells its total, then the rest of the pages are fetched by their offset
+
+        :return: iterator of (playlist, playlist items) in the order of playlists, items in their playlist order
+        """
+        def fetch_page(playlist, offset):
+            return self.call(
+                self.client.playlist_items,
+                playlist_id=playlist["id"],
+                limit=self.limit,
+                offset=offset,
+            )
+
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            first_pages = list(executor.map(lambda p: fetch_page(p, 0), playlists))
+            rest_pages = [
+                [
+                    executor.submit(fetch_page, playlist, offset)
+                    for offset in range(self.limit, first_page["total"], self.limit)
+                ]
+                for playlist, first_page in zip(playlists, first_pages)
+            ]
+            for playlist, first_page, pages in zip(playlists, first_pages, rest_pages):
+                items = list(first_page["items"])
+                for page in pages:
+                    items.extend(page.result()["items"])
+                yield playlist, items
+
+    def playlists_pages(self, playlists: List[Dict]) -> Iterator[Tuple[Dict, List[Dict]]]:
+        """
+        Streams the items of the playlists page by page, without holding more than a window of pages
+
+        Pages are planned by the total of items in the playlist listing, and up to 2 * workers of them are fetched
+        ahead concurrently; When a playlist grew since the listing, its last planned page leads to the rest
+        :return: iterator of (playlist, items of a page) in the order of playlists and of their items;
+        Every playlist has at least a page, which is empty for an empty playlist
+        """
+        def plan():
+            for playlist in playlists:
+                total = (playlist.get("tracks") or {}).get("total") or 0
+                offsets = range(0, total, self.limit) if total else [0]
+                for offset in offsets:
+                    yield playlist, offset, offset == offsets[-1]
+
+        def fetch_page(playlist, offset, last):
+            return playlist, last, self.call(
+                self.client.playlist_items,
+                playlist_id=playlist["id"],
+                limit=self.limit,
+                offset=offset,
+            )
+
+        window = 2 * max(self.workers, 1)
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            pending = deque()
+            tasks = plan()
+            for task in itertools.islice(tasks, window):
+                pending.append(executor.submit(fetch_page, *task))
+            while pending:
+                playlist, last, page = pending.popleft().result()
+                if (task := next(tasks, None)) is not None:
+                    pending.append(executor.submit(fetch_page, *task))
+                yield playlist, page["items"]
+                while last and page["next"] is not None:
+                    page = self.call(self.client.next, page)
+                    yield playlist, page["items"]
+
+    def call(self, method, *args, **kwargs):
+        """
+        Calls a spotipy method; When rate limited, waits for as long as the Retry-After header says and retries
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            try:
+                return method(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = e.headers.get("Retry-After")
+                time.sleep(float(retry_after) if retry_after else 2 ** attempt)
+
     def audio_features(self, track_id: str):
-        return self.client.audio_features(track_id)[0]
+        return self.call(self.client.audio_features, track_id)[0]
+
+    def audio_features_batch(self, track_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Fetches the audio features of tracks by batches of AUDIO_FEATURES_BATCH_SIZE ids
+
+        :return: features by track id; None for tracks that spotify has no features for
+        """
+        features = {}
+        for start in range(0, len(track_ids), AUDIO_FEATURES_BATCH_SIZE):
+            batch = track_ids[start:start + AUDIO_FEATURES_BATCH_SIZE]
+            features.update(zip(batch, self.call(self.client.audio_features, batch)))
+        return features
 
     def create_playlist(self, playlist_name: str, uris: List[str], description: Optional[str]):
         """
@@ -175,107 +295,3 @@ class SpotifyClient:
             playlist_id=playlist_id,
             description=collection["description"],
         )
-
-
-def make_track_filter(track_name: str, artist_name: str, duration: str):
-    def duration_to_ms():
-        duration_parts = duration.split(":")
-        len_duration = len(duration_parts)
-        if len_duration == 3:
-            hours, minutes, seconds = duration_parts
-        elif len_duration == 2:
-            hours, minutes, seconds = ['0'] + duration_parts
-        else:
-            raise ValueError(f"Failed to parse duration -> {duration}")
-
-        return (
-                int(hours) * 3600 + int(minutes) * 60 + int(seconds)
-        ) * 1000
-
-    origin_artists = artist_name_to_list(artist_name)
-    duration_in_ms = duration_to_ms()
-    duration_min = duration_in_ms * 0.9
-    duration_max = duration_in_ms * 1.1
-    track_name_lower = track_name.lower()
-
-    def type_filter(_item):
-        if _item["type"] == "track":
-            return True
-        print(f"False. not type track item: {_item}")
-        return False
-
-    def similar_name_filter(_item) -> bool:
-        item_name: str = _item["name"].lower()
-        if "remaster" in item_name and "-" in item_name:
-            parts = item_name.split("-")
-            item_name = parts[0].strip()
-        similar_score = difflib.SequenceMatcher(
-            a=item_name,
-            b=track_name_lower,
-        ).ratio()
-        if similar_score >= 0.85:
-            return True
-
-        print(f"False. track name {track_name_lower} dissimilar to item name {item_name}")
-        return False
-
-    def artist_name_filter(_item):
-        artists_names_in_response = [
-            a["name"].lower() for a in _item["artists"]
-        ]
-        artist_in_response = any(
-            [
-                artist in artists_names_in_response
-                for artist in origin_artists
-            ]
-        )
-        if artist_in_response:
-            return True
-        # Fuzzy match now
-        _item_artists = "".join(artists_names_in_response)
-        similar_score = difflib.SequenceMatcher(
-            a=_item_artists.lower(),
-            b=artist_name.lower(),
-        ).ratio()
-        if similar_score >= 0.9:
-            return True
-
-        print(
-            f"Can't find origin artist {origin_artists} in  {artists_names_in_response}"
-        )
-        return False
-
-    def make_duration_filter(_item):
-        _item_duration = _item["duration_ms"]
-        if duration_min <= _item_duration <= duration_max:
-            return True
-        print(
-            f"Item name {_item['name']} duration {_item_duration} is not in bounds ({duration_min}, {duration_max})"
-        )
-        return False
-
-    all_filters = (
-        type_filter,
-        similar_name_filter,
-        artist_name_filter,
-        make_duration_filter,
-    )
-
-    def filter_all(_item):
-        return all(
-            (
-                f(_item)
-                for f
-                in all_filters
-            )
-        )
-
-    return filter_all
-
-
-def artist_name_to_list(artist_names: str):
-    return [
-        name.strip().replace("\\&", "&").lower()
-        for name
-        in AND_REGEX.split(artist_names)
-    ]
@@ -0,0 +1,96 @@
+"""
+Vectorized statistics of track audio features
+
+Features are held in a (tracks, STAT_FEATURES) float array, as loaded by FeatureStore.arrays,
+so an aggregate over the whole library is a handful of NumPy calls instead of a loop over dicts
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Sequence
+
+import numpy as np
+
+STAT_FEATURES = (
+    "tempo",
+    "energy",
+    "danceability",
+    "valence",
+    "key",
+    "loudness",
+    "duration_ms",
+)
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Bin edges of the distribution of every feature; Values out of the edges are counted in the first or last bin
+HISTOGRAM_EDGES = {
+    "tempo": np.arange(40, 221, 10),
+    "energy": np.linspace(0, 1, 11),
+    "danceability": np.linspace(0, 1, 11),
+    "valence": np.linspace(0, 1, 11),
+    "key": np.arange(-0.5, 12, 1),
+    "loudness": np.arange(-30, 1, 3),
+    "duration_ms": np.arange(0, 600001, 30000),
+}
+
+
+@dataclass
+class FeatureSummary:
+    mean: float
+    std: float
+    minimum: float
+    maximum: float
+    # Value of the feature by percentile
+    percentiles: Dict[int, float]
+    # Number of tracks in every bin, and the len(counts) + 1 edges of the bins
+    counts: List[int]
+    edges: List[float]
+
+    @property
+    def median(self) -> float:
+        return self.percentiles[50]
+
+
+def summarize(values: np.ndarray, features: Sequence[str] = STAT_FEATURES) -> Dict[str, FeatureSummary]:
+    """
+    :param values: array of shape (tracks, features), with a column for each of features
+    :return: summary by feature; Empty when there are no tracks
+    """
+    if not len(values):
+        return {}
+    # The nan variants skip the features that the API left out for a track
+    means = np.nanmean(values, axis=0)
+    stds = np.nanstd(values, axis=0)
+    minimums = np.nanmin(values, axis=0)
+    maximums = np.nanmax(values, axis=0)
+    percentiles = np.nanpercentile(values, PERCENTILES, axis=0)
+    summaries = {}
+    for column, feature in enumerate(features):
+        edges = HISTOGRAM_EDGES[feature]
+        known = values[:, column][~np.isnan(values[:, column])]
+        counts, _ = np.histogram(np.clip(known, edges[0], edges[-1]), bins=edges)
+        summaries[feature] = FeatureSummary(
+            mean=float(means[column]),
+            std=float(stds[column]),
+            minimum=float(minimums[column]),
+            maximum=float(maximums[column]),
+            percentiles=dict(zip(PERCENTILES, percentiles[:, column].tolist())),
+            counts=counts.tolist(),
+            edges=edges.tolist(),
+        )
+    return summaries
+
+
+def group_rows(track_ids: Sequence[str], groups: Mapping[str, Sequence[str]]) -> Dict[str, np.ndarray]:
+    """
+    :param track_ids: ids of the rows of the features array
+    :param groups: track ids by group, e.g. by collection name; Tracks without a row are skipped
+    :return: indices of the rows of every group
+    """
+    row_by_id = {track_id: row for row, track_id in enumerate(track_ids)}
+    return {
+        name: np.fromiter(
+            (row_by_id[i] for i in ids if i in row_by_id),
+            dtype=np.intp,
+        )
+        for name, ids in groups.items()
+    }
@@ -0,0 +1,156 @@
+"""
+Local store of the audio features of spotify tracks, so analytics over the library need no network
+
+A SQLite table keyed by the spotify track id, with a column per numeric audio feature.
+Tracks that spotify has no features for are stored without features, so they are not requested again
+"""
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from integrations.spotify.feature_stats import STAT_FEATURES
+from integrations.spotify.models import SpotifyTrack, SpotifyTrackFeatures
+
+DEFAULT_STORE_PATH = Path(os.environ.get(
+    "MUSIKA_SPOTIFY_FEATURES_PATH",
+    Path(__file__).parent.absolute().joinpath("features", "features.sqlite3"),
+))
+
+FEATURE_NAMES = (
+    "danceability",
+    "energy",
+    "key",
+    "loudness",
+    "mode",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+    "duration_ms",
+    "time_signature",
+)
+
+
+class FeatureStore:
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path))
+        # Numeric affinity keeps the integer features, e.g. key and mode, as integers
+        feature_columns = ", ".join(f"{name} NUMERIC" for name in FEATURE_NAMES)
+        self._db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS track_features (
+                spotify_id TEXT PRIMARY KEY,
+                track_name TEXT NOT NULL,
+                track_artists TEXT NOT NULL,
+                version TEXT NOT NULL,
+                has_features INTEGER NOT NULL,
+                {feature_columns}
+            )
+            """
+        )
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM track_features").fetchone()[0]
+
+    def __contains__(self, spotify_id: str):
+        return self._db.execute(
+            "SELECT 1 FROM track_features WHERE spotify_id = ?", (spotify_id,)
+        ).fetchone() is not None
+
+    def missing(self, spotify_ids: Iterable[str]) -> List[str]:
+        """
+        :return: the ids that are not stored, in their order and without repeats
+        """
+        spotify_ids = list(dict.fromkeys(spotify_ids))
+        stored = set()
+        # Bounded by the limit of SQLite variables in a statement
+        for start in range(0, len(spotify_ids), 500):
+            chunk = spotify_ids[start:start + 500]
+            stored.update(
+                row[0] for row in self._db.execute(
+                    f"SELECT spotify_id FROM track_features WHERE spotify_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+        return [i for i in spotify_ids if i not in stored]
+
+    def put_many(self, tracks_features: Iterable[Tuple[SpotifyTrack, Optional[Dict]]]):
+        """
+        Stores in a single transaction
+        :param tracks_features: (track, features from the API) pairs; features are None when spotify has none
+        """
+        def row(track, audio_features):
+            features = audio_features or {}
+            return (
+                track.spotify_id,
+                track.name,
+                json.dumps([a.to_dict() for a in track.artist]),
+                SpotifyTrackFeatures.version,
+                audio_features is not None,
+                *(features.get(name) for name in FEATURE_NAMES),
+            )
+
+        with self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO track_features VALUES ({','.join('?' * (5 + len(FEATURE_NAMES)))})",
+                (row(track, audio_features) for track, audio_features in tracks_features),
+            )
+
+    def arrays(
+            self,
+            spotify_ids: Optional[Iterable[str]] = None,
+            features: Sequence[str] = STAT_FEATURES,
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Loads features into an array for feature_stats
+
+        :param spotify_ids: ids to load; All the stored tracks when None
+        :return: ids of the tracks that have features, and an array of shape (tracks, features) of their values
+        """
+        assert set(features) <= set(FEATURE_NAMES), features
+        select = f"SELECT spotify_id, {', '.join(features)} FROM track_features WHERE has_features"
+        if spotify_ids is None:
+            rows = self._db.execute(select).fetchall()
+        else:
+            spotify_ids = list(dict.fromkeys(spotify_ids))
+            rows = []
+            for start in range(0, len(spotify_ids), 500):
+                chunk = spotify_ids[start:start + 500]
+                rows.extend(self._db.execute(f"{select} AND spotify_id IN ({','.join('?' * len(chunk))})", chunk))
+        if not rows:
+            return [], np.empty((0, len(features)))
+        ids, *columns = zip(*rows)
+        # None, for a feature the API left out, becomes nan
+        return list(ids), np.array(columns, dtype=float).T
+
+    def get(self, spotify_ids: Iterable[str]) -> Dict[str, SpotifyTrackFeatures]:
+        """
+        :return: the stored features by spotify id, for the ids that have features
+        """
+        spotify_ids = list(spotify_ids)
+        columns = ", ".join(FEATURE_NAMES)
+        result = {}
+        for start in range(0, len(spotify_ids), 500):
+            chunk = spotify_ids[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT spotify_id, track_name, track_artists, version, {columns} FROM track_features "
+                f"WHERE has_features AND spotify_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for spotify_id, track_name, track_artists, version, *values in rows:
+                result[spotify_id] = SpotifyTrackFeatures(
+                    spotify_track_id=spotify_id,
+                    track_name=track_name,
+                    track_artists=json.loads(track_artists),
+                    audio_features=dict(zip(FEATURE_NAMES, values)),
+                    version=version,
+                )
+        return result
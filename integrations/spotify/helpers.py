@@ -1,23 +1,63 @@
+import itertools
 from pathlib import Path
-from typing import Iterator, Dict, Optional
+from typing import Iterator, Dict, List, Mapping, NamedTuple, Optional, Tuple
 
+from integrations.spotify import feature_stats
 from integrations.spotify.client import SpotifyClient
-from integrations.spotify.models import SpotifyCollection, SpotifyCollectionStats, SpotifyTrackFeatures
+from integrations.spotify.feature_store import FeatureStore
+from integrations.spotify.models import SpotifyCollection, SpotifyCollectionStats, SpotifyTrack, parse_added_at
+from musik_lib import collections
 
 BASE_PATH = Path(__file__).parent.absolute()
 SPOTIFY_COLLECTIONS_PATH = BASE_PATH.joinpath("collections")
 UNFINISHED_PLAYLIST_PREFIXES = ("ZZZ", "KIDS", "XXX", "0")
 
 
-def get_remote_collections(client: SpotifyClient) -> Iterator[SpotifyCollection]:
-    display_name = client.me().get("display_name")
+class WrittenCollection(NamedTuple):
+    name: str
+    spotify_id: str
+    path: str
+    num_tracks: int
+
+
+def get_remote_playlists(
+        client: SpotifyClient,
+        local_snapshots: Optional[Dict[str, Optional[str]]] = None,
+) -> List[Dict]:
+    """
+    :param local_snapshots: snapshot id by playlist id of the local collections;
+    Playlists whose snapshot did not change are left out
+    :return: the final playlists of the user that changed
+    """
+    local_snapshots = local_snapshots or {}
+    me = client.me()
+    display_name = me.get("display_name")
     if display_name is None:
         raise ValueError(
-            f"display name is None in client_me response {client.me()}"
+            f"display name is None in client_me response {me}"
         )
-    filtered_playlists = (p for p in client.playlists() if is_final_playlist(p, display_name))
-    for playlist in filtered_playlists:
-        playlist_items = list(client.playlist_items(playlist))
+    return [
+        p for p in client.playlists()
+        if is_final_playlist(p, display_name) and not is_unchanged_playlist(p, local_snapshots)
+    ]
+
+
+def get_remote_collections(
+        client: SpotifyClient,
+        local_snapshots: Optional[Dict[str, Optional[str]]] = None,
+) -> Iterator[SpotifyCollection]:
+    """
+    With a client of several workers, the items of all final playlists are fetched concurrently
+
+    :param local_snapshots: snapshot id by playlist id of the local collections;
+    The items of playlists whose snapshot did not change are not fetched and these playlists are not returned
+    """
+    filtered_playlists = get_remote_playlists(client, local_snapshots)
+    if client.workers > 1:
+        playlists_items = client.playlists_items(filtered_playlists)
+    else:
+        playlists_items = ((p, list(client.playlist_items(p))) for p in filtered_playlists)
+    for playlist, playlist_items in playlists_items:
         try:
             yield SpotifyCollection.from_spotify_api(
                 playlist=playlist,
@@ -27,15 +67,113 @@ def get_remote_collections(client: SpotifyClient) -> Iterator[SpotifyCollection]
             print(f"Error {e} in importing playlist : {playlist}")
 
 
-def get_collection_stats(client: SpotifyClient, spotify_collection: SpotifyCollection) -> SpotifyCollectionStats:
-    tracks_features = [
-        SpotifyTrackFeatures.from_spotify_api(
-            audio_features=client.audio_features(t.spotify_id),
-            track=t,
+def write_remote_collections(
+        client: SpotifyClient,
+        local_snapshots: Optional[Dict[str, Optional[str]]] = None,
+        collection_format: Optional[str] = None,
+) -> Iterator[WrittenCollection]:
+    """
+    Streams the changed final playlists into local collection files, page by page
+
+    Every item goes from its page to a track of the file as it arrives, so memory is bounded by the pages
+    that the client fetches ahead, not by the size of the playlists;
+    The files are the ones write_spotify_collection writes
+    :param local_snapshots: as in get_remote_collections
+    """
+    playlists = get_remote_playlists(client, local_snapshots)
+    pages = client.playlists_pages(playlists)
+    for _, playlist_pages in itertools.groupby(pages, key=lambda page: page[0]["id"]):
+        playlist_pages = iter(playlist_pages)
+        playlist, first_items = next(playlist_pages)
+        items = itertools.chain(first_items, (i for _, page_items in playlist_pages for i in page_items))
+        try:
+            yield _write_remote_collection(playlist, items, collection_format)
+        except (KeyError, ValueError) as e:
+            print(f"Error {e} in importing playlist : {playlist}")
+
+
+def _write_remote_collection(
+        playlist: Dict,
+        items: Iterator[Dict],
+        collection_format: Optional[str],
+) -> WrittenCollection:
+    path = collections.spotify_collection_path(playlist["name"], collection_format=collection_format)
+    writer = collections.CollectionFileWriter(path)
+    try:
+        last_added_at = None
+        for item in items:
+            writer.write_track(SpotifyTrack.from_spotify_api(item["track"]).to_dict())
+            last_added_at = max(last_added_at or item["added_at"], item["added_at"])
+        if last_added_at is None:
+            raise ValueError("playlist has no items")
+        header = SpotifyCollection(
+            spotify_id=playlist["id"],
+            name=playlist["name"],
+            created_date=parse_added_at(last_added_at),
+            description=playlist["description"],
+            tracks=(),
+            snapshot_id=playlist.get("snapshot_id"),
         )
-        for t in spotify_collection.tracks
-    ]
-    print(tracks_features)
+        writer.close(header.to_dict())
+    except BaseException:
+        writer.discard()
+        raise
+    return WrittenCollection(playlist["name"], playlist["id"], path, writer.num_tracks)
+
+
+def get_collection_stats(
+        client: SpotifyClient,
+        spotify_collection: SpotifyCollection,
+        store: Optional[FeatureStore] = None,
+) -> SpotifyCollectionStats:
+    """
+    Features of the collection tracks, read from the store; Only tracks that are not stored yet are fetched
+    """
+    if store is None:
+        store = FeatureStore()
+    fetch_tracks_features(client, spotify_collection.tracks, store)
+    _, values = store.arrays(spotify_collection.track_ids)
+    return SpotifyCollectionStats.from_feature_values(values)
+
+
+def get_library_stats(
+        store: FeatureStore,
+        collections_track_ids: Mapping[str, List[str]],
+) -> Tuple[SpotifyCollectionStats, Dict[str, SpotifyCollectionStats]]:
+    """
+    Stats of the stored features, without the network; The features of all the tracks are loaded once
+
+    :param collections_track_ids: spotify track ids by collection name
+    :return: stats of the tracks of all the collections, and stats by collection name
+    """
+    track_ids, values = store.arrays(
+        track_id for ids in collections_track_ids.values() for track_id in ids
+    )
+    rows_by_collection = feature_stats.group_rows(track_ids, collections_track_ids)
+    return (
+        SpotifyCollectionStats.from_feature_values(values),
+        {
+            name: SpotifyCollectionStats.from_feature_values(values[rows])
+            for name, rows in rows_by_collection.items()
+        },
+    )
+
+
+def fetch_tracks_features(client: SpotifyClient, tracks: List[SpotifyTrack], store: FeatureStore) -> int:
+    """
+    Fetches the audio features of the tracks that are not in the store yet, in batches, and stores them
+
+    :return: the number of fetched tracks
+    """
+    tracks_by_id = {t.spotify_id: t for t in tracks}
+    missing_ids = store.missing(tracks_by_id.keys())
+    if not missing_ids:
+        return 0
+    features = client.audio_features_batch(missing_ids)
+    store.put_many(
+        (tracks_by_id[track_id], features.get(track_id)) for track_id in missing_ids
+    )
+    return len(missing_ids)
 
 
 def is_final_playlist(playlist: Dict, user_name: Optional[str] = None) -> bool:
@@ -56,6 +194,15 @@ def is_final_playlist(playlist: Dict, user_name: Optional[str] = None) -> bool:
     return True
 
 
+def is_unchanged_playlist(playlist: Dict, local_snapshots: Dict[str, Optional[str]]) -> bool:
+    """
+    Returns True if the local collection of the playlist has its current snapshot;
+    Collections written before snapshots were kept have none, so they are always changed
+    """
+    snapshot_id = local_snapshots.get(playlist["id"])
+    return snapshot_id is not None and snapshot_id == playlist.get("snapshot_id")
+
+
 def _is_not_me_playlist(user_name: str, playlist_user: str) -> bool:
     return playlist_user != user_name
 
@@ -0,0 +1,235 @@
+"""
+On disk cache of spotify API responses, for requests.Session so that it sits under the spotipy client
+
+Responses of GET requests are kept in a SQLite file by their url and params, for a TTL by the class of the endpoint.
+A stale response is revalidated with its ETag or Last-Modified, when the API gave one,
+and the least recently used responses are evicted once the cache is bigger than its bound.
+Any other request method changes the library, so it drops the cached responses of the endpoints that can change
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3 import Retry
+
+DEFAULT_CACHE_PATH = Path(os.environ.get(
+    "MUSIKA_SPOTIFY_CACHE_PATH",
+    Path(__file__).parent.absolute().joinpath("cache", "responses.sqlite3"),
+))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+MINUTE = 60
+DAY = 24 * 60 * MINUTE
+
+# (path regex, TTL in seconds, immutable); First match wins.
+# Immutable endpoints describe tracks, which do not change, so their responses survive writes to the library
+ENDPOINT_TTLS = (
+    (re.compile(r"/audio-features"), 90 * DAY, True),
+    (re.compile(r"/search$"), 7 * DAY, True),
+    (re.compile(r"/tracks/[^/]+$"), 90 * DAY, True),
+    (re.compile(r"/me/?$"), DAY, False),
+    (re.compile(r"/playlists/[^/]+/(tracks|items)$"), 60 * MINUTE, False),
+    (re.compile(r"/playlists"), 10 * MINUTE, False),
+    (re.compile(r"/me/tracks"), 10 * MINUTE, False),
+)
+DEFAULT_TTL = (5 * MINUTE, False)
+
+
+def endpoint_ttl(path: str) -> Tuple[int, bool]:
+    """
+    :return: TTL in seconds and whether the endpoint is immutable
+    """
+    for pattern, ttl, immutable in ENDPOINT_TTLS:
+        if pattern.search(path):
+            return ttl, immutable
+    return DEFAULT_TTL
+
+
+def mount_retries(session: requests.Session) -> requests.Session:
+    """
+    Mounts the same retries as spotipy builds for its own session, except for rate limited responses,
+    which SpotifyClient.call waits for, so that a rate limited request is retried by a single loop
+    :return: the session
+    """
+    adapter = HTTPAdapter(max_retries=Retry(
+        total=3,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        # Otherwise a 429 with a Retry-After header is retried whatever the status_forcelist
+        respect_retry_after_header=False,
+    ))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CachedSession(requests.Session):
+    """
+    requests.Session with the cache described in the module docs.
+
+    In offline mode every cached response is served regardless of its TTL and a missing one raises ConnectionError,
+    so recorded responses can be replayed without the network
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        mount_retries(self)
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                immutable INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+            """
+        )
+        # Running total of the bodies, so that a put does not sum the whole table to know whether to evict
+        self._size = self.size()
+
+    def request(self, method, url, params=None, **kwargs):
+        if method.upper() != "GET":
+            response = super().request(method, url, params=params, **kwargs)
+            if response.ok:
+                self.invalidate_mutable()
+            return response
+
+        key = self._key(url, params)
+        cached = self._get(key)
+        if cached is not None and (self.offline or cached["expires_at"] > time.time()):
+            self.hits += 1
+            self._touch(key)
+            return self._response(cached, url)
+        if self.offline:
+            raise requests.ConnectionError(f"No cached response for {key} in offline mode")
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not None:
+            if etag := cached["headers"].get("ETag"):
+                headers["If-None-Match"] = etag
+            if last_modified := cached["headers"].get("Last-Modified"):
+                headers["If-Modified-Since"] = last_modified
+        response = super().request(method, url, params=params, headers=headers, **kwargs)
+
+        ttl, immutable = endpoint_ttl(urlparse(url).path)
+        if response.status_code == 304 and cached is not None:
+            self.revalidated += 1
+            self._refresh(key, time.time() + ttl)
+            return self._response(cached, url)
+
+        self.misses += 1
+        if response.status_code == 200:
+            self._put(key, response, time.time() + ttl, immutable)
+        return response
+
+    def invalidate_mutable(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses WHERE immutable = 0")
+            self._size = self._sum_sizes()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._sum_sizes()
+
+    def _sum_sizes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _key(url: str, params) -> str:
+        """
+        The url with its query and params, sorted so that the same request has the same key
+        """
+        parsed = urlparse(url)
+        query = sorted(
+            [tuple(p.split("=", 1)) for p in parsed.query.split("&") if p]
+            + [(k, str(v)) for k, v in (params or {}).items() if v is not None]
+        )
+        return f"{parsed.netloc}{parsed.path}?{urlencode(query)}"
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, expires_at = row
+        return {"status": status, "headers": json.loads(headers), "body": body, "expires_at": expires_at}
+
+    def _touch(self, key: str):
+        with self._lock, self._db:
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+
+    def _refresh(self, key: str, expires_at: float):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE responses SET expires_at = ?, last_used = ? WHERE key = ?", (expires_at, time.time(), key)
+            )
+
+    def _put(self, key: str, response: requests.Response, expires_at: float, immutable: bool):
+        headers = {
+            name: response.headers[name]
+            for name in ("Content-Type", "ETag", "Last-Modified")
+            if name in response.headers
+        }
+        with self._lock, self._db:
+            replaced = self._db.execute("SELECT LENGTH(body) FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, response.status_code, json.dumps(headers), response.content, expires_at, time.time(), immutable),
+            )
+            self._size += len(response.content) - (replaced[0] if replaced else 0)
+            self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used responses until the cache fits in max_bytes; Call with the lock held.
+        Other sessions on the same file do not add to the running total, so it is summed again before evicting
+        """
+        if self._size <= self.max_bytes:
+            return
+        total = self._sum_sizes()
+        to_delete = []
+        for key, size in self._db.execute("SELECT key, LENGTH(body) FROM responses ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+        self._size = total
+
+    @staticmethod
+    def _response(cached: dict, url: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = cached["status"]
+        response.headers = CaseInsensitiveDict(cached["headers"])
+        response._content = cached["body"]
+        response.encoding = "utf-8"
+        response.url = url
+        return response
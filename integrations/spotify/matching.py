@@ -0,0 +1,174 @@
+"""
+Matching of a track of a manual collection to the items of a spotify search
+
+Cheap prefilters run first, so that most items are rejected without any string similarity:
+the item type, the duration window and a shared word in the track or artist names.
+The items that survive are scored by the similarity of their name, artists and duration,
+and the best scored item that passes the thresholds is the match, no matter its place in the search results.
+Similarities are difflib ratios, with the thresholds that the search filtered by before the ranking
+"""
+import difflib
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from musik_lib.artists import PARSE_CACHE_SIZE, parse_artists
+
+# Suffixes that spotify adds to names of re-releases, e.g. "Song - Remastered 2009" or "Song (2011 Remaster)"
+RELEASE_SUFFIX_REGEX = re.compile(r"\s+-\s+[^-]*remaster.*$|\s*[(\[][^)\]]*remaster[^)\]]*[)\]]", re.IGNORECASE)
+NON_WORD_REGEX = re.compile(r"[^\w\s]+")
+
+DURATION_TOLERANCE = 0.1
+NAME_THRESHOLD = 0.85
+ARTIST_THRESHOLD = 0.9
+# Weights of the name, artist and duration scores in the score of a candidate
+WEIGHTS = (0.5, 0.3, 0.2)
+
+
+def duration_to_ms(duration: str) -> int:
+    """
+    :param duration: as in the manual collections, [hours:]minutes:seconds
+    """
+    duration_parts = duration.split(":")
+    len_duration = len(duration_parts)
+    if len_duration == 3:
+        hours, minutes, seconds = duration_parts
+    elif len_duration == 2:
+        hours, minutes, seconds = ['0'] + duration_parts
+    else:
+        raise ValueError(f"Failed to parse duration -> {duration}")
+
+    return (
+            int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    ) * 1000
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def normalize(name: str) -> str:
+    """
+    Lower case name without release suffixes, punctuation and repeated spaces;
+    Memoized, as the same artist names come up in many search results
+    """
+    name = RELEASE_SUFFIX_REGEX.sub("", name)
+    return " ".join(NON_WORD_REGEX.sub(" ", name.lower()).split())
+
+
+def similarity(a: str, b: str, threshold: float = 0.0) -> float:
+    """
+    difflib ratio of a and b; The cheap upper bounds of the ratio come first,
+    and when one is under threshold it is returned instead of the ratio, which the threshold rejects anyway
+    """
+    if a == b:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for ratio in (matcher.real_quick_ratio, matcher.quick_ratio):
+        bound = ratio()
+        if bound < threshold:
+            return bound
+    return matcher.ratio()
+
+
+@dataclass
+class Candidate:
+    item: Dict
+    score: float
+    name_score: float
+    artist_score: float
+    duration_score: float
+
+    def explain(self) -> str:
+        return (
+            f"{self.item['name']} ({self.score:.2f}: name {self.name_score:.2f}, "
+            f"artist {self.artist_score:.2f}, duration {self.duration_score:.2f})"
+        )
+
+
+@dataclass
+class MatchResult:
+    """
+    Candidates that pass the thresholds ranked by score, and the reasons that the other items were rejected
+    """
+    candidates: List[Candidate] = field(default_factory=list)
+    rejected: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def best(self) -> Optional[Candidate]:
+        return self.candidates[0] if self.candidates else None
+
+    def explain(self) -> str:
+        return "\n".join(
+            [f"Candidate {c.explain()}" for c in self.candidates]
+            + [f"Rejected {name}: {reason}" for name, reason in self.rejected]
+        )
+
+
+class TrackMatcher:
+
+    def __init__(self, track_name: str, artist_name: str, duration: str):
+        self.name = normalize(track_name)
+        self.artist_name = normalize(artist_name)
+        self.artists = [normalize(a) for a in parse_artists(artist_name).all]
+        self.duration_ms = duration_to_ms(duration)
+        self.duration_min = self.duration_ms * (1 - DURATION_TOLERANCE)
+        self.duration_max = self.duration_ms * (1 + DURATION_TOLERANCE)
+        self.words = frozenset(self.name.split()) | frozenset(self.artist_name.split())
+
+    def match(self, items: Iterable[Dict]) -> MatchResult:
+        result = MatchResult()
+        seen = set()
+        for item in items:
+            if item.get("id") in seen:
+                continue
+            seen.add(item.get("id"))
+            reason = self.prefilter(item)
+            if reason is None:
+                candidate = self.score(item)
+                reason = self.threshold(candidate)
+                if reason is None:
+                    result.candidates.append(candidate)
+                    continue
+            result.rejected.append((item.get("name"), reason))
+        result.candidates.sort(key=lambda c: c.score, reverse=True)
+        return result
+
+    def prefilter(self, item: Dict) -> Optional[str]:
+        """
+        :return: why the item cannot match, by checks that cost no string similarity; None when it can
+        """
+        if item.get("type") != "track":
+            return f"type {item.get('type')}"
+        if not self.duration_min <= item["duration_ms"] <= self.duration_max:
+            return f"duration {item['duration_ms']} out of ({self.duration_min:.0f}, {self.duration_max:.0f})"
+        item_words = set(normalize(item["name"]).split())
+        for artist in item["artists"]:
+            item_words.update(normalize(artist["name"]).split())
+        if not self.words & item_words:
+            return "no shared word in track or artist names"
+        return None
+
+    def score(self, item: Dict) -> Candidate:
+        item_artists = [normalize(a["name"]) for a in item["artists"]]
+        name_score = similarity(normalize(item["name"]), self.name, NAME_THRESHOLD)
+        if any(artist in item_artists for artist in self.artists):
+            artist_score = 1.0
+        else:
+            artist_score = similarity(" ".join(item_artists), self.artist_name, ARTIST_THRESHOLD)
+        tolerance_ms = max(self.duration_ms * DURATION_TOLERANCE, 1)
+        duration_score = 1 - abs(item["duration_ms"] - self.duration_ms) / tolerance_ms
+        name_weight, artist_weight, duration_weight = WEIGHTS
+        return Candidate(
+            item=item,
+            score=name_weight * name_score + artist_weight * artist_score + duration_weight * duration_score,
+            name_score=name_score,
+            artist_score=artist_score,
+            duration_score=duration_score,
+        )
+
+    @staticmethod
+    def threshold(candidate: Candidate) -> Optional[str]:
+        if candidate.name_score < NAME_THRESHOLD:
+            return f"name score {candidate.name_score:.2f}"
+        if candidate.artist_score < ARTIST_THRESHOLD:
+            return f"artist score {candidate.artist_score:.2f}"
+        return None
@@ -7,25 +7,119 @@ SPOTIPY_CLIENT_ID;
 SPOTIPY_CLIENT_SECRET;
 SPOTIPY_REDIRECT_URI=https://localhost:8080/callback
 """
+import dataclasses
+import weakref
 from datetime import date, datetime
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from typing import List, Dict
+from typing import ClassVar, List, Dict, Optional, Tuple
 
+import numpy as np
 
-@dataclass
+from integrations.spotify.feature_stats import FeatureSummary, summarize
+
+
+def _interned(cls, key: Optional[str], make):
+    """
+    :return: the instance of cls with the key that is alive, or the one that make creates;
+    Instances without a key are never shared
+    """
+    if key is None:
+        return make()
+    instance = cls._interned.get(key)
+    if instance is None:
+        instance = cls._interned.setdefault(key, make())
+    return instance
+
+
+class _WeakReferable:
+    """
+    Base of the interned slotted dataclasses, so they can be values of a WeakValueDictionary;
+    dataclass only has weakref_slot from python 3.11
+    """
+    __slots__ = ("__weakref__",)
+
+
+@dataclass(frozen=True, slots=True)
+class SpotifyArtist(_WeakReferable):
+    """
+    Represent an artist of tracks from the spotify API
+    An artist is shared by id across the tracks that refer to it, while any of them is alive
+    """
+    _interned: ClassVar[weakref.WeakValueDictionary] = weakref.WeakValueDictionary()
+
+    external_urls: Optional[Dict] = field(default=None, compare=False)
+    href: Optional[str] = None
+    id: Optional[str] = None
+    name: Optional[str] = None
+    type: Optional[str] = None
+    uri: Optional[str] = None
+
+    @classmethod
+    def from_spotify_api(cls, data: Dict):
+        """
+        The API artists and the artists of the collection files have the same keys
+        """
+        return _interned(cls, data.get("id"), lambda: cls(
+            external_urls=data.get("external_urls"),
+            href=data.get("href"),
+            id=data.get("id"),
+            name=data.get("name"),
+            type=data.get("type"),
+            uri=data.get("uri"),
+        ))
+
+    def to_dict(self) -> Dict:
+        return dataclasses.asdict(self)
+
+
+@dataclass(frozen=True, slots=True)
+class SpotifyAlbum(_WeakReferable):
+    """
+    Represent the album of a track from the spotify API, shared by id as artists are
+    """
+    _interned: ClassVar[weakref.WeakValueDictionary] = weakref.WeakValueDictionary()
+
+    album_name: str
+    album_group: Optional[str]
+    album_type: str
+    released: str
+    spotify_id: str
+
+    @classmethod
+    def from_spotify_api(cls, data: Dict):
+        return _interned(cls, data["id"], lambda: cls(
+            album_name=data["name"],
+            album_group=data.get("album_group"),
+            album_type=data["album_type"],
+            released=data["release_date"],
+            spotify_id=data["id"],
+        ))
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        """
+        From the album of a track of a local collection file
+        """
+        return _interned(cls, data["spotify_id"], lambda: cls(**data))
+
+    def to_dict(self) -> Dict:
+        return dataclasses.asdict(self)
+
+
+@dataclass(frozen=True, slots=True)
 class SpotifyTrack:
     """
     Represent a track from the spotify API
-    has a list of artists and an Album that we keep as a Dict for now
+    has a tuple of artists and an album, shared with the other tracks of the same artists and album
     """
     name: str
     spotify_id: str
     duration_ms: int
-    artist: List[Dict]
+    artist: Tuple[SpotifyArtist, ...]
     uri: str
-    album: Dict
+    album: SpotifyAlbum
 
     @classmethod
     def from_spotify_api(cls, data: Dict):
@@ -33,29 +127,52 @@ class SpotifyTrack:
             name=data["name"],
             spotify_id=data["id"],
             duration_ms=data["duration_ms"],
-            artist=data["artists"],
+            artist=tuple(SpotifyArtist.from_spotify_api(a) for a in data["artists"]),
             uri=data["uri"],
-            album={
-                "album_name": data["album"]["name"],
-                "album_group": data["album"].get("album_group"),
-                "album_type": data["album"]["album_type"],
-                "released": data["album"]["release_date"],
-                "spotify_id": data["album"]["id"],
-            },
+            album=SpotifyAlbum.from_spotify_api(data["album"]),
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        """
+        From a track of a local collection file; Older files have no uri
+        """
+        return cls(
+            name=data["name"],
+            spotify_id=data["spotify_id"],
+            duration_ms=data["duration_ms"],
+            artist=tuple(SpotifyArtist.from_spotify_api(a) for a in data["artist"]),
+            uri=data.get("uri") or f"spotify:track:{data['spotify_id']}",
+            album=SpotifyAlbum.from_dict(data["album"]),
         )
 
+    def to_dict(self) -> Dict:
+        """
+        As a track of a collection file, the dict that dataclasses.asdict gave when artists were a list of dicts
+        """
+        return {
+            "name": self.name,
+            "spotify_id": self.spotify_id,
+            "duration_ms": self.duration_ms,
+            "artist": [a.to_dict() for a in self.artist],
+            "uri": self.uri,
+            "album": self.album.to_dict(),
+        }
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class SpotifyCollection:
     """
     Represent a collection from the spotify API
-    has a list of Spotify tracks
+    has a tuple of Spotify tracks
     """
     name: str
     spotify_id: str
     created_date: date | None
     description: str | None
-    tracks: List[SpotifyTrack]
+    tracks: Tuple[SpotifyTrack, ...]
+    # Version of the playlist on spotify, changes on every edit of the playlist
+    snapshot_id: str | None = None
 
     @classmethod
     def from_spotify_api(cls, playlist: Dict, playlist_items: List):
@@ -64,12 +181,41 @@ class SpotifyCollection:
             name=playlist["name"],
             created_date=get_created_at_date(playlist_items),
             description=playlist["description"],
-            tracks=[
+            tracks=tuple(
                 SpotifyTrack.from_spotify_api(pi["track"])
                 for pi in playlist_items
-            ],
+            ),
+            snapshot_id=playlist.get("snapshot_id"),
         )
 
+    @classmethod
+    def from_dict(cls, data: Dict):
+        """
+        From the content of a local collection file
+        """
+        created_date = data.get("created_date")
+        return cls(
+            name=data["name"],
+            spotify_id=data["spotify_id"],
+            created_date=date.fromisoformat(created_date) if created_date else None,
+            description=data.get("description"),
+            tracks=tuple(SpotifyTrack.from_dict(t) for t in data["tracks"]),
+            snapshot_id=data.get("snapshot_id"),
+        )
+
+    def to_dict(self) -> Dict:
+        """
+        As the content of a collection file
+        """
+        return {
+            "name": self.name,
+            "spotify_id": self.spotify_id,
+            "created_date": self.created_date,
+            "description": self.description,
+            "tracks": [t.to_dict() for t in self.tracks],
+            "snapshot_id": self.snapshot_id,
+        }
+
     @property
     def track_ids(self) -> List[str]:
         """
@@ -94,16 +240,28 @@ class SpotifyTrackFeatures:
         return cls(
             spotify_track_id=track.spotify_id,
             track_name=track.name,
-            track_artists=track.artist,
+            track_artists=[a.to_dict() for a in track.artist],
             audio_features=audio_features,
         )
 
 
 @dataclass
 class SpotifyCollectionStats:
+    """
+    Aggregates of the audio features of a collection, or of the library
+    """
+    num_tracks: int = 0
+    features: Dict[str, FeatureSummary] = field(default_factory=dict)
+
     @classmethod
-    def from_spotify_api(cls, audio_features: Dict):
-        return cls()
+    def from_feature_values(cls, values: np.ndarray):
+        """
+        :param values: array of shape (tracks, STAT_FEATURES), as FeatureStore.arrays loads it
+        """
+        return cls(
+            num_tracks=len(values),
+            features=summarize(values),
+        )
 
 
 def get_created_at_date(items):
@@ -112,4 +270,11 @@ def get_created_at_date(items):
             i["added_at"] for i in items
         ]
     )
-    return datetime.strptime(max_date, "%Y-%m-%dT%H:%M:%SZ").date()
+    return parse_added_at(max_date)
+
+
+def parse_added_at(added_at: str) -> date:
+    """
+    :param added_at: as the API gives it, an ISO date time that orders as a string
+    """
+    return datetime.strptime(added_at, "%Y-%m-%dT%H:%M:%SZ").date()
@@ -0,0 +1,148 @@
+"""
+Resolution of the tracks of manual collections to spotify tracks, for converting them to spotify playlists
+
+Searches run concurrently, and every result is kept on disk by the track (name, artist, duration),
+so a track is searched once across runs. A track without a match is recorded with the reason for review,
+instead of aborting its collection, and a collection whose playlist was written is checkpointed by its content
+"""
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from integrations.spotify.client import SpotifyClient
+
+DEFAULT_RESOLUTIONS_PATH = Path(os.environ.get(
+    "MUSIKA_SPOTIFY_RESOLUTIONS_PATH",
+    Path(__file__).parent.absolute().joinpath("resolutions", "resolutions.sqlite3"),
+))
+
+TrackKey = Tuple[str, str, str]
+
+
+def track_key(track: Dict) -> TrackKey:
+    """
+    :param track: track of a manual collection
+    """
+    return track["name"], track["artist"], track["duration"]
+
+
+@dataclass
+class Resolution:
+    """
+    URIs of the tracks of a collection in their order, None for the unresolved ones,
+    and the reasons that the unresolved tracks did not match
+    """
+    uris: List[Optional[str]] = field(default_factory=list)
+    unresolved: Dict[TrackKey, str] = field(default_factory=dict)
+
+    @property
+    def is_complete(self) -> bool:
+        return not self.unresolved
+
+
+class ResolutionStore:
+
+    def __init__(self, path=DEFAULT_RESOLUTIONS_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path))
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS resolutions (
+                name TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                duration TEXT NOT NULL,
+                uri TEXT,
+                reason TEXT,
+                PRIMARY KEY (name, artist, duration)
+            );
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                collection TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL
+            );
+            """
+        )
+
+    def get(self, key: TrackKey) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """
+        :return: uri and reason of a searched track, one of them is None; None when the track was not searched
+        """
+        return self._db.execute(
+            "SELECT uri, reason FROM resolutions WHERE name = ? AND artist = ? AND duration = ?", key
+        ).fetchone()
+
+    def put(self, key: TrackKey, uri: Optional[str], reason: Optional[str] = None):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?)", (*key, uri, reason))
+
+    def unresolved(self) -> List[Tuple[TrackKey, str]]:
+        """
+        :return: the searched tracks that did not match, with the reason, for review
+        """
+        return [
+            ((name, artist, duration), reason)
+            for name, artist, duration, reason in self._db.execute(
+                "SELECT name, artist, duration, reason FROM resolutions WHERE uri IS NULL ORDER BY name"
+            )
+        ]
+
+    def is_done(self, collection_name: str, fingerprint: str) -> bool:
+        return self._db.execute(
+            "SELECT 1 FROM checkpoints WHERE collection = ? AND fingerprint = ?", (collection_name, fingerprint)
+        ).fetchone() is not None
+
+    def mark_done(self, collection_name: str, fingerprint: str):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?)", (collection_name, fingerprint))
+
+
+def resolve_tracks(
+        client: SpotifyClient,
+        tracks: List[Dict],
+        store: ResolutionStore,
+        workers: int = 1,
+        retry_unresolved: bool = False,
+) -> Resolution:
+    """
+    Searches the tracks that the store has no result for, by a pool of workers threads
+
+    Results are stored as they complete, so an interrupted run keeps the searches it did.
+    Errors other than no match, e.g. of the network, are reported as unresolved but not stored, so a rerun retries them
+    :param retry_unresolved: when true, tracks stored without a match are searched again
+    """
+    keys = [track_key(t) for t in tracks]
+    known = {}
+    to_search = []
+    for key in dict.fromkeys(keys):
+        stored = store.get(key)
+        if stored is None or (retry_unresolved and stored[0] is None):
+            to_search.append(key)
+        else:
+            known[key] = stored
+
+    def search(key: TrackKey):
+        name, artist, duration = key
+        return client.search_track(name, artist, duration).uri
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(search, key): key for key in to_search}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                known[key] = (future.result(), None)
+            except ValueError as e:
+                known[key] = (None, str(e))
+            except Exception as e:
+                known[key] = (None, f"Search failed: {e!r}")
+                continue
+            store.put(key, *known[key])
+
+    resolution = Resolution()
+    for key in keys:
+        uri, reason = known[key]
+        resolution.uris.append(uri)
+        if uri is None:
+            resolution.unresolved[key] = reason
+    return resolution
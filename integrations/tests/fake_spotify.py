@@ -0,0 +1,218 @@
+"""
+A fake Spotify web API served over local HTTP, for testing the spotify client without the remote service
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import requests
+import spotipy
+
+from integrations.spotify.client import SpotifyClient
+
+
+def make_track(track_id: str, name: str = None, duration_ms: int = 200000) -> Dict:
+    return {
+        "id": track_id,
+        "name": name or f"Track {track_id}",
+        "duration_ms": duration_ms,
+        "type": "track",
+        "uri": f"spotify:track:{track_id}",
+        "artists": [{"id": f"artist-{track_id}", "name": f"Artist {track_id}"}],
+        "album": {
+            "id": f"album-{track_id}",
+            "name": f"Album {track_id}",
+            "album_type": "album",
+            "release_date": "2020-01-01",
+        },
+    }
+
+
+def make_audio_features(track_id: str) -> Dict:
+    return {
+        "id": track_id,
+        "danceability": 0.5,
+        "energy": 0.75,
+        "key": 5,
+        "loudness": -6.25,
+        "mode": 1,
+        "speechiness": 0.05,
+        "acousticness": 0.125,
+        "instrumentalness": 0.0,
+        "liveness": 0.25,
+        "valence": 0.625,
+        "tempo": 120.5,
+        "duration_ms": 200000,
+        "time_signature": 4,
+    }
+
+
+def make_playlist(
+        playlist_id: str,
+        num_tracks: int,
+        owner: str = "me",
+        name: str = None,
+        snapshot_id: str = "snapshot-1",
+) -> Dict:
+    """
+    :return: a playlist with its items under "items", which the fake serves as the playlist tracks
+    """
+    return {
+        "id": playlist_id,
+        "name": name or f"Playlist {playlist_id}",
+        "description": f"Description {playlist_id}",
+        "owner": {"display_name": owner},
+        "snapshot_id": snapshot_id,
+        "tracks": {"total": num_tracks},
+        "items": [
+            {"added_at": "2021-06-12T10:00:00Z", "track": make_track(f"{playlist_id}t{i}")}
+            for i in range(num_tracks)
+        ],
+    }
+
+
+class FakeSpotify:
+    """
+    Serves /me, the user playlists, the playlist tracks from the playlists it was made with,
+    and audio features for the tracks of the playlists; other track ids have no features.
+    A search returns the search items the fake was made with, in their order, whatever the query.
+
+    Records every request path, can answer the next requests with 429 and a Retry-After header,
+    and can delay every response to show concurrency in max_in_flight.
+    Responses have an ETag, and a request with a matching If-None-Match is answered with 304
+    """
+
+    def __init__(self, playlists: List[Dict], display_name: str = "me", delay: float = 0.0, search_items=()):
+        self.playlists = playlists
+        self.search_items = list(search_items)
+        self.display_name = display_name
+        self.delay = delay
+        self.requests: List[str] = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._rate_limited = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.01,), daemon=True)
+
+    @property
+    def prefix(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def client(self, limit=2, workers=1, session: requests.Session = None) -> SpotifyClient:
+        # A plain session, so that rate limited responses reach the client instead of the retries of spotipy
+        spotify = spotipy.Spotify(auth="fake-token", requests_session=session or requests.Session())
+        spotify.prefix = self.prefix
+        return SpotifyClient(client=spotify, limit=limit, workers=workers)
+
+    def rate_limit(self, num_requests: int):
+        """
+        Answers the next num_requests requests with 429
+        """
+        self._rate_limited = num_requests
+
+    def requests_to(self, path: str) -> List[str]:
+        return [r for r in self.requests if urlparse(r).path.rstrip("/") == path.rstrip("/")]
+
+    def _page(self, path: str, items: List, query: Dict) -> Dict:
+        limit = int(query.get("limit", ["20"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        next_offset = offset + limit
+        return {
+            "items": items[offset:next_offset],
+            "total": len(items),
+            "limit": limit,
+            "offset": offset,
+            "next": f"{self.prefix}{path}?limit={limit}&offset={next_offset}" if next_offset < len(items) else None,
+        }
+
+    def _respond(self, path: str, query: Dict):
+        """
+        :return: status, headers and body of the response to a GET of path
+        """
+        with self._lock:
+            if self._rate_limited:
+                self._rate_limited -= 1
+                return 429, {"Retry-After": "0"}, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+
+        parts = path.strip("/").split("/")[1:]
+        if parts == ["me"]:
+            return 200, {}, {"id": "me-id", "display_name": self.display_name}
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "playlists":
+            playlists = [{k: v for k, v in p.items() if k != "items"} for p in self.playlists]
+            return 200, {}, self._page("/".join(parts), playlists, query)
+        # Newer spotipy versions call the tracks of a playlist its items
+        if len(parts) == 3 and parts[0] == "playlists" and parts[2] in ("tracks", "items"):
+            playlist = next((p for p in self.playlists if p["id"] == parts[1]), None)
+            if playlist is not None:
+                return 200, {}, self._page("/".join(parts), playlist["items"], query)
+        if parts == ["search"]:
+            return 200, {}, {"tracks": self._page("search", self.search_items, query)}
+        if parts == ["audio-features"]:
+            track_ids = {i["track"]["id"] for p in self.playlists for i in p["items"]}
+            return 200, {}, {
+                "audio_features": [
+                    make_audio_features(track_id) if track_id in track_ids else None
+                    for track_id in query["ids"][0].split(",")
+                ]
+            }
+        return 404, {}, {"error": {"status": 404, "message": "Not found"}}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests.append(self.path)
+                    fake._in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake._in_flight)
+                try:
+                    time.sleep(fake.delay)
+                    url = urlparse(self.path)
+                    status, headers, body = fake._respond(url.path, parse_qs(url.query))
+                finally:
+                    with fake._lock:
+                        fake._in_flight -= 1
+
+                content = json.dumps(body).encode()
+                etag = f'"{hashlib.sha1(content).hexdigest()}"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    status, content = 304, b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.send_header("ETag", etag)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_DELETE(self):
+                with fake._lock:
+                    fake.requests.append(f"DELETE {self.path}")
+                content = b"{}"
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
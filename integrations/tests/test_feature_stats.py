@@ -0,0 +1,100 @@
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from integrations.spotify import feature_stats, helpers
+from integrations.spotify.feature_store import FeatureStore
+from integrations.spotify.models import SpotifyCollection, SpotifyCollectionStats
+from integrations.tests.fake_spotify import make_audio_features, make_playlist
+
+
+class SummarizeTest(SimpleTestCase):
+
+    def test_aggregates_of_every_feature(self):
+        values = np.array([
+            [100.0, 0.2, 0.5, 0.1, 0, -10.0, 180000],
+            [120.0, 0.4, 0.5, 0.3, 2, -8.0, 200000],
+            [140.0, 0.6, 0.5, 0.5, 4, -6.0, 220000],
+        ])
+
+        summaries = feature_stats.summarize(values)
+
+        self.assertEqual(list(feature_stats.STAT_FEATURES), list(summaries))
+        tempo = summaries["tempo"]
+        self.assertEqual(120.0, tempo.mean)
+        self.assertEqual(120.0, tempo.median)
+        self.assertEqual((100.0, 140.0), (tempo.minimum, tempo.maximum))
+        self.assertAlmostEqual(np.std([100, 120, 140]), tempo.std)
+        self.assertEqual(104.0, tempo.percentiles[10])
+        self.assertEqual(3, sum(tempo.counts))
+        self.assertEqual(len(tempo.edges) - 1, len(tempo.counts))
+
+    def test_key_distribution_is_by_pitch_class(self):
+        values = np.zeros((4, len(feature_stats.STAT_FEATURES)))
+        values[:, feature_stats.STAT_FEATURES.index("key")] = [0, 0, 5, 11]
+
+        counts = feature_stats.summarize(values)["key"].counts
+
+        self.assertEqual([2, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1], counts)
+
+    def test_out_of_range_values_are_counted_in_edge_bins(self):
+        values = np.zeros((2, len(feature_stats.STAT_FEATURES)))
+        values[:, feature_stats.STAT_FEATURES.index("tempo")] = [10, 300]
+
+        counts = feature_stats.summarize(values)["tempo"].counts
+
+        self.assertEqual((1, 1, 2), (counts[0], counts[-1], sum(counts)))
+
+    def test_missing_values_are_skipped(self):
+        values = np.array([[100.0] * 7, [np.nan] * 7, [200.0] * 7])
+
+        tempo = feature_stats.summarize(values)["tempo"]
+
+        self.assertEqual(150.0, tempo.mean)
+        self.assertEqual(2, sum(tempo.counts))
+
+    def test_no_tracks(self):
+        stats = SpotifyCollectionStats.from_feature_values(np.empty((0, len(feature_stats.STAT_FEATURES))))
+
+        self.assertEqual(0, stats.num_tracks)
+        self.assertEqual({}, stats.features)
+
+    def test_library_of_10k_tracks_takes_milliseconds(self):
+        values = np.random.default_rng(0).random((10000, len(feature_stats.STAT_FEATURES)))
+
+        start = time.perf_counter()
+        feature_stats.summarize(values)
+
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+
+class LibraryStatsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = FeatureStore(Path(self.tmp_dir.name).joinpath("features.sqlite3"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_library_and_collection_stats(self):
+        p1, p2 = make_playlist("p1", num_tracks=3), make_playlist("p2", num_tracks=2)
+        collections = [SpotifyCollection.from_spotify_api(p, p["items"]) for p in (p1, p2)]
+        for collection in collections:
+            self.store.put_many([(t, make_audio_features(t.spotify_id)) for t in collection.tracks])
+
+        library, by_collection = helpers.get_library_stats(
+            self.store,
+            {
+                "first": collections[0].track_ids,
+                "second": collections[1].track_ids + collections[0].track_ids[:1],
+                "unknown": ["unknown"],
+            },
+        )
+
+        self.assertEqual(5, library.num_tracks)
+        self.assertEqual(120.5, library.features["tempo"].mean)
+        self.assertEqual({"first": 3, "second": 3, "unknown": 0}, {n: s.num_tracks for n, s in by_collection.items()})
@@ -0,0 +1,88 @@
+import dataclasses
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from integrations.spotify import helpers
+from integrations.spotify.feature_stats import STAT_FEATURES
+from integrations.spotify.feature_store import FEATURE_NAMES, FeatureStore
+from integrations.spotify.models import SpotifyCollection, SpotifyTrack
+from integrations.tests.fake_spotify import FakeSpotify, make_audio_features, make_playlist
+
+
+class FeatureStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = FeatureStore(Path(self.tmp_dir.name).joinpath("features.sqlite3"))
+        self.playlist = make_playlist("p1", num_tracks=250)
+        self.collection = SpotifyCollection.from_spotify_api(self.playlist, self.playlist["items"])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def audio_features_requests(self, fake: FakeSpotify):
+        return fake.requests_to("/v1/audio-features")
+
+    def test_features_are_fetched_in_batches(self):
+        with FakeSpotify([self.playlist]) as fake:
+            stats = helpers.get_collection_stats(fake.client(), self.collection, self.store)
+
+        self.assertEqual(3, len(self.audio_features_requests(fake)))
+        self.assertEqual(250, stats.num_tracks)
+        self.assertEqual(250, len(self.store))
+
+    def test_stored_tracks_are_not_fetched_again(self):
+        with FakeSpotify([self.playlist]) as fake:
+            helpers.get_collection_stats(fake.client(), self.collection, self.store)
+            num_requests = len(fake.requests)
+
+            stats = helpers.get_collection_stats(fake.client(), self.collection, self.store)
+
+        self.assertEqual(num_requests, len(fake.requests))
+        self.assertEqual(250, stats.num_tracks)
+
+    def test_only_missing_tracks_are_fetched(self):
+        with FakeSpotify([self.playlist]) as fake:
+            first_tracks = dataclasses.replace(self.collection, tracks=self.collection.tracks[:150])
+            helpers.get_collection_stats(fake.client(), first_tracks, self.store)
+
+            self.assertEqual(
+                100,
+                helpers.fetch_tracks_features(fake.client(), self.collection.tracks, self.store),
+            )
+
+        self.assertEqual(2 + 1, len(self.audio_features_requests(fake)))
+
+    def test_tracks_without_features_are_stored_as_missing(self):
+        unknown = SpotifyTrack(
+            name="Unknown", spotify_id="unknown", duration_ms=1000, artist=[], uri="spotify:track:unknown", album={},
+        )
+        with FakeSpotify([self.playlist]) as fake:
+            helpers.fetch_tracks_features(fake.client(), [unknown, *self.collection.tracks[:2]], self.store)
+            self.assertEqual(0, helpers.fetch_tracks_features(fake.client(), [unknown], self.store))
+
+        self.assertIn("unknown", self.store)
+        self.assertEqual({"p1t0", "p1t1"}, set(self.store.get(["unknown", "p1t0", "p1t1"])))
+
+    def test_stored_features_round_trip(self):
+        track = self.collection.tracks[0]
+        self.store.put_many([(track, make_audio_features(track.spotify_id))])
+
+        features = self.store.get([track.spotify_id])[track.spotify_id]
+
+        self.assertEqual(track.name, features.track_name)
+        self.assertEqual([a.to_dict() for a in track.artist], features.track_artists)
+        expected = make_audio_features(track.spotify_id)
+        self.assertEqual({name: expected[name] for name in FEATURE_NAMES}, features.audio_features)
+
+    def test_arrays_of_stored_features(self):
+        tracks = self.collection.tracks[:3]
+        self.store.put_many([(t, make_audio_features(t.spotify_id)) for t in tracks[:2]] + [(tracks[2], None)])
+
+        track_ids, values = self.store.arrays([t.spotify_id for t in tracks], features=("tempo", "key"))
+
+        self.assertEqual(["p1t0", "p1t1"], track_ids)
+        self.assertEqual([[120.5, 5], [120.5, 5]], values.tolist())
+        self.assertEqual((2, len(STAT_FEATURES)), self.store.arrays()[1].shape)
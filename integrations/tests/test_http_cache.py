@@ -0,0 +1,143 @@
+import tempfile
+from pathlib import Path
+
+import requests
+from django.test import SimpleTestCase
+
+from integrations.spotify import http_cache
+from integrations.spotify.http_cache import CachedSession
+from integrations.tests.fake_spotify import FakeSpotify, make_playlist, make_track
+
+
+class CachedSessionTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name).joinpath("responses.sqlite3")
+        self.playlists = [make_playlist("p1", num_tracks=5)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def session(self, **kwargs) -> CachedSession:
+        return CachedSession(self.path, **kwargs)
+
+    def expire_all(self, session: CachedSession):
+        with session._db:
+            session._db.execute("UPDATE responses SET expires_at = 0")
+
+    def test_repeated_calls_are_served_from_cache(self):
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(session=self.session())
+            first = list(client.playlist_items(self.playlists[0]))
+            num_requests = len(fake.requests)
+
+            second = list(client.playlist_items(self.playlists[0]))
+
+        self.assertEqual(first, second)
+        self.assertEqual(num_requests, len(fake.requests))
+
+    def test_cache_persists_between_sessions(self):
+        with FakeSpotify(self.playlists) as fake:
+            list(fake.client(session=self.session()).playlists())
+            num_requests = len(fake.requests)
+
+            list(fake.client(session=self.session()).playlists())
+
+        self.assertEqual(num_requests, len(fake.requests))
+
+    def test_stale_response_is_revalidated(self):
+        session = self.session()
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(session=session)
+            first = list(client.playlist_items(self.playlists[0]))
+            self.expire_all(session)
+
+            second = list(client.playlist_items(self.playlists[0]))
+
+        self.assertEqual(first, second)
+        self.assertEqual(3, session.revalidated)
+
+    def test_changed_response_replaces_stale_one(self):
+        session = self.session()
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(limit=10, session=session)
+            list(client.playlist_items(self.playlists[0]))
+            self.playlists[0]["items"].append({"added_at": "2021-06-12T10:00:00Z", "track": make_track("new")})
+            self.expire_all(session)
+
+            items = list(client.playlist_items(self.playlists[0]))
+
+        self.assertEqual("new", items[-1]["track"]["id"])
+        self.assertEqual(0, session.revalidated)
+
+    def test_writes_drop_mutable_responses(self):
+        session = self.session()
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(session=session)
+            list(client.playlists())
+            num_requests = len(fake.requests)
+
+            client.delete_from_saved_tracks(["t1"])
+            list(client.playlists())
+
+        self.assertEqual(num_requests + 1 + 1, len(fake.requests))
+
+    def test_least_recently_used_are_evicted(self):
+        playlists = [make_playlist(f"p{i}", num_tracks=2) for i in range(5)]
+        with FakeSpotify(playlists) as fake:
+            session = self.session(max_bytes=3000)
+            client = fake.client(session=session)
+            for playlist in playlists:
+                list(client.playlist_items(playlist))
+
+            self.assertLessEqual(session.size(), 3000)
+            num_requests = len(fake.requests)
+            list(client.playlist_items(playlists[-1]))
+            self.assertEqual(num_requests, len(fake.requests))
+            list(client.playlist_items(playlists[0]))
+            self.assertEqual(num_requests + 1, len(fake.requests))
+
+    def test_puts_under_the_bound_do_not_sum_the_cache(self):
+        playlists = [make_playlist(f"p{i}", num_tracks=2) for i in range(3)]
+        with FakeSpotify(playlists) as fake:
+            session = self.session()
+            statements = []
+            session._db.set_trace_callback(statements.append)
+            client = fake.client(session=session)
+            for playlist in playlists:
+                list(client.playlist_items(playlist))
+            session._db.set_trace_callback(None)
+
+            self.assertFalse([s for s in statements if "SUM(" in s])
+            self.assertEqual(session.size(), session._size)
+            # Replacing a response counts its new body instead of adding both
+            self.expire_all(session)
+            list(client.playlist_items(playlists[0]))
+            self.assertEqual(session.size(), session._size)
+
+    def test_offline_replay_of_recorded_responses(self):
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(session=self.session())
+            recorded = list(client.playlist_items(self.playlists[0]))
+
+        session = self.session(offline=True)
+        self.expire_all(session)
+        replayed = list(fake.client(session=session).playlist_items(self.playlists[0]))
+
+        self.assertEqual(recorded, replayed)
+        with self.assertRaises(requests.ConnectionError):
+            list(fake.client(session=session).playlist_items(make_playlist("unknown", num_tracks=1)))
+
+
+class EndpointTtlTest(SimpleTestCase):
+
+    def test_track_endpoints_are_immutable(self):
+        self.assertTrue(http_cache.endpoint_ttl("/v1/audio-features")[1])
+        self.assertTrue(http_cache.endpoint_ttl("/v1/search")[1])
+        self.assertTrue(http_cache.endpoint_ttl("/v1/tracks/t1")[1])
+
+    def test_library_endpoints_are_mutable(self):
+        self.assertFalse(http_cache.endpoint_ttl("/v1/playlists/p1/items")[1])
+        self.assertFalse(http_cache.endpoint_ttl("/v1/users/me/playlists")[1])
+        self.assertFalse(http_cache.endpoint_ttl("/v1/me/tracks")[1])
@@ -0,0 +1,68 @@
+import dataclasses
+import gc
+import sys
+
+from django.test import SimpleTestCase
+
+from integrations.spotify.models import SpotifyAlbum, SpotifyArtist, SpotifyCollection, SpotifyTrack
+from integrations.tests.fake_spotify import make_playlist, make_track
+from musik_lib import collections
+
+
+class SpotifyModelsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.content = next(collections.get_local_spotify_collections_content())
+
+    def test_collection_file_round_trip(self):
+        collection = SpotifyCollection.from_dict(self.content)
+
+        self.assertEqual(
+            {**self.content, "snapshot_id": None, "created_date": collection.created_date},
+            {**collection.to_dict(), "tracks": self.content["tracks"]},
+        )
+        for track, track_content in zip(collection.tracks, self.content["tracks"]):
+            self.assertEqual(
+                {"uri": f"spotify:track:{track_content['spotify_id']}", **track_content},
+                track.to_dict(),
+            )
+
+    def test_artists_and_albums_are_shared_by_id(self):
+        first = SpotifyTrack.from_spotify_api(make_track("t1"))
+        second = SpotifyTrack.from_spotify_api({**make_track("t2"), "artists": first.to_dict()["artist"]})
+        from_file = SpotifyTrack.from_dict({**first.to_dict(), "spotify_id": "t3"})
+
+        self.assertIs(first.artist[0], second.artist[0])
+        self.assertIs(first.artist[0], from_file.artist[0])
+        self.assertIs(first.album, from_file.album)
+        self.assertIsNot(first.album, second.album)
+
+    def test_artists_without_id_are_not_shared(self):
+        local = {"id": None, "name": "Local"}
+
+        self.assertIsNot(SpotifyArtist.from_spotify_api(local), SpotifyArtist.from_spotify_api(local))
+
+    def test_shared_artists_are_released_with_their_tracks(self):
+        track = SpotifyTrack.from_spotify_api(make_track("released"))
+        artist_id = track.artist[0].id
+        self.assertIn(artist_id, SpotifyArtist._interned)
+
+        del track
+        gc.collect()
+        self.assertNotIn(artist_id, SpotifyArtist._interned)
+
+    def test_models_are_slotted_and_immutable(self):
+        collection = SpotifyCollection.from_spotify_api(*self.playlist_and_items())
+        track = collection.tracks[0]
+
+        for instance in (collection, track, track.artist[0], track.album):
+            self.assertFalse(hasattr(instance, "__dict__"))
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            track.name = "Other"
+        self.assertLess(sys.getsizeof(track), sys.getsizeof(track.to_dict()))
+        self.assertIsInstance(track.album, SpotifyAlbum)
+
+    @staticmethod
+    def playlist_and_items():
+        playlist = make_playlist("p1", num_tracks=2)
+        return playlist, playlist["items"]
@@ -0,0 +1,79 @@
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from integrations.spotify.resolution import ResolutionStore, resolve_tracks
+from integrations.tests.fake_spotify import FakeSpotify
+from integrations.tests.test_matching import make_item
+
+
+class ResolveTracksTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = ResolutionStore(Path(self.tmp_dir.name).joinpath("resolutions.sqlite3"))
+        self.search_items = [
+            make_item("karma", "Karma Police", duration_ms=264000),
+            make_item("creep", "Creep", duration_ms=238000),
+            make_item("airbag", "Airbag", duration_ms=284000),
+        ]
+        self.tracks = [
+            {"name": "Creep", "artist": "Radiohead", "duration": "3:58"},
+            {"name": "Karma Police", "artist": "Radiohead", "duration": "4:24"},
+            {"name": "Airbag", "artist": "Radiohead", "duration": "4:44"},
+        ]
+        self.missing = {"name": "Lucky", "artist": "Radiohead", "duration": "4:19"}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def searches(self, fake: FakeSpotify) -> int:
+        return len(fake.requests_to("/v1/search"))
+
+    def test_tracks_resolve_in_order(self):
+        with FakeSpotify([], search_items=self.search_items) as fake:
+            resolution = resolve_tracks(fake.client(), self.tracks, self.store, workers=4)
+
+        self.assertTrue(resolution.is_complete)
+        self.assertEqual(
+            ["spotify:track:creep", "spotify:track:karma", "spotify:track:airbag"],
+            resolution.uris,
+        )
+
+    def test_resolved_tracks_are_not_searched_again(self):
+        with FakeSpotify([], search_items=self.search_items) as fake:
+            resolve_tracks(fake.client(), self.tracks, self.store, workers=4)
+            searches = self.searches(fake)
+
+            resolution = resolve_tracks(fake.client(), self.tracks + self.tracks[:1], self.store, workers=4)
+
+        self.assertEqual(3, searches)
+        self.assertEqual(searches, self.searches(fake))
+        self.assertEqual("spotify:track:creep", resolution.uris[-1])
+
+    def test_unresolved_tracks_are_recorded_without_aborting(self):
+        with FakeSpotify([], search_items=self.search_items) as fake:
+            resolution = resolve_tracks(fake.client(), [self.missing] + self.tracks, self.store, workers=4)
+
+        self.assertFalse(resolution.is_complete)
+        self.assertEqual([None, "spotify:track:creep"], resolution.uris[:2])
+        self.assertIn(("Lucky", "Radiohead", "4:19"), resolution.unresolved)
+        self.assertEqual([("Lucky", "Radiohead", "4:19")], [key for key, _ in self.store.unresolved()])
+
+    def test_unresolved_tracks_are_searched_again_on_demand(self):
+        with FakeSpotify([], search_items=self.search_items) as fake:
+            resolve_tracks(fake.client(), [self.missing], self.store)
+            resolve_tracks(fake.client(), [self.missing], self.store)
+            self.assertEqual(1, self.searches(fake))
+
+            resolve_tracks(fake.client(), [self.missing], self.store, retry_unresolved=True)
+
+        self.assertEqual(2, self.searches(fake))
+
+    def test_checkpoints_are_by_content(self):
+        self.store.mark_done("My 1st Album", "fingerprint")
+
+        self.assertTrue(self.store.is_done("My 1st Album", "fingerprint"))
+        self.assertFalse(self.store.is_done("My 1st Album", "changed"))
+        self.assertFalse(self.store.is_done("My 2nd Album", "fingerprint"))
@@ -0,0 +1,103 @@
+import requests
+from django.test import SimpleTestCase
+from spotipy import SpotifyException
+
+from integrations.spotify import helpers
+from integrations.spotify.client import MAX_RATE_LIMIT_RETRIES
+from integrations.spotify.http_cache import mount_retries
+from integrations.tests.fake_spotify import FakeSpotify, make_playlist
+
+
+class ConcurrentPlaylistItemsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.playlists = [make_playlist(f"p{i}", num_tracks=i * 3) for i in range(1, 6)]
+
+    def test_items_keep_playlist_order(self):
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(limit=2, workers=4)
+
+            fetched = list(client.playlists_items(self.playlists))
+
+        self.assertEqual([p["id"] for p in self.playlists], [p["id"] for p, _ in fetched])
+        for playlist, items in fetched:
+            self.assertEqual(playlist["items"], items)
+
+    def test_same_items_as_serial_fetch(self):
+        with FakeSpotify(self.playlists) as fake:
+            serial = [list(fake.client(workers=1).playlist_items(p)) for p in self.playlists]
+            concurrent = [list(fake.client(workers=4).playlist_items(p)) for p in self.playlists]
+
+        self.assertEqual(serial, concurrent)
+
+    def test_pages_are_fetched_concurrently(self):
+        with FakeSpotify(self.playlists, delay=0.05) as fake:
+            list(fake.client(limit=2, workers=4).playlists_items(self.playlists))
+
+        self.assertGreater(fake.max_in_flight, 1)
+        self.assertLessEqual(fake.max_in_flight, 4)
+
+    def test_rate_limited_calls_are_retried(self):
+        with FakeSpotify(self.playlists) as fake:
+            fake.rate_limit(3)
+
+            fetched = list(fake.client(workers=4).playlists_items(self.playlists))
+
+        self.assertEqual([p["items"] for p in self.playlists], [items for _, items in fetched])
+
+    def test_rate_limited_calls_are_retried_by_one_loop(self):
+        with FakeSpotify(self.playlists) as fake:
+            # With the retries of the session that the default client uses
+            client = fake.client(session=mount_retries(requests.Session()))
+            fake.rate_limit(MAX_RATE_LIMIT_RETRIES + 1)
+
+            with self.assertRaises(SpotifyException):
+                client.me()
+
+        # The first request and its retries, all rate limited
+        self.assertEqual(MAX_RATE_LIMIT_RETRIES + 1, len(fake.requests_to("/v1/me")))
+
+
+class GetRemoteCollectionsTest(SimpleTestCase):
+
+    def test_final_playlists_are_fetched_with_one_me_call(self):
+        playlists = [
+            make_playlist("p1", num_tracks=5),
+            make_playlist("p2", num_tracks=3, owner="someone else"),
+            make_playlist("p3", num_tracks=4, name="ZZZ work in progress"),
+            make_playlist("p4", num_tracks=1),
+        ]
+        with FakeSpotify(playlists) as fake:
+            collections = list(helpers.get_remote_collections(fake.client(workers=4)))
+
+        self.assertEqual(["p1", "p4"], [c.spotify_id for c in collections])
+        self.assertEqual(5, len(collections[0].tracks))
+        self.assertEqual(1, len(fake.requests_to("/v1/me")))
+
+
+class SnapshotSyncTest(SimpleTestCase):
+
+    def setUp(self):
+        self.playlists = [
+            make_playlist("p1", num_tracks=3, snapshot_id="s1"),
+            make_playlist("p2", num_tracks=3, snapshot_id="s2"),
+            make_playlist("p3", num_tracks=3, snapshot_id="s3"),
+        ]
+
+    def test_only_changed_playlists_are_fetched(self):
+        local_snapshots = {"p1": "s1", "p2": "old", "p3": None}
+        with FakeSpotify(self.playlists) as fake:
+            collections = list(helpers.get_remote_collections(fake.client(workers=4), local_snapshots))
+
+        self.assertEqual(["p2", "p3"], [c.spotify_id for c in collections])
+        self.assertEqual(["s2", "s3"], [c.snapshot_id for c in collections])
+        self.assertFalse(fake.requests_to("/v1/playlists/p1/items") + fake.requests_to("/v1/playlists/p1/tracks"))
+
+    def test_nothing_is_fetched_when_all_unchanged(self):
+        local_snapshots = {"p1": "s1", "p2": "s2", "p3": "s3"}
+        with FakeSpotify(self.playlists) as fake:
+            collections = list(helpers.get_remote_collections(fake.client(workers=4), local_snapshots))
+
+        self.assertFalse(collections)
+        # Only /me and the listing of playlists
+        self.assertEqual(1 + 2, len(fake.requests))
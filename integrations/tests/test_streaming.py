@@ -0,0 +1,100 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from integrations.spotify import helpers
+from integrations.tests.fake_spotify import FakeSpotify, make_playlist
+from musik_lib import collections
+
+
+class PlaylistsPagesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.playlists = [make_playlist(f"p{i}", num_tracks=i * 3) for i in range(5)]
+
+    def test_pages_keep_playlist_order(self):
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(limit=2, workers=4)
+            pages = list(client.playlists_pages(list(client.playlists())))
+
+        self.assertEqual(
+            [(p["id"], i["track"]["id"]) for p in self.playlists for i in p["items"]],
+            [(p["id"], i["track"]["id"]) for p, items in pages for i in items],
+        )
+        # The empty playlist still has its page
+        self.assertIn(("p0", []), [(p["id"], items) for p, items in pages])
+
+    def test_pages_fetched_ahead_are_bounded(self):
+        with FakeSpotify(self.playlists, delay=0.02) as fake:
+            client = fake.client(limit=2, workers=2)
+            playlists = list(client.playlists())
+            pages = client.playlists_pages(playlists)
+            next(pages)
+            num_fetched = sum(len(fake.requests_to(f"/v1/playlists/{p['id']}/items")) for p in playlists)
+            list(pages)
+
+        self.assertLessEqual(fake.max_in_flight, 2)
+        # The page consumed and the window of 2 * workers fetched ahead, of the 17 planned
+        self.assertLessEqual(num_fetched, 1 + 2 * 2)
+
+    def test_playlist_that_grew_since_listing(self):
+        with FakeSpotify(self.playlists) as fake:
+            client = fake.client(limit=2)
+            listed = client.playlists_pages([{**self.playlists[2], "tracks": {"total": 1}}])
+
+            items = [i for _, page_items in listed for i in page_items]
+
+        self.assertEqual(self.playlists[2]["items"], items)
+
+
+class WriteRemoteCollectionsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(collections, "SPOTIFY_COLLECTION_DIR", self.tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.playlists = [
+            make_playlist("p1", num_tracks=5),
+            make_playlist("p2", num_tracks=0),
+            make_playlist("p3", num_tracks=3),
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_streamed_files_equal_written_collections(self):
+        for collection_format in collections.COLLECTION_FORMATS:
+            with self.subTest(collection_format), FakeSpotify(self.playlists) as fake:
+                written = list(helpers.write_remote_collections(
+                    fake.client(limit=2, workers=2), collection_format=collection_format,
+                ))
+                expected_paths = [
+                    collections.write_spotify_collection(c, prefix="expected", collection_format=collection_format)
+                    for c in helpers.get_remote_collections(fake.client(limit=2))
+                ]
+
+            self.assertEqual(["p1", "p3"], [w.spotify_id for w in written])
+            self.assertEqual([5, 3], [w.num_tracks for w in written])
+            for w, expected_path in zip(written, expected_paths):
+                with open(w.path, "rb") as streamed, open(expected_path, "rb") as expected:
+                    self.assertEqual(expected.read(), streamed.read())
+
+    def test_failed_playlist_keeps_former_file(self):
+        path = collections.spotify_collection_path("Playlist p1")
+        with open(path, "w") as f:
+            f.write("former")
+        self.playlists[0]["items"][3]["track"] = {"id": "broken"}
+
+        with FakeSpotify(self.playlists) as fake:
+            written = list(helpers.write_remote_collections(fake.client(limit=2)))
+
+        self.assertEqual(["p3"], [w.spotify_id for w in written])
+        with open(path) as f:
+            self.assertEqual("former", f.read())
+        self.assertEqual(
+            sorted(["Playlist p1.json", "Playlist p3.json"]),
+            sorted(os.listdir(self.tmp_dir.name)),
+        )
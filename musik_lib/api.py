@@ -0,0 +1,245 @@
+"""
+Read-only JSON API of the library, for tooling that would otherwise scrape the HTML pages
+
+Every resource is listed by keyset pages, /lib/api/<resource>/?after=<cursor>&limit=<n>,
+or streamed as NDJSON, one object per line, from the cursor to the end with ?format=ndjson.
+/lib/api/export/ streams every resource as NDJSON records. Streams query a chunk of rows at a time,
+so their memory does not grow with the library.
+Responses carry an ETag and Last-Modified of the library version, so clients can make conditional GETs
+"""
+import datetime
+import json
+from typing import Callable, Dict, NamedTuple, Tuple
+
+from django.db.models import F, OrderBy, Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+
+from musik_lib.cache import library_version
+from musik_lib.models.stats import *
+from musik_lib.pagination import decode_cursor, iter_keyset, keyset_keys, row_cursor
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows of a query of a stream; Bounds the memory of a stream
+STREAM_CHUNK_SIZE = 500
+
+
+def _seconds(duration: datetime.timedelta) -> float:
+    return duration.total_seconds()
+
+
+def _collection(c: Collection) -> Dict:
+    return {
+        "id": c.id,
+        "name": c.name,
+        "nick_name": c.nick_name,
+        "description": c.description,
+        "created_year": c.created_year,
+        "ordinal": c.ordinal,
+        "track_count": c.track_count,
+        "duration": _seconds(c.total_duration),
+        "tracks": [{"id": t.track_id, "album": t.album_id} for t in c.trackincollection_set.all()],
+    }
+
+
+def _track(t: Track) -> Dict:
+    return {
+        "id": t.id,
+        "name": t.name,
+        "duration": _seconds(t.duration),
+        "released_year": t.released_year,
+        "artists": [a.id for a in t.artist.all()],
+        "featuring": [a.id for a in t.featuring.all()],
+    }
+
+
+def _artist(a: Artist) -> Dict:
+    return {
+        "id": a.id,
+        "name": a.name,
+    }
+
+
+def _album(a: Album) -> Dict:
+    return {
+        "id": a.id,
+        "name": a.name,
+        "album_type": a.album_type,
+        "created_year": a.created_year,
+        "spotify_id": a.spotify_id,
+        "track_count": a.track_count,
+        "duration": _seconds(a.total_duration),
+    }
+
+
+def _collection_stat(s: CollectionStat) -> Dict:
+    return {
+        "id": s.collection_id,
+        "duplicate_tracks": [d.track_id for d in s.duplicate_tracks.all()],
+    }
+
+
+def _duplicate_track(d: DuplicateTrack) -> Dict:
+    return {
+        "id": d.track_id,
+        "frequency": d.frequency,
+    }
+
+
+def _artist_frequency_collection(afc: ArtistFrequencyCollection) -> Dict:
+    return {
+        "id": afc.id,
+        "artist": afc.artist_id,
+        "collection": afc.collection_stat_id,
+        "frequency": afc.frequency,
+    }
+
+
+def _artist_frequency_library(afl: ArtistFrequencyLibrary) -> Dict:
+    return {
+        "id": afl.id,
+        "artist": afl.artist_id,
+        "frequency": afl.frequency,
+    }
+
+
+class Resource(NamedTuple):
+    queryset: Callable
+    serialize: Callable[[models.Model], Dict]
+    # Sort order of the pages, as in KeysetPaginationMixin; By the primary key, which is indexed
+    keyset: Tuple[OrderBy, ...] = (F("pk").asc(),)
+
+
+# Resources by their name in the URLs, in the order of the export
+RESOURCES = {
+    "collections": Resource(
+        lambda: Collection.objects.prefetch_related(
+            Prefetch(
+                "trackincollection_set",
+                queryset=TrackInCollection.objects.order_by("ordinal").only("collection", "track", "album"),
+            )
+        ),
+        _collection,
+    ),
+    "tracks": Resource(lambda: Track.objects.prefetch_related("artist", "featuring"), _track),
+    "artists": Resource(lambda: Artist.objects.all(), _artist),
+    "albums": Resource(lambda: Album.objects.all(), _album),
+    "collection_stats": Resource(
+        lambda: CollectionStat.objects.prefetch_related(
+            Prefetch("duplicate_tracks", queryset=DuplicateTrack.objects.only("track"))
+        ),
+        _collection_stat,
+    ),
+    "duplicate_tracks": Resource(lambda: DuplicateTrack.objects.all(), _duplicate_track),
+    "artist_frequency_collection": Resource(
+        lambda: ArtistFrequencyCollection.objects.all(), _artist_frequency_collection
+    ),
+    "artist_frequency_library": Resource(lambda: ArtistFrequencyLibrary.objects.all(), _artist_frequency_library),
+}
+
+
+def _etag(request, *args, **kwargs) -> str:
+    return str(library_version())
+
+
+def _last_modified(request, *args, **kwargs) -> datetime.datetime:
+    # The library version is the time of the last write, in nanoseconds
+    return datetime.datetime.fromtimestamp(library_version() / 1e9, tz=datetime.timezone.utc)
+
+
+def library_conditional(view):
+    """
+    Only GET and HEAD, answered by 304 Not Modified when the library did not change since the client got the response
+    """
+    return require_safe(condition(etag_func=_etag, last_modified_func=_last_modified)(view))
+
+
+def _get_resource(name: str) -> Resource:
+    try:
+        return RESOURCES[name]
+    except KeyError:
+        raise Http404(f"No resource {name}")
+
+
+def _ndjson_lines(rows, serialize):
+    """
+    :return: a string of NDJSON lines for a chunk of rows, to stream a chunk at a time
+    """
+    return "".join(json.dumps(serialize(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+@library_conditional
+def index(request):
+    return JsonResponse({
+        "resources": {name: f"/lib/api/{name}/" for name in RESOURCES},
+        "stats": "/lib/api/stats/",
+        "export": "/lib/api/export/",
+    })
+
+
+@library_conditional
+def resource_list(request, resource):
+    """
+    A page of the resource from the row after the cursor, or with ?format=ndjson all the rows after it
+    """
+    resource = _get_resource(resource)
+    after = request.GET.get("after")
+    try:
+        values = decode_cursor(after, len(resource.keyset)) if after is not None else None
+        limit = int(request.GET.get("limit", PAGE_SIZE))
+    except ValueError as e:
+        raise Http404(str(e))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise Http404(f"Limit {limit} is out of 1 to {MAX_PAGE_SIZE}")
+
+    if request.GET.get("format") == "ndjson":
+        return StreamingHttpResponse(
+            (
+                _ndjson_lines(rows, resource.serialize)
+                for rows in iter_keyset(resource.queryset(), resource.keyset, values, STREAM_CHUNK_SIZE)
+            ),
+            content_type=NDJSON_CONTENT_TYPE,
+        )
+
+    # One more row than the page tells whether there is another page
+    rows = next(iter_keyset(resource.queryset(), resource.keyset, values, limit + 1), [])
+    return JsonResponse({
+        "results": [resource.serialize(row) for row in rows[:limit]],
+        "next": row_cursor(rows[limit - 1], keyset_keys(resource.keyset)) if len(rows) > limit else None,
+    })
+
+
+@library_conditional
+def resource_detail(request, resource, pk):
+    resource = _get_resource(resource)
+    return JsonResponse(resource.serialize(get_object_or_404(resource.queryset(), pk=pk)))
+
+
+@library_conditional
+def stats(request):
+    library_stat = LibraryStat.load()
+    return JsonResponse({
+        "num_collections": library_stat.num_collections,
+        "num_tracks": library_stat.num_tracks,
+        "num_artists": library_stat.num_artists,
+        "duration": _seconds(library_stat.duration),
+    })
+
+
+def _export_lines():
+    for name, resource in RESOURCES.items():
+        for rows in iter_keyset(resource.queryset(), resource.keyset, chunk_size=STREAM_CHUNK_SIZE):
+            yield _ndjson_lines(rows, lambda row: {"resource": name, "object": resource.serialize(row)})
+
+
+@library_conditional
+def export(request):
+    """
+    The whole library as NDJSON records, {"resource": <name>, "object": {...}}, resource after resource
+    """
+    response = StreamingHttpResponse(_export_lines(), content_type=NDJSON_CONTENT_TYPE)
+    response["Content-Disposition"] = 'attachment; filename="library.ndjson"'
+    return response
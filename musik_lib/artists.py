@@ -0,0 +1,106 @@
+"""
+Parsing of artist fields, e.g. "A & B feat. C", shared by the ingestion and the spotify search
+
+Kept free of Django models, as parsing, so it can run in worker processes.
+Artist fields repeat a lot across collections, so parsing is memoized in a bounded LRU cache;
+Results are tuples, as they are shared between the callers
+"""
+import re
+import unicodedata
+
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, MutableMapping, NamedTuple, Optional, Tuple, TypeVar
+
+AND_REGEX = re.compile(" & | and |, ", re.IGNORECASE)
+FEAT_REGEX = re.compile(" feat | featuring | feat\\. | מארח את", re.IGNORECASE)
+NON_WORD_REGEX = re.compile(r"[^\w\s]+")
+
+# Bounds the memory of the caches; The local collections have a few thousands artist fields
+PARSE_CACHE_SIZE = 8192
+
+
+class ParsedArtists(NamedTuple):
+    """
+    Names of the main and featuring artists of an artist field, in their order in the field
+    """
+    main: Tuple[str, ...]
+    featuring: Tuple[str, ...]
+
+    @property
+    def all(self) -> Tuple[str, ...]:
+        return self.main + self.featuring
+
+
+def _split_names(artist_names: str) -> Tuple[str, ...]:
+    if not artist_names:
+        return ()
+    return tuple(
+        name.strip().replace("\\&", "&")
+        for name
+        in AND_REGEX.split(artist_names)
+    )
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_artists(artist_field: str) -> ParsedArtists:
+    """
+    Splits an artist field into main artists and featuring artists names
+    :param artist_field: e.g. "A & B feat. C"
+    """
+    featuring = FEAT_REGEX.search(artist_field)
+    if featuring:
+        artist_field = artist_field.replace(featuring.group(), " feat ")
+    main_artists, _, feat_artists = artist_field.partition(" feat ")
+    return ParsedArtists(_split_names(main_artists), _split_names(feat_artists))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def artist_key(name: str) -> str:
+    """
+    Identity of an artist name, insensitive to case, punctuation, spacing and unicode forms,
+    e.g. "Guns N' Roses" and "guns n roses" have the same key;
+    A name of punctuation only keeps it, so that it does not share the empty key
+    """
+    folded = unicodedata.normalize("NFKC", name).casefold()
+    return " ".join(NON_WORD_REGEX.sub("", folded).split()) or " ".join(folded.split())
+
+
+V = TypeVar("V")
+
+
+class ArtistIndex(MutableMapping[str, V]):
+    """
+    Mapping from artist names to values, e.g. their ids, by artist_key of the names;
+    So a name finds the value of any other spelling of the same artist
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, V]] = ()):
+        self._values: Dict[str, V] = {}
+        for name, value in items:
+            self[name] = value
+
+    def __getitem__(self, name: str) -> V:
+        return self._values[artist_key(name)]
+
+    def __setitem__(self, name: str, value: V):
+        self._values[artist_key(name)] = value
+
+    def __delitem__(self, name: str):
+        del self._values[artist_key(name)]
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Iterates the keys of the names, which are the names that find them
+        """
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, name: str, default: Optional[V] = None) -> Optional[V]:
+        return self._values.get(artist_key(name), default)
+
+
+def clear_caches():
+    parse_artists.cache_clear()
+    artist_key.cache_clear()
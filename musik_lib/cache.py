@@ -0,0 +1,76 @@
+"""
+Caching of rendered pages and library wide values.
+
+The library changes only on ingestion and stat updates, which bump the library version;
+Every cache key holds the version, so entries of older versions are never read again and expire on their own
+"""
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+LIBRARY_VERSION_KEY = "musik_lib:library_version"
+
+
+def library_version() -> int:
+    version = cache.get(LIBRARY_VERSION_KEY)
+    if version is None:
+        # Another process may have set it in the meantime, so read back what was kept
+        cache.add(LIBRARY_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(LIBRARY_VERSION_KEY)
+    return version
+
+
+def bump_library_version():
+    """
+    Invalidates all cached pages and values; Call on every write to the library
+    """
+    cache.set(LIBRARY_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_library_version_on_commit():
+    """
+    Bumps the library version once the current transaction commits, or right away outside of a transaction;
+    Bumping before the commit would let a concurrent request cache the rows it still reads under the new version
+    """
+    transaction.on_commit(bump_library_version)
+
+
+def cached_value(name: str, compute):
+    """
+    :param name: unique name of the value in the library
+    :param compute: computes the value when it is not cached for the current library version
+    :return: the cached value
+    """
+    key = f"musik_lib:value:{library_version()}:{name}"
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+    return value
+
+
+def cached_page(view):
+    """
+    Caches the rendered responses of a view for the current library version, by their full path
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return view(request, *args, **kwargs)
+
+        key = f"musik_lib:page:{library_version()}:{request.get_full_path()}"
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response.render()
+        if response.status_code == 200:
+            cache.set(key, (response.content, response["Content-Type"]))
+        return response
+    return wrapper
@@ -1,31 +1,32 @@
-import dataclasses
+import hashlib
 import json
 import os
 import shutil
+import tempfile
+import textwrap
+import threading
 
 from collections import OrderedDict
-from typing import Set, Iterator, Dict
+from typing import Set, Iterator, Dict, List, Mapping, NamedTuple, Optional
+
+from musik_lib.collections import compact
 
 COLLECTION_PARENT_DIR = os.path.dirname(os.path.realpath(__file__))
 MANUAL_COLLECTION_DIR = os.path.join(COLLECTION_PARENT_DIR, "from_manual")
 SPOTIFY_COLLECTION_DIR = os.path.join(COLLECTION_PARENT_DIR, "from_spotify")
-MANUAL_COLLECTION_FILE_NAMES = OrderedDict(
-    [
-        (f.split("_")[1], f)
-        for f
-        in sorted(
-            [
-                f for f in os.listdir(MANUAL_COLLECTION_DIR) if f.startswith("collection_")
-            ]
-        )
-    ]
+MANIFEST_PATH = os.environ.get(
+    "MUSIKA_COLLECTIONS_MANIFEST_PATH",
+    os.path.join(COLLECTION_PARENT_DIR, ".manifest.json"),
 )
+MANIFEST_VERSION = 1
 
-SPOTIFY_COLLECTIONS_FILE_NAMES = [
-    name
-    for name in os.listdir(SPOTIFY_COLLECTION_DIR)
-    if name.endswith(".json")
-]
+# Extension of the collection files by format; Files are read by their extension, whatever the format
+COLLECTION_FORMATS = {
+    "json": ".json",
+    "compact": compact.COMPACT_EXTENSION,
+}
+# Format that collection files are written in
+COLLECTION_FORMAT = os.environ.get("MUSIKA_COLLECTION_FORMAT", "json")
 
 
 def _load_json_file(file_path):
@@ -33,40 +34,216 @@ def _load_json_file(file_path):
         return json.load(fp)
 
 
+def is_collection_file(file_name: str) -> bool:
+    return file_name.endswith(tuple(COLLECTION_FORMATS.values()))
+
+
+def load_collection_file(file_path) -> Dict:
+    """
+    Reads a collection file in the format of its extension
+    """
+    if str(file_path).endswith(compact.COMPACT_EXTENSION):
+        with open(file_path, encoding="utf-8") as fp:
+            return compact.load(fp)
+    return _load_json_file(file_path)
+
+
+def collection_fingerprint(content: Dict) -> str:
+    """
+    Hash of the normalized collection content; Equal for collections files with the same content
+    regardless of keys order or indentation
+    """
+    normalized = json.dumps(
+        content,
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ManifestEntry(NamedTuple):
+    """
+    What is known of a collection file without reading it
+    """
+    name: str
+    spotify_id: Optional[str]
+    snapshot_id: Optional[str]
+    track_count: int
+    fingerprint: str
+    mtime_ns: int
+    size: int
+
+
+class Manifest:
+    """
+    Index of the collection files in a few directories, persisted as JSON
+
+    Every read refreshes it by the stat of the files: a file is parsed only when it is new or its mtime or size changed,
+    and entries of deleted files are dropped. The file is rewritten only when an entry changed
+    """
+
+    def __init__(self, path: str, directories: Mapping[str, str]):
+        """
+        :param directories: directory of the collection files by kind, e.g. 'spotify'
+        """
+        self.path = path
+        self.directories = directories
+        self._entries: Optional[Dict[str, Dict[str, ManifestEntry]]] = None
+        self._lock = threading.Lock()
+
+    def entries(self, kind: str) -> Dict[str, ManifestEntry]:
+        """
+        :return: entries by file name, in the order of the file names
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            entries, changed = self._refresh(kind, self._entries.get(kind, {}))
+            if changed:
+                self._entries[kind] = entries
+                self._save()
+        return entries
+
+    def _load(self) -> Dict[str, Dict[str, ManifestEntry]]:
+        try:
+            content = _load_json_file(self.path)
+        except (OSError, ValueError):
+            return {}
+        if content.get("version") != MANIFEST_VERSION:
+            return {}
+        return {
+            kind: {file_name: ManifestEntry(**entry) for file_name, entry in entries.items()}
+            for kind, entries in content["kinds"].items()
+        }
+
+    def _refresh(self, kind: str, entries: Dict[str, ManifestEntry]):
+        """
+        :return: the entries of the files that are in the directory now, and whether any entry changed
+        """
+        refreshed = {}
+        with os.scandir(self.directories[kind]) as files:
+            stats = sorted((f.name, f.stat()) for f in files if is_collection_file(f.name))
+        for file_name, stat in stats:
+            entry = entries.get(file_name)
+            if entry is None or entry.mtime_ns != stat.st_mtime_ns or entry.size != stat.st_size:
+                content = load_collection_file(os.path.join(self.directories[kind], file_name))
+                entry = ManifestEntry(
+                    name=content["name"],
+                    spotify_id=content.get("spotify_id"),
+                    snapshot_id=content.get("snapshot_id"),
+                    track_count=len(content["tracks"]),
+                    fingerprint=collection_fingerprint(content),
+                    mtime_ns=stat.st_mtime_ns,
+                    size=stat.st_size,
+                )
+            refreshed[file_name] = entry
+        return refreshed, refreshed != entries
+
+    def _save(self):
+        content = {
+            "version": MANIFEST_VERSION,
+            "kinds": {
+                kind: {file_name: entry._asdict() for file_name, entry in entries.items()}
+                for kind, entries in self._entries.items()
+            },
+        }
+        # Written aside and renamed, so that a reader never sees half a manifest
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(content, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # A read only checkout still works, it just parses the changed files on every run
+            pass
+
+
+MANIFEST = Manifest(
+    MANIFEST_PATH,
+    {"manual": MANUAL_COLLECTION_DIR, "spotify": SPOTIFY_COLLECTION_DIR},
+)
+
+
+class LazyCollections(Mapping):
+    """
+    Collection contents by name, each read from its file on first access
+    """
+
+    def __init__(self, directory: str, entries: Dict[str, ManifestEntry]):
+        self._directory = directory
+        self._file_names = {entry.name: file_name for file_name, entry in entries.items()}
+        self._contents = {}
+
+    def __getitem__(self, name: str) -> Dict:
+        if name not in self._contents:
+            self._contents[name] = load_collection_file(os.path.join(self._directory, self._file_names[name]))
+        return self._contents[name]
+
+    def __iter__(self):
+        return iter(self._file_names)
+
+    def __len__(self):
+        return len(self._file_names)
+
+
 def read_manual_collection_file(file_name):
-    return _load_json_file(
+    return load_collection_file(
         os.path.join(MANUAL_COLLECTION_DIR, file_name)
     )
 
 
 def read_spotify_collection_file(file_name):
-    return _load_json_file(
+    return load_collection_file(
         os.path.join(SPOTIFY_COLLECTION_DIR, file_name)
     )
 
 
-def get_local_manual_collection_file_names():
-    return MANUAL_COLLECTION_FILE_NAMES.values()
+def get_manual_manifest() -> Dict[str, ManifestEntry]:
+    return {
+        file_name: entry
+        for file_name, entry in MANIFEST.entries("manual").items()
+        if file_name.startswith("collection_")
+    }
+
 
+def get_spotify_manifest() -> Dict[str, ManifestEntry]:
+    return MANIFEST.entries("spotify")
 
-def get_local_manual_collections_by_name() -> Dict[str, Dict]:
-    collection_files = get_local_manual_collection_file_names()
-    collection_contents = (
-        read_manual_collection_file(f)
-        for f in collection_files
+
+def get_manual_collection_file_names_by_number() -> Dict[str, str]:
+    return OrderedDict(
+        (f.split("_")[1], f) for f in get_manual_manifest()
     )
-    return {
-        content["name"]: content for content in collection_contents
-    }
+
+
+def get_local_manual_collection_file_names():
+    return get_manual_manifest().keys()
+
+
+def get_local_manual_collection_paths() -> List[str]:
+    return [
+        os.path.join(MANUAL_COLLECTION_DIR, f)
+        for f in get_local_manual_collection_file_names()
+    ]
+
+
+def get_local_manual_collections_by_name() -> Mapping[str, Dict]:
+    """
+    Returns the local manual collections content by their name, each read on first access
+    """
+    return LazyCollections(MANUAL_COLLECTION_DIR, get_manual_manifest())
 
 
 def resolve_manual_collection_files(collection_numbers):
+    file_names_by_number = get_manual_collection_file_names_by_number()
     # dedup the collection numbers while also keeping their order
     collection_numbers_dedup = OrderedDict([(cn, cn) for cn in collection_numbers]).keys()
-    missing_collections = collection_numbers_dedup - MANUAL_COLLECTION_FILE_NAMES.keys()
+    missing_collections = collection_numbers_dedup - file_names_by_number.keys()
     if missing_collections:
         raise ValueError("Collection files for numbers '%s' do not exist" % (",".join(collection_numbers_dedup)))
-    return [MANUAL_COLLECTION_FILE_NAMES[cn] for cn in collection_numbers_dedup]
+    return [file_names_by_number[cn] for cn in collection_numbers_dedup]
 
 
 def get_local_spotify_collection_ids() -> Set[str]:
@@ -74,28 +251,49 @@ def get_local_spotify_collection_ids() -> Set[str]:
     Returns the collection ids that exists on collection_path
     """
     return {
-        content["spotify_id"]
-        for content
-        in get_local_spotify_collections_content()
+        entry.spotify_id
+        for entry
+        in get_spotify_manifest().values()
+    }
+
+
+def get_local_spotify_snapshots() -> Dict[str, Optional[str]]:
+    """
+    Returns the snapshot id of the local collections by their spotify id; None for collections written without one
+    """
+    return {
+        entry.spotify_id: entry.snapshot_id
+        for entry
+        in get_spotify_manifest().values()
+    }
+
+
+def get_local_spotify_collection_paths_by_id() -> Dict[str, str]:
+    return {
+        entry.spotify_id: os.path.join(SPOTIFY_COLLECTION_DIR, file_name)
+        for file_name, entry in get_spotify_manifest().items()
     }
 
 
 def get_local_spotify_collections_content() -> Iterator[dict]:
     return (
-        _load_json_file(os.path.join(SPOTIFY_COLLECTION_DIR, name))
-        for name in SPOTIFY_COLLECTIONS_FILE_NAMES
+        load_collection_file(path)
+        for path in get_local_spotify_collection_paths()
     )
 
 
-def get_local_spotify_collections_by_name() -> Dict[str, Dict]:
+def get_local_spotify_collection_paths() -> List[str]:
+    return [
+        os.path.join(SPOTIFY_COLLECTION_DIR, name)
+        for name in get_spotify_manifest()
+    ]
+
+
+def get_local_spotify_collections_by_name() -> Mapping[str, Dict]:
     """
-    Returns all local collection content by their name
+    Returns all local collection content by their name, each read on first access
     """
-    return {
-        content["name"]: content
-        for content
-        in get_local_spotify_collections_content()
-    }
+    return LazyCollections(SPOTIFY_COLLECTION_DIR, get_spotify_manifest())
 
 
 def clear_spotify_local_collections():
@@ -107,17 +305,35 @@ def clear_spotify_local_collections():
         os.makedirs(SPOTIFY_COLLECTION_DIR)
 
 
-def write_spotify_collection(collection: dataclasses.dataclass,  prefix=""):
+def spotify_collection_path(name: str, prefix="", collection_format=None) -> str:
+    """
+    :param collection_format: one of COLLECTION_FORMATS keys; COLLECTION_FORMAT by default
+    """
     if prefix:
         prefix += "-"
-    path = f"/{SPOTIFY_COLLECTION_DIR}/{prefix}{collection.name}.json"
-    _write_col(
-        data=dataclasses.asdict(collection),
+    extension = COLLECTION_FORMATS[collection_format or COLLECTION_FORMAT]
+    return f"/{SPOTIFY_COLLECTION_DIR}/{prefix}{name}{extension}"
+
+
+def write_spotify_collection(collection,  prefix="", collection_format=None) -> str:
+    """
+    Returns the path of the written collection file
+    :param collection: a SpotifyCollection, written as its to_dict
+    :param collection_format: one of COLLECTION_FORMATS keys; COLLECTION_FORMAT by default
+    """
+    path = spotify_collection_path(collection.name, prefix, collection_format)
+    write_collection_file(
+        data=collection.to_dict(),
         path=path,
     )
+    return path
+
 
-def _write_col(data: Dict, path:str):
-    with open(path, "w") as f:
+def write_collection_file(data: Dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(compact.COMPACT_EXTENSION):
+            compact.dump(data, f)
+            return
         f.write(
             json.dumps(
                 data,
@@ -126,3 +342,60 @@ def _write_col(data: Dict, path:str):
             )
         )
 
+
+class CollectionFileWriter:
+    """
+    Writes a collection file a track at a time, so that the tracks of a collection are never all in memory
+
+    The tracks are spooled to a temporary file, since keys of the collection, e.g. its created date,
+    may be known only after its tracks. The file has the same content that write_collection_file writes,
+    and replaces the former file only once it is complete
+    """
+    # Stands for the tracks when the collection keys are dumped, so that the tracks go in their place
+    TRACKS_MARKER = "@@tracks-7f3a9c@@"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.is_compact = path.endswith(compact.COMPACT_EXTENSION)
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self._compact_writer = compact.CompactWriter(self._spool) if self.is_compact else None
+        self.num_tracks = 0
+
+    def write_track(self, track: Dict):
+        if self.is_compact:
+            self._compact_writer.write_track(track)
+        else:
+            self._spool.write(",\n" if self.num_tracks else "[\n")
+            self._spool.write(textwrap.indent(json.dumps(track, indent=4, default=str), " " * 8))
+        self.num_tracks += 1
+
+    def close(self, collection: Dict):
+        """
+        Writes the file
+        :param collection: the collection keys in the order of the file; its tracks are the written tracks
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                self._spool.seek(0)
+                if self.is_compact:
+                    self._compact_writer.write_collection(collection, f)
+                    shutil.copyfileobj(self._spool, f)
+                else:
+                    text = json.dumps({**collection, "tracks": self.TRACKS_MARKER}, indent=4, default=str)
+                    before, after = text.split(json.dumps(self.TRACKS_MARKER))
+                    f.write(before)
+                    if self.num_tracks:
+                        shutil.copyfileobj(self._spool, f)
+                        f.write("\n    ]")
+                    else:
+                        f.write("[]")
+                    f.write(after)
+            os.replace(tmp_path, self.path)
+        finally:
+            self.discard()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def discard(self):
+        self._spool.close()
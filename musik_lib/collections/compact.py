@@ -0,0 +1,128 @@
+"""
+Compact line-delimited format of collection files, an alternative to indented JSON
+
+Every line is a JSON array, a record whose first element is its type:
+    ["C", {...}]      the collection, all of its keys but tracks; the first line
+    ["A", {...}]      an artist; artists are numbered by the order of their records
+    ["L", {...}]      an album; numbered as artists
+    ["T", {...}]      a track, whose artist list and album are the numbers of their records
+An artist or album record comes once, before the first track that refers to it,
+so a file can be written a track at a time and read back without holding the JSON text of the whole collection.
+Decoding gives a dict equal to the one that was encoded
+"""
+import io
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+COMPACT_EXTENSION = ".ndjson"
+
+COLLECTION = "C"
+ARTIST = "A"
+ALBUM = "L"
+TRACK = "T"
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _key(value: Dict) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class CompactWriter:
+    """
+    Writes the records of a collection to a text file, a track at a time
+    """
+
+    def __init__(self, f: TextIO, collection: Optional[Dict] = None):
+        """
+        :param collection: the collection keys but tracks; When None, write_collection writes them in another file,
+        to be put before the tracks
+        """
+        self._f = f
+        self._artists: Dict[str, int] = {}
+        self._albums: Dict[str, int] = {}
+        if collection is not None:
+            self.write_collection(collection, f)
+
+    @staticmethod
+    def write_collection(collection: Dict, f: TextIO):
+        f.write(_dumps([COLLECTION, {k: v for k, v in collection.items() if k != "tracks"}]))
+        f.write("\n")
+
+    def write_track(self, track: Dict):
+        record = dict(track)
+        artists = track.get("artist")
+        if isinstance(artists, list) and all(isinstance(a, dict) for a in artists):
+            record["artist"] = [self._index(ARTIST, self._artists, a) for a in artists]
+        album = track.get("album")
+        if isinstance(album, dict):
+            record["album"] = self._index(ALBUM, self._albums, album)
+        self._write(TRACK, record)
+
+    def _index(self, record_type: str, table: Dict[str, int], value: Dict) -> int:
+        key = _key(value)
+        if key not in table:
+            table[key] = len(table)
+            self._write(record_type, value)
+        return table[key]
+
+    def _write(self, record_type: str, value: Dict):
+        self._f.write(_dumps([record_type, value]))
+        self._f.write("\n")
+
+
+def dump(content: Dict, f: TextIO):
+    writer = CompactWriter(f, content)
+    for track in content["tracks"]:
+        writer.write_track(track)
+
+
+def dumps(content: Dict) -> str:
+    f = io.StringIO()
+    dump(content, f)
+    return f.getvalue()
+
+
+def iter_tracks(lines: Iterable[str]) -> Iterator[Dict]:
+    """
+    Decodes the tracks of the lines of records, a line at a time; The collection record is skipped
+    """
+    return _decode_tracks(json.loads(line) for line in lines if line.strip())
+
+
+def _decode_tracks(records: Iterable[List]) -> Iterator[Dict]:
+    """
+    Tracks share the dicts of their artists and albums, as they are decoded once
+    """
+    artists: List[Dict] = []
+    albums: List[Dict] = []
+    for record_type, value in records:
+        if record_type == TRACK:
+            if isinstance(value.get("artist"), list) and all(isinstance(a, int) for a in value["artist"]):
+                value["artist"] = [artists[i] for i in value["artist"]]
+            if isinstance(value.get("album"), int):
+                value["album"] = albums[value["album"]]
+            yield value
+        elif record_type == ARTIST:
+            artists.append(value)
+        elif record_type == ALBUM:
+            albums.append(value)
+        elif record_type != COLLECTION:
+            raise ValueError(f"Unknown record type {record_type}")
+
+
+def load(f: TextIO) -> Dict:
+    first = f.readline()
+    record_type, collection = json.loads(first)
+    if record_type != COLLECTION:
+        raise ValueError(f"Compact collection starts with {record_type} instead of a collection record")
+    # JSON escapes new lines in strings, so the lines join into one array that decodes in a single call
+    lines = [line for line in f.read().split("\n") if line.strip()]
+    collection["tracks"] = list(_decode_tracks(json.loads(f"[{','.join(lines)}]")))
+    return collection
+
+
+def loads(text: str) -> Dict:
+    return load(io.StringIO(text))
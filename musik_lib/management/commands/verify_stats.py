@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from musik_lib.models.stats import LibraryStat, StatsDrift
+
+
+class Command(BaseCommand):
+    help = "Verifies that the library stats match the collections; Stats are kept up to date on writes " \
+           "so any difference is drift, which --repair fixes with a full recompute"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='when provided, recompute all stats if there is drift. Default is false',
+        )
+
+    def handle(self, *args, **options):
+        l_stat = LibraryStat.load()
+        drift = l_stat.verify()
+        self.report(drift)
+        if not drift or not options["repair"]:
+            return
+
+        self.stdout.write("Repairing stats")
+        l_stat.update()
+        self.report(l_stat.verify())
+
+    def report(self, drift: StatsDrift):
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("No drift in stats"))
+            return
+
+        for name, entries in drift._asdict().items():
+            if not entries:
+                continue
+            self.stdout.write(self.style.WARNING(f"{len(entries)} drifted {name} rows"))
+            for key, stored, expected in entries[:10]:
+                self.stdout.write(f"  {key}: stored={stored} expected={expected}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musik_lib', '0006_album_trackincollection_album'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:23
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_totals(apps, schema_editor):
+    Collection = apps.get_model('musik_lib', 'Collection')
+    collections = list(
+        Collection.objects.annotate(
+            tracks_count=Count('trackincollection'),
+            tracks_duration=Sum('trackincollection__track__duration'),
+        )
+    )
+    for collection in collections:
+        collection.track_count = collection.tracks_count
+        collection.total_duration = collection.tracks_duration or datetime.timedelta()
+    Collection.objects.bulk_update(collections, ['track_count', 'total_duration'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musik_lib', '0007_collection_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='total_duration',
+            field=models.DurationField(default=datetime.timedelta, editable=False),
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='track_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:27
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def backfill_artist_names(apps, schema_editor):
+    Artist = apps.get_model('musik_lib', 'Artist')
+    artist_name = models.Subquery(Artist.objects.filter(pk=models.OuterRef('artist_id')).values('name')[:1])
+    for model_name in ('ArtistFrequencyCollection', 'ArtistFrequencyLibrary'):
+        apps.get_model('musik_lib', model_name).objects.update(artist_name=artist_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musik_lib', '0008_collection_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(django.db.models.functions.text.Upper('name'), models.F('id'), name='artist_upper_name_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='artistfrequencycollection',
+            name='artist_name',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='artistfrequencylibrary',
+            name='artist_name',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(backfill_artist_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='artistfrequencycollection',
+            index=models.Index(models.OrderBy(models.F('frequency'), descending=True), django.db.models.functions.text.Upper('artist_name'), models.F('id'), name='afc_frequency_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artistfrequencylibrary',
+            index=models.Index(models.OrderBy(models.F('frequency'), descending=True), django.db.models.functions.text.Upper('artist_name'), models.F('id'), name='afl_frequency_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='duplicatetrack',
+            index=models.Index(fields=['-frequency', 'track'], name='dt_frequency_track_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['name', 'id'], name='track_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+import hashlib
+import unicodedata
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def track_identity_key(name, artist_ids):
+    """
+    Copy of musik_lib.models.base.track_identity_key as of this migration, so that changing it later does not change
+    what the migration writes
+    """
+    normalized_name = " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+    signature = ",".join(str(artist_id) for artist_id in sorted(set(artist_ids)))
+    return hashlib.sha1(f"{normalized_name}\x00{signature}".encode()).hexdigest()
+
+
+def backfill_identity_keys(apps, schema_editor):
+    Track = apps.get_model('musik_lib', 'Track')
+    track_artist_ids = defaultdict(set)
+    for through in (Track.artist.through, Track.featuring.through):
+        for track_id, artist_id in through.objects.values_list('track_id', 'artist_id'):
+            track_artist_ids[track_id].add(artist_id)
+    tracks = list(Track.objects.only('id', 'name'))
+    for track in tracks:
+        track.identity_key = track_identity_key(track.name, track_artist_ids[track.id])
+    Track.objects.bulk_update(tracks, ['identity_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musik_lib', '0009_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='identity_key',
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(backfill_identity_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['identity_key'], name='track_identity_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trackincollection',
+            index=models.Index(fields=['track', 'collection'], name='tic_track_collection_idx'),
+        ),
+    ]
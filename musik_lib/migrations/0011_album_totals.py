@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:55
+
+import datetime
+from django.db import migrations, models
+
+
+def backfill_totals(apps, schema_editor):
+    Album = apps.get_model('musik_lib', 'Album')
+    TrackInCollection = apps.get_model('musik_lib', 'TrackInCollection')
+    albums = {album.id: album for album in Album.objects.all()}
+    for album_id, _, duration in (
+        TrackInCollection.objects.filter(album__isnull=False)
+        .values_list('album_id', 'track_id', 'track__duration')
+        .distinct()
+    ):
+        albums[album_id].track_count += 1
+        albums[album_id].total_duration += duration
+    Album.objects.bulk_update(albums.values(), ['track_count', 'total_duration'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musik_lib', '0010_track_identity_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='total_duration',
+            field=models.DurationField(default=datetime.timedelta, editable=False),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='track_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='album',
+            name='album_type',
+            field=models.CharField(choices=[('CPN', 'Compilation'), ('STD', 'Studio'), ('SGL', 'Single')], default='CPN', max_length=3),
+        ),
+        migrations.AlterField(
+            model_name='album',
+            name='spotify_id',
+            field=models.CharField(max_length=50, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['name', 'id'], name='album_name_id_idx'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
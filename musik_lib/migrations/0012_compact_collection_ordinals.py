@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:04
+
+from django.db import migrations
+from django.db.models import Count, F, Max, Min, Q
+
+
+def compact_ordinals(apps, schema_editor):
+    """
+    Renumbers the tracks of every collection whose ordinals are not 1 to its track count, keeping their order;
+    Inserts, moves and removes of collection tracks rely on gapless ordinals, which deletes used to leave gaps in
+    """
+    Collection = apps.get_model('musik_lib', 'Collection')
+    TrackInCollection = apps.get_model('musik_lib', 'TrackInCollection')
+    gapped = (
+        Collection.objects.annotate(
+            tracks_count=Count('trackincollection'),
+            first_ordinal=Min('trackincollection__ordinal'),
+            last_ordinal=Max('trackincollection__ordinal'),
+        )
+        .filter(tracks_count__gt=0)
+        .filter(~Q(first_ordinal=1) | ~Q(last_ordinal=F('tracks_count')))
+        .values_list('id', flat=True)
+    )
+    for collection_id in gapped:
+        rows = TrackInCollection.objects.filter(collection_id=collection_id).order_by('ordinal')
+        moves = [
+            (row_id, old_ordinal, new_ordinal)
+            for new_ordinal, (row_id, old_ordinal) in enumerate(rows.values_list('id', 'ordinal'), start=1)
+            if old_ordinal != new_ordinal
+        ]
+        # The rows that move up are the first ones, and go from the last of them, the rest go down from the first,
+        # so that a row always moves to an ordinal no other row has
+        up = [move for move in moves if move[2] > move[1]]
+        down = [move for move in moves if move[2] < move[1]]
+        for row_id, _, new_ordinal in up[::-1] + down:
+            TrackInCollection.objects.filter(pk=row_id).update(ordinal=new_ordinal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musik_lib', '0011_album_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_ordinals, migrations.RunPython.noop),
+    ]
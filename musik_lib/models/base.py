@@ -1,15 +1,29 @@
 import datetime
+import difflib
+import hashlib
 import operator
+import unicodedata
 
-from itertools import chain
+from collections import defaultdict
+from itertools import chain, repeat
 from functools import reduce
+from typing import Iterable
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import Upper
+from django.dispatch import Signal, receiver
 from django.utils.translation import gettext_lazy
 
+from musik_lib.cache import bump_library_version_on_commit
 from musik_lib.validators import validate_year
 
 
+# Sent within the transaction of every write to the tracks of a collection
+# with the collection, and the added and removed track ids; An id repeats for each occurrence
+collection_tracks_changed = Signal()
+
+
 def total_durations(durations):
     """
     Helper function to add durations
@@ -19,6 +33,16 @@ def total_durations(durations):
     return reduce(operator.add, durations, datetime.timedelta())
 
 
+def track_identity_key(name: str, artist_ids: Iterable[int]) -> str:
+    """
+    Identity of a track by its name, regardless of case, spacing and unicode forms, and the set of all its artists
+    :return: a hex digest, so that it fits an indexed column whatever the length of the name
+    """
+    normalized_name = " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+    signature = ",".join(str(artist_id) for artist_id in sorted(set(artist_ids)))
+    return hashlib.sha1(f"{normalized_name}\x00{signature}".encode()).hexdigest()
+
+
 def render_duration(duration):
     """
     Helper function to render duration
@@ -52,6 +76,12 @@ class Artist(models.Model):
     """
     name = models.CharField(max_length=200, unique=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the artist list
+            models.Index(Upper("name"), F("id"), name="artist_upper_name_id_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -77,6 +107,52 @@ class Track(models.Model):
 
     artist = models.ManyToManyField(Artist, related_name='main_artist')
     featuring = models.ManyToManyField(Artist, related_name='featured_artist')
+    # track_identity_key of the name and artists, so that a track is found by them with an indexed lookup;
+    # Kept current on saves that change the name and on changes to the artists
+    identity_key = models.CharField(max_length=40, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the track list
+            models.Index(fields=["name", "id"], name="track_name_id_idx"),
+            models.Index(fields=["identity_key"], name="track_identity_key_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored name, so that a save only recomputes the identity key when the name changed
+        instance._saved_name = instance.__dict__.get("name")
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            self.identity_key = track_identity_key(self.name, ())
+        elif self.name != getattr(self, "_saved_name", None):
+            self.identity_key = track_identity_key(self.name, self._artist_ids())
+        elif kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            # The artist receivers keep the stored key, which this instance may not have seen, so it is not written
+            kwargs["update_fields"] = [
+                f.attname for f in self._meta.concrete_fields
+                if not f.primary_key and f.attname != "identity_key" and f.attname in self.__dict__
+            ]
+        super().save(*args, **kwargs)
+        self._saved_name = self.name
+
+    def _artist_ids(self):
+        return chain(
+            self.artist.values_list("id", flat=True),
+            self.featuring.values_list("id", flat=True),
+        )
+
+    def update_identity_key(self):
+        """
+        Recomputes the stored identity key from the artists in the DB
+        :return: this instance
+        """
+        self.identity_key = track_identity_key(self.name, self._artist_ids())
+        Track.objects.filter(pk=self.pk).update(identity_key=self.identity_key)
+        return self
 
     def __str__(self):
         template = "{} - {} - {}"
@@ -107,10 +183,90 @@ class Track(models.Model):
         return [t.collection for t in tracks_in_collection]
 
 
+@receiver(models.signals.m2m_changed, sender=Track.artist.through)
+@receiver(models.signals.m2m_changed, sender=Track.featuring.through)
+def update_identity_key_on_artists_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the identity keys of tracks whose artists were added or removed, from either side of the relation
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.update_identity_key()
+        return
+    # The tracks of a cleared artist are gone from the relation after the clear, so they are kept from before it
+    if action == "pre_clear":
+        instance._cleared_track_ids = list(
+            sender.objects.filter(artist_id=instance.pk).values_list("track_id", flat=True)
+        )
+    elif action in ("post_add", "post_remove", "post_clear"):
+        track_ids = pk_set if action != "post_clear" else instance.__dict__.pop("_cleared_track_ids", [])
+        for track in Track.objects.filter(pk__in=track_ids):
+            track.update_identity_key()
+
+
+@receiver(models.signals.m2m_changed, sender=Track.artist.through)
+@receiver(models.signals.m2m_changed, sender=Track.featuring.through)
+def send_tracks_changed_on_artists_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The artists of the tracks in collections make up the stats, so the changed tracks are sent as removed from their
+    collections before the change and as added back after it
+    """
+    if action not in ("pre_add", "pre_remove", "pre_clear", "post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        track_ids = [instance.pk]
+    elif action == "pre_clear":
+        track_ids = instance._stats_cleared_track_ids = list(
+            sender.objects.filter(artist_id=instance.pk).values_list("track_id", flat=True)
+        )
+    elif action == "post_clear":
+        track_ids = instance.__dict__.pop("_stats_cleared_track_ids", [])
+    else:
+        track_ids = pk_set
+    if (pk_set is not None and not pk_set) or not track_ids:
+        return
+    _send_tracks_changed(track_ids, added=action.startswith("post_"))
+
+
+@receiver(models.signals.pre_delete, sender=Artist)
+def clear_tracks_before_delete(sender, instance: Artist, **kwargs):
+    """
+    Clears the tracks of an artist before it is deleted, instead of the cascade, so that m2m_changed keeps the stats
+    and the identity keys of the tracks
+    """
+    instance.main_artist.clear()
+    instance.featured_artist.clear()
+
+
+def _send_tracks_changed(track_ids, added: bool):
+    """
+    Sends collection_tracks_changed for every collection of the tracks, with their occurrences as added or as removed;
+    The tracks stay in the collections, so their totals are not changed
+    """
+    occurrences = defaultdict(list)
+    for collection_id, track_id in TrackInCollection.objects.filter(track_id__in=track_ids).values_list(
+            "collection_id", "track_id",
+    ):
+        occurrences[collection_id].append(track_id)
+    for collection in Collection.objects.filter(id__in=occurrences):
+        collection_tracks_changed.send(
+            sender=Collection,
+            collection=collection,
+            added=occurrences[collection.id] if added else [],
+            removed=[] if added else occurrences[collection.id],
+        )
+
+
 class Collection(models.Model):
     """
     Collection stores some tracks
+
+    The tracks are ordered by the ordinals of their TrackInCollection rows, which are kept gapless from 1;
+    Inserting, removing and moving tracks renumber the rows after them in two statements, see _renumber
     """
+    # Ordinals are moved past it, and then back to their new values, so that no two rows ever share an ordinal;
+    # Bounds the number of tracks in a collection, as ordinals are small integers
+    ORDINAL_SHIFT = 16384
 
     name = models.CharField(max_length=200)
     nick_name = models.CharField(max_length=200, null=True)
@@ -118,6 +274,11 @@ class Collection(models.Model):
 
     created_year = models.PositiveSmallIntegerField(validators=[validate_year])
     ordinal = models.PositiveSmallIntegerField(unique=True, null=True)
+    # Hash of the collection file content it was ingested from
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Totals of the tracks in the collection, kept current on every change to its tracks
+    track_count = models.PositiveIntegerField(default=0, editable=False)
+    total_duration = models.DurationField(default=datetime.timedelta, editable=False)
 
     def __str__(self):
         template = "name={} , nick_name = {}, duration = {}"
@@ -126,12 +287,28 @@ class Collection(models.Model):
 
     @property
     def duration(self):
-        return total_durations(
-            [t.duration for t in self.tracks]
-        )
+        return self.total_duration
 
     def number_of_tracks(self):
-        return self.trackincollection_set.count() if hasattr(self, "trackincollection_set") else 0
+        return self.track_count
+
+    def update_totals(self):
+        """
+        Recomputes the stored track count and duration from the tracks in the collection, with a DB side aggregate;
+        Edits of the tracks move the totals by the tracks they add and remove, so this repairs drifted totals
+        :return: this instance
+        """
+        totals = self.trackincollection_set.aggregate(
+            track_count=Count("id"),
+            total_duration=Sum("track__duration"),
+        )
+        self.track_count = totals["track_count"]
+        self.total_duration = totals["total_duration"] or datetime.timedelta()
+        Collection.objects.filter(pk=self.pk).update(
+            track_count=self.track_count,
+            total_duration=self.total_duration,
+        )
+        return self
 
     @property
     def tracks(self):
@@ -143,24 +320,272 @@ class Collection(models.Model):
         :param tracks: Track objects. Assume that the order of this list maps to their order in the collection
         :return:
         """
-        start_index = self.number_of_tracks() + 1
-        for ind, track in enumerate(tracks):
-            TrackInCollection.objects.create(track=track, collection=self, ordinal=start_index + ind)
+        return self.add_track_ids([t.id for t in tracks])
+
+    def add_track_ids(self, track_ids):
+        """
+        Appends tracks to the collection with a single insert
+        :param track_ids: ids of Track objects, in their order in the collection
+        :return:
+        """
+        return self.insert_track_ids(track_ids)
+
+    def insert_track_ids(self, track_ids, position=None):
+        """
+        Inserts tracks with a single insert, after shifting the tracks from the position on
+        :param track_ids: ids of Track objects, in their order in the collection
+        :param position: ordinal of the first inserted track; Appends when None
+        :return: this instance
+        """
+        track_ids = list(track_ids)
+        with transaction.atomic():
+            track_count = self._locked_track_count()
+            if position is None:
+                position = track_count + 1
+            if not 1 <= position <= track_count + 1:
+                raise ValueError(f"Position {position} is out of 1 to {track_count + 1}")
+            if track_count + len(track_ids) >= self.ORDINAL_SHIFT:
+                raise ValueError(f"A collection holds less than {self.ORDINAL_SHIFT} tracks")
+            if track_ids and position <= track_count:
+                self._renumber(Q(ordinal__gte=position), F("ordinal") + len(track_ids))
+            TrackInCollection.objects.bulk_create(
+                [
+                    TrackInCollection(track_id=track_id, collection=self, ordinal=position + ind)
+                    for ind, track_id in enumerate(track_ids)
+                ]
+            )
+            self._tracks_changed(added=track_ids, removed=[])
+        return self
+
+    def remove_tracks(self, position, count=1):
+        """
+        Removes tracks with a single delete, and shifts the tracks after them back
+        :param position: ordinal of the first removed track
+        :param count: number of consecutive tracks to remove
+        :return: this instance
+        """
+        with transaction.atomic():
+            track_count = self._locked_track_count()
+            if count < 1 or not 1 <= position <= track_count - count + 1:
+                raise ValueError(f"Tracks {position} to {position + count - 1} are out of 1 to {track_count}")
+            removed = self.trackincollection_set.filter(ordinal__gte=position, ordinal__lt=position + count)
+            removed_track_ids, removed_album_ids = zip(*removed.values_list("track_id", "album_id"))
+            removed.delete()
+            if position + count <= track_count:
+                self._renumber(Q(ordinal__gte=position + count), F("ordinal") - count)
+            Album.update_totals_of(removed_album_ids)
+            self._tracks_changed(added=[], removed=list(removed_track_ids))
+        return self
+
+    def move_tracks(self, position, to_position, count=1):
+        """
+        Moves consecutive tracks, so that the first of them is at to_position, in two statements
+        :param position: ordinal of the first moved track
+        :param to_position: ordinal of the first moved track after the move
+        :param count: number of consecutive tracks to move
+        :return: this instance
+        """
+        with transaction.atomic():
+            track_count = self._locked_track_count()
+            last_position = track_count - count + 1
+            if count < 1 or not 1 <= position <= last_position or not 1 <= to_position <= last_position:
+                raise ValueError(f"Moving {count} tracks from {position} to {to_position} is out of 1 to {track_count}")
+            if position == to_position:
+                return self
+            moved = Q(ordinal__gte=position, ordinal__lt=position + count)
+            if to_position < position:
+                # The tracks between the destination and the moved tracks go after them
+                self._renumber(
+                    Q(ordinal__gte=to_position, ordinal__lt=position + count),
+                    Case(When(moved, then=F("ordinal") - (position - to_position)), default=F("ordinal") + count),
+                )
+            else:
+                # The tracks between the moved tracks and their destination go before them
+                self._renumber(
+                    Q(ordinal__gte=position, ordinal__lt=to_position + count),
+                    Case(When(moved, then=F("ordinal") + (to_position - position)), default=F("ordinal") - count),
+                )
+            # The tracks of the collection did not change, so there is no collection_tracks_changed
+            bump_library_version_on_commit()
+        return self
+
+    def _locked_track_count(self):
+        """
+        Reads the stored track count, which is the last ordinal, and locks the collection row until the transaction ends
+        """
+        self.track_count = Collection.objects.select_for_update().values_list("track_count", flat=True).get(pk=self.pk)
+        return self.track_count
+
+    def _renumber(self, rows: Q, new_ordinal):
+        """
+        Sets the ordinals of the rows of the collection to new_ordinal, which gives the rows distinct ordinals
+        that no other row of the collection has; Two updates, whatever the number of rows,
+        as they first go past ORDINAL_SHIFT, where no ordinal is, and then back
+        """
+        tracks_in_collection = self.trackincollection_set
+        tracks_in_collection.filter(rows).update(ordinal=new_ordinal + self.ORDINAL_SHIFT)
+        tracks_in_collection.filter(ordinal__gt=self.ORDINAL_SHIFT).update(ordinal=F("ordinal") - self.ORDINAL_SHIFT)
+
+    def set_track_ids(self, track_ids, album_ids=None):
+        """
+        Makes the collection hold exactly these tracks, in that order.
+        The current and the new tracks are diffed by their (track, album) identity, so rows of tracks that stay keep
+        their row, and a run of them that moves is renumbered by one statement, see _renumber_blocks;
+        Rows of replaced tracks are updated in place, and the rest are deleted or inserted
+
+        :param track_ids: ids of Track objects, in their order in the collection
+        :param album_ids: ids of the Album objects of the tracks, None for a track without an album;
+        No albums when None
+        :return:
+        """
+        new_keys = list(zip(track_ids, album_ids if album_ids is not None else repeat(None)))
+        if len(new_keys) >= self.ORDINAL_SHIFT:
+            raise ValueError(f"A collection holds less than {self.ORDINAL_SHIFT} tracks")
+        with transaction.atomic():
+            current = list(
+                self.trackincollection_set.order_by("ordinal").values_list("id", "track_id", "album_id")
+            )
+            current_keys = [(track_id, album_id) for _, track_id, album_id in current]
+            to_update = []
+            to_create = []
+            to_delete = []
+            # (first ordinal, last ordinal + 1, shift) of runs of rows that stay, in the current ordinals
+            blocks = []
+            added = []
+            removed = []
+            changed_album_ids = set()
+            matcher = difflib.SequenceMatcher(None, current_keys, new_keys, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                kept = i2 - i1 if tag == "equal" else min(i2 - i1, j2 - j1) if tag == "replace" else 0
+                if kept and j1 != i1:
+                    blocks.append((i1 + 1, i1 + kept + 1, j1 - i1))
+                if tag == "replace":
+                    for (tic_id, current_track_id, current_album_id), (track_id, album_id) in zip(
+                            current[i1:i1 + kept], new_keys[j1:j1 + kept],
+                    ):
+                        to_update.append(TrackInCollection(id=tic_id, track_id=track_id, album_id=album_id))
+                        changed_album_ids.update((current_album_id, album_id))
+                        if current_track_id != track_id:
+                            added.append(track_id)
+                            removed.append(current_track_id)
+                if tag != "equal":
+                    for tic_id, track_id, album_id in current[i1 + kept:i2]:
+                        to_delete.append(tic_id)
+                        removed.append(track_id)
+                        changed_album_ids.add(album_id)
+                    for ordinal, (track_id, album_id) in enumerate(new_keys[j1 + kept:j2], start=j1 + kept + 1):
+                        to_create.append(
+                            TrackInCollection(track_id=track_id, collection=self, ordinal=ordinal, album_id=album_id)
+                        )
+                        added.append(track_id)
+                        changed_album_ids.add(album_id)
+
+            if to_delete:
+                TrackInCollection.objects.filter(id__in=to_delete).delete()
+            if to_update:
+                TrackInCollection.objects.bulk_update(to_update, ["track", "album"])
+            self._renumber_blocks(blocks)
+            if to_create:
+                TrackInCollection.objects.bulk_create(to_create)
+            Album.update_totals_of(changed_album_ids)
+            self._tracks_changed(added=added, removed=removed)
         return self
 
+    def _renumber_blocks(self, blocks):
+        """
+        Shifts runs of consecutive rows, a statement for each run and one more, like _renumber
+        :param blocks: (first ordinal, last ordinal + 1, shift) of each run; The shifted ordinals must be free
+        """
+        if not blocks:
+            return
+        tracks_in_collection = self.trackincollection_set
+        for start, end, shift in blocks:
+            tracks_in_collection.filter(ordinal__gte=start, ordinal__lt=end).update(
+                ordinal=F("ordinal") + shift + self.ORDINAL_SHIFT
+            )
+        tracks_in_collection.filter(ordinal__gt=self.ORDINAL_SHIFT).update(ordinal=F("ordinal") - self.ORDINAL_SHIFT)
+
+    def _tracks_changed(self, added, removed):
+        if added or removed:
+            self._apply_totals_delta(added, removed)
+            collection_tracks_changed.send(
+                sender=Collection,
+                collection=self,
+                added=added,
+                removed=removed,
+            )
+
+    def _apply_totals_delta(self, added, removed):
+        """
+        Moves the stored totals by the added and removed tracks, without an aggregate over the whole collection
+        :param added: ids of the added tracks, an id for each occurrence
+        :param removed: ids of the removed tracks, an id for each occurrence
+        """
+        durations = dict(Track.objects.filter(id__in=set(added) | set(removed)).values_list("id", "duration"))
+        track_count, total_duration = Collection.objects.values_list("track_count", "total_duration").get(pk=self.pk)
+        self.track_count = track_count + len(added) - len(removed)
+        self.total_duration = (
+            total_duration
+            + total_durations(durations[track_id] for track_id in added)
+            - total_durations(durations[track_id] for track_id in removed)
+        )
+        Collection.objects.filter(pk=self.pk).update(
+            track_count=self.track_count,
+            total_duration=self.total_duration,
+        )
+
+
+@receiver(models.signals.pre_delete, sender=Collection)
+def remove_tracks_before_delete(sender, instance: Collection, **kwargs):
+    """
+    Empties a collection before it is deleted, so that receivers of collection_tracks_changed see its tracks go
+    """
+    instance.set_track_ids([])
+
+
+def _remove_from_collections(field: str, instance):
+    """
+    Removes the rows of the collections whose field is instance, instead of the cascade of its delete,
+    so that the ordinals of the collections stay gapless and their totals, albums and stats follow
+    """
+    for collection in Collection.objects.filter(**{f"trackincollection__{field}": instance}).distinct():
+        rows = list(
+            collection.trackincollection_set
+            .exclude(**{field: instance})
+            .order_by("ordinal")
+            .values_list("track_id", "album_id")
+        )
+        collection.set_track_ids([track_id for track_id, _ in rows], [album_id for _, album_id in rows])
+
+
+@receiver(models.signals.pre_delete, sender=Track)
+def remove_track_from_collections_before_delete(sender, instance: Track, **kwargs):
+    _remove_from_collections("track", instance)
+
 
 class Album(models.Model):
     """
-    Collection stores some tracks
+    Album of tracks in collections; Albums of spotify tracks are ingested with them, keyed by their spotify id
     """
 
     name = models.CharField(max_length=200)
     created_year = models.PositiveSmallIntegerField(validators=[validate_year])
-    spotify_id = models.CharField(max_length=50, null=True)
+    spotify_id = models.CharField(max_length=50, null=True, unique=True)
+    # Totals of the distinct tracks of the album, kept current on every change to the tracks in collections
+    track_count = models.PositiveIntegerField(default=0, editable=False)
+    total_duration = models.DurationField(default=datetime.timedelta, editable=False)
 
     class AlbumType(models.TextChoices):
         COMPILATION = 'CPN', gettext_lazy('Compilation')
         STUDIO = 'STD', gettext_lazy('Studio')
+        SINGLE = 'SGL', gettext_lazy('Single')
+
+    # Album types by the album_type of the spotify API
+    SPOTIFY_ALBUM_TYPES = {
+        "album": AlbumType.STUDIO,
+        "single": AlbumType.SINGLE,
+        "compilation": AlbumType.COMPILATION,
+    }
 
     album_type = models.CharField(
         max_length=3,
@@ -168,20 +593,31 @@ class Album(models.Model):
         default=AlbumType.COMPILATION,
     )
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the album list
+            models.Index(fields=["name", "id"], name="album_name_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.created_year}"
 
+    @property
+    def duration(self):
+        return self.total_duration
+
     def number_of_tracks(self):
-        if not hasattr(self, "trackincollection_set"):
-            return 0
-        return self.trackincollection_set.count()
+        return self.track_count
 
     @property
     def tracks(self):
-        return [
+        """
+        Distinct tracks of the album, in the order they were first added to a collection with it
+        """
+        return list(dict.fromkeys(
             t.track for t
-            in self.trackincollection_set
-        ]
+            in self.trackincollection_set.order_by("id").select_related("track")
+        ))
 
     def add_a_track(self, a_track: 'TrackInCollection'):
         """
@@ -191,8 +627,40 @@ class Album(models.Model):
         """
         a_track.album = self
         a_track.save()
+        Album.update_totals_of([self.id])
+        self.refresh_from_db(fields=["track_count", "total_duration"])
         return self
 
+    @classmethod
+    def update_totals_of(cls, album_ids):
+        """
+        Recomputes the stored totals of the albums from their distinct tracks, with a query for all of them
+        :param album_ids: ids of albums; None ids are skipped
+        """
+        album_ids = {album_id for album_id in album_ids if album_id is not None}
+        if not album_ids:
+            return
+        totals = {album_id: (0, datetime.timedelta()) for album_id in album_ids}
+        for album_id, _, duration in (
+            TrackInCollection.objects.filter(album_id__in=album_ids)
+            .values_list("album_id", "track_id", "track__duration")
+            .distinct()
+        ):
+            track_count, total_duration = totals[album_id]
+            totals[album_id] = (track_count + 1, total_duration + duration)
+        cls.objects.bulk_update(
+            [
+                cls(id=album_id, track_count=track_count, total_duration=total_duration)
+                for album_id, (track_count, total_duration) in totals.items()
+            ],
+            ["track_count", "total_duration"],
+        )
+
+
+@receiver(models.signals.pre_delete, sender=Album)
+def remove_album_from_collections_before_delete(sender, instance: Album, **kwargs):
+    _remove_from_collections("album", instance)
+
 
 class TrackInCollection(models.Model):
     """
@@ -208,6 +676,10 @@ class TrackInCollection(models.Model):
             models.UniqueConstraint(
                 fields=['collection', 'ordinal'], name='Collection and Ordinal')
         ]
+        indexes = [
+            # The collections of tracks, e.g. for the duplicate tracks stats, without reading the rows
+            models.Index(fields=["track", "collection"], name="tic_track_collection_idx"),
+        ]
 
     def __str__(self):
         return "track={} , ordinal = {}".format(self.track, self.ordinal)
@@ -231,9 +703,10 @@ class Library(models.Model):
 
     @property
     def duration(self):
-        return total_durations(
-            [t.duration for t in self.collections]
-        )
+        # Sums the stored collection durations, so it does not scale with the number of tracks
+        return Collection.objects.aggregate(
+            duration=Sum("total_duration"),
+        )["duration"] or datetime.timedelta()
 
     @property
     def collections(self):
@@ -1,9 +1,178 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
 
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Upper
 
+from musik_lib.cache import bump_library_version_on_commit, cached_value
 from musik_lib.models.base import *
 
 
+class StatsDrift(NamedTuple):
+    """
+    Differences between the stored stats and the stats computed from the tracks in collections;
+    Every entry is (key, stored frequency, expected frequency) with 0 for a missing row.
+    Collection totals entries are (collection id, stored (track count, duration), expected (track count, duration))
+    """
+    artist_frequency_collection: List[Tuple]
+    artist_frequency_library: List[Tuple]
+    duplicate_tracks: List[Tuple]
+    collection_totals: List[Tuple]
+
+    def __bool__(self):
+        return any((
+            self.artist_frequency_collection,
+            self.artist_frequency_library,
+            self.duplicate_tracks,
+            self.collection_totals,
+        ))
+
+
+def _track_artist_ids(track_ids: Iterable[int]) -> Tuple[Dict[int, List[int]], Dict[int, str]]:
+    """
+    :return: artist ids of each track, main artists and featuring, and the names of those artists, in two queries
+    """
+    track_artists = defaultdict(list)
+    artist_names = {}
+    for through in (Track.artist.through, Track.featuring.through):
+        for track_id, artist_id, artist_name in (
+            through.objects.filter(track_id__in=track_ids).values_list("track_id", "artist_id", "artist__name")
+        ):
+            track_artists[track_id].append(artist_id)
+            artist_names[artist_id] = artist_name
+    return track_artists, artist_names
+
+
+def _apply_frequency_deltas(queryset, deltas: Dict[int, int], make_row):
+    """
+    Adds deltas to the frequency of artist rows in queryset; rows dropping to zero are deleted
+    :param queryset: artist frequency rows of a single collection stat or library stat
+    :param deltas: frequency delta by artist id
+    :param make_row: creates a new row for an artist id and frequency
+    """
+    rows = {row.artist_id: row for row in queryset.filter(artist_id__in=deltas.keys())}
+    to_update, to_delete, to_create = [], [], []
+    for artist_id, delta in deltas.items():
+        if not delta:
+            continue
+        row = rows.get(artist_id)
+        frequency = (row.frequency if row else 0) + delta
+        if row is None:
+            if frequency > 0:
+                to_create.append(make_row(artist_id, frequency))
+        elif frequency > 0:
+            row.frequency = frequency
+            to_update.append(row)
+        else:
+            to_delete.append(row.id)
+
+    if to_delete:
+        queryset.filter(id__in=to_delete).delete()
+    if to_update:
+        queryset.model.objects.bulk_update(to_update, ["frequency"])
+    if to_create:
+        queryset.model.objects.bulk_create(to_create)
+
+
+def _artist_frequencies(group_by: Tuple[str, ...] = (), **filters) -> Counter:
+    """
+    Counts the occurrences of every artist in collections with a GROUP BY query
+    for each of the main artists and featuring relations
+
+    :param group_by: TrackInCollection fields to count by, along with the artist id
+    :param filters: TrackInCollection filters
+    :return: frequency by (*group_by values, artist id), or by artist id when group_by is empty
+    """
+    frequencies = Counter()
+    for relation in ("track__artist", "track__featuring"):
+        rows = (
+            TrackInCollection.objects.filter(**filters)
+            .filter(**{f"{relation}__isnull": False})
+            .values(*group_by, relation)
+            .annotate(frequency=Count("id"))
+            .values_list(*group_by, relation, "frequency")
+        )
+        for *key, frequency in rows:
+            frequencies[tuple(key) if group_by else key[0]] += frequency
+    return frequencies
+
+
+def _track_frequencies(**filters) -> Dict[int, int]:
+    """
+    :return: the number of times each track appears in collections, for tracks appearing more than once
+    """
+    return dict(
+        TrackInCollection.objects.filter(**filters)
+        .values("track_id")
+        .annotate(frequency=Count("id"))
+        .filter(frequency__gt=1)
+        .values_list("track_id", "frequency")
+    )
+
+
+def _sync_frequencies(
+        queryset,
+        key_fields: Tuple[str, ...],
+        expected: Dict,
+        make_row,
+        unique_fields=None,
+        update_fields=("frequency",),
+):
+    """
+    Makes the frequency rows in queryset equal to expected: upserts in bulk and deletes the rest
+
+    :param queryset: the frequency rows to sync
+    :param key_fields: field names that make the key of expected, unique within queryset
+    :param expected: frequency by key
+    :param make_row: creates a row for a key and frequency
+    :param unique_fields: fields of the unique constraint to upsert on, defaults to key_fields
+    :param update_fields: fields of the existing rows that the upsert updates
+    """
+    stale = [
+        row_id for row_id, *key
+        in queryset.values_list("pk", *[f"{f}_id" for f in key_fields])
+        if (tuple(key) if len(key) > 1 else key[0]) not in expected
+    ]
+    if stale:
+        queryset.filter(pk__in=stale).delete()
+    queryset.model.objects.bulk_create(
+        [make_row(key, frequency) for key, frequency in expected.items()],
+        update_conflicts=True,
+        unique_fields=list(unique_fields or key_fields),
+        update_fields=list(update_fields),
+    )
+
+
+def _artist_names(artist_ids: Iterable[int] = None) -> Dict[int, str]:
+    """
+    :return: name by id of the artists, or of all artists when artist_ids is None
+    """
+    artists = Artist.objects.all() if artist_ids is None else Artist.objects.filter(pk__in=artist_ids)
+    return dict(artists.values_list("id", "name"))
+
+
+def _collection_totals() -> Dict[int, Tuple[int, datetime.timedelta]]:
+    """
+    :return: track count and duration of every collection, computed from its tracks with a single aggregation
+    """
+    return {
+        collection_id: (track_count, duration or datetime.timedelta())
+        for collection_id, track_count, duration
+        in Collection.objects.annotate(
+            tracks_count=Count("trackincollection"),
+            tracks_duration=Sum("trackincollection__track__duration"),
+        ).values_list("id", "tracks_count", "tracks_duration")
+    }
+
+
+def _frequency_drift(stored: Dict, expected: Dict) -> List[Tuple]:
+    return sorted(
+        (key, stored.get(key, 0), expected.get(key, 0))
+        for key in stored.keys() | expected.keys()
+        if stored.get(key, 0) != expected.get(key, 0)
+    )
+
+
 class LibraryStat(models.Model):
     library: Library = models.OneToOneField(
         Library,
@@ -18,63 +187,153 @@ class LibraryStat(models.Model):
 
     @property
     def num_collections(self):
-        return Collection.objects.count()
+        return cached_value("num_collections", Collection.objects.count)
 
     @property
     def num_tracks(self):
-        return Track.objects.count()
+        return cached_value("num_tracks", Track.objects.count)
 
     @property
     def num_artists(self):
-        return Artist.objects.count()
+        return cached_value("num_artists", Artist.objects.count)
 
     @property
     def duration(self):
-        return self.library.duration
+        return cached_value("duration", lambda: self.library.duration)
 
     @property
     def rendered_duration(self) -> str:
         return render_duration(self.duration)
 
     def update(self):
+        """
+        Full recompute of all stats; Stats are otherwise kept up to date on every write to collections
+        so this is for repairing drift, see verify
+        """
+        self.update_collection_totals()
         self.update_collection_stats()
         self.update_artist_frequency_counts()
         self.update_duplicate_tracks()
+        bump_library_version_on_commit()
+
+    def apply_tracks_delta(self, collection: Collection, added: List[int], removed: List[int]):
+        """
+        Updates the stats with tracks that were added to or removed from a collection
+        :param collection: the changed collection
+        :param added: added track ids, an id repeats for each occurrence
+        :param removed: removed track ids, an id repeats for each occurrence
+        """
+        c_stat, _ = CollectionStat.objects.get_or_create(collection=collection)
+
+        track_artists, artist_names = _track_artist_ids(set(added) | set(removed))
+        artist_deltas = Counter()
+        for track_id in added:
+            artist_deltas.update(track_artists[track_id])
+        for track_id in removed:
+            artist_deltas.subtract(track_artists[track_id])
+
+        _apply_frequency_deltas(
+            c_stat.artistfrequencycollection_set.all(),
+            artist_deltas,
+            lambda artist_id, frequency: ArtistFrequencyCollection(
+                artist_id=artist_id, artist_name=artist_names[artist_id], collection_stat=c_stat, frequency=frequency,
+            ),
+        )
+        _apply_frequency_deltas(
+            self.artistfrequencylibrary_set.all(),
+            artist_deltas,
+            lambda artist_id, frequency: ArtistFrequencyLibrary(
+                artist_id=artist_id, artist_name=artist_names[artist_id], library_stat=self, frequency=frequency,
+            ),
+        )
+        self._update_duplicate_tracks_of(set(added) | set(removed))
+
+    def _update_duplicate_tracks_of(self, track_ids):
+        """
+        Recounts the duplicate tracks among track_ids and links them to the stats of their collections
+        """
+        self._sync_duplicate_tracks(
+            DuplicateTrack.objects.filter(track_id__in=track_ids),
+            _track_frequencies(track_id__in=track_ids),
+        )
+
+    def verify(self) -> StatsDrift:
+        """
+        Compares the stored stats with the stats computed from the tracks in collections
+        :return: the drift, falsy when there is none
+        """
+        stored_afc = {
+            (collection_id, artist_id): frequency
+            for collection_id, artist_id, frequency
+            in ArtistFrequencyCollection.objects.values_list("collection_stat_id", "artist_id", "frequency")
+        }
+        stored_afl = dict(self.artistfrequencylibrary_set.values_list("artist_id", "frequency"))
+        stored_dt = dict(DuplicateTrack.objects.values_list("track_id", "frequency"))
+        stored_totals = {
+            collection_id: (track_count, duration)
+            for collection_id, track_count, duration
+            in Collection.objects.values_list("id", "track_count", "total_duration")
+        }
+
+        return StatsDrift(
+            artist_frequency_collection=_frequency_drift(stored_afc, _artist_frequencies(("collection_id",))),
+            artist_frequency_library=_frequency_drift(stored_afl, _artist_frequencies()),
+            duplicate_tracks=_frequency_drift(stored_dt, _track_frequencies()),
+            collection_totals=_frequency_drift(stored_totals, _collection_totals()),
+        )
+
+    def update_collection_totals(self):
+        """
+        Recomputes the stored track count and duration of all collections with a single aggregation
+        """
+        Collection.objects.bulk_update(
+            [
+                Collection(id=collection_id, track_count=track_count, total_duration=duration)
+                for collection_id, (track_count, duration) in _collection_totals().items()
+            ],
+            ["track_count", "total_duration"],
+        )
 
     def update_collection_stats(self):
-        for coll in self.library.collections:
-            c_stat, _ = CollectionStat.objects.get_or_create(collection=coll)
-            c_stat.update()
+        """
+        Recomputes the artist frequencies of all collections with a single aggregation
+        """
+        CollectionStat.objects.bulk_create(
+            [
+                CollectionStat(collection_id=collection_id)
+                for collection_id in self.library.collections.values_list("id", flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+        # The collection stat primary key is its collection id
+        artist_names = _artist_names()
+        _sync_frequencies(
+            ArtistFrequencyCollection.objects.all(),
+            ("collection_stat", "artist"),
+            _artist_frequencies(("collection_id",)),
+            lambda key, frequency: ArtistFrequencyCollection(
+                collection_stat_id=key[0], artist_id=key[1], artist_name=artist_names[key[1]], frequency=frequency,
+            ),
+            unique_fields=("artist", "collection_stat"),
+            update_fields=("frequency", "artist_name"),
+        )
 
     def update_artist_frequency_counts(self):
         """
 
         :return:
         """
-
-        frequency_counts = defaultdict(int)
-        unique_artists = dict()
-
-        def add_collection_counts(cafcs):
-            for cafc in cafcs:
-                frequency_counts[cafc.artist.id] += cafc.frequency
-                unique_artists[cafc.artist.id] = cafc.artist
-
-        def add_artist_frequency_library(artist, frequency):
-            afl, _ = ArtistFrequencyLibrary.objects.get_or_create(
-                artist=artist,
-                library_stat=self,
-            )
-            afl.frequency = frequency
-            afl.save()
-            self.artistfrequencylibrary_set.add(afl)
-
-        for c_stat in self.collection_stats:
-            add_collection_counts(c_stat.update_artist_frequency_counts())
-
-        for aid, freq in frequency_counts.items():
-            add_artist_frequency_library(unique_artists[aid], freq)
-        
+        artist_names = _artist_names()
+        _sync_frequencies(
+            self.artistfrequencylibrary_set.all(),
+            ("artist",),
+            _artist_frequencies(),
+            lambda artist_id, frequency: ArtistFrequencyLibrary(
+                artist_id=artist_id, artist_name=artist_names[artist_id], library_stat=self, frequency=frequency,
+            ),
+            unique_fields=("artist", "library_stat"),
+            update_fields=("frequency", "artist_name"),
+        )
         return self.artistfrequencylibrary_set.all()
 
     @property
@@ -82,20 +341,46 @@ class LibraryStat(models.Model):
         return CollectionStat.objects.all()
 
     def update_duplicate_tracks(self):
-        track_counts = [
-            (track, c_stat, track.trackincollection_set.count()) for c_stat in self.collection_stats
-            for track in c_stat.collection.tracks
-        ]
-        duplicate_tracks = [tup for tup in track_counts if tup[2] > 1]
-
-        for track, c_stat, frequency in duplicate_tracks:
-            dt = DuplicateTrack.objects.get_or_create(track=track)[0]
-            dt.frequency = frequency
-            dt.save()
-            c_stat.duplicate_tracks.add(dt)
-            c_stat.save()
+        self._sync_duplicate_tracks(DuplicateTrack.objects.all(), _track_frequencies())
         return DuplicateTrack.objects.all()
 
+    @staticmethod
+    def _sync_duplicate_tracks(queryset, frequencies: Dict[int, int]):
+        """
+        Makes the duplicate tracks in queryset equal to frequencies
+        and links each to the stats of the collections it is in
+        """
+        _sync_frequencies(
+            queryset,
+            ("track",),
+            frequencies,
+            lambda track_id, frequency: DuplicateTrack(track_id=track_id, frequency=frequency),
+        )
+
+        # The collection stat primary key is its collection id and the duplicate track one is its track id
+        links = CollectionStat.duplicate_tracks.through
+        expected_links = set(
+            TrackInCollection.objects.filter(
+                track_id__in=frequencies.keys(),
+                collection__collectionstat__isnull=False,
+            ).values_list("collection_id", "track_id").distinct()
+        )
+        current_links = {
+            (collection_id, track_id): link_id
+            for link_id, collection_id, track_id
+            in links.objects.filter(duplicatetrack_id__in=frequencies.keys())
+            .values_list("id", "collectionstat_id", "duplicatetrack_id")
+        }
+        links.objects.filter(
+            id__in=[link_id for key, link_id in current_links.items() if key not in expected_links]
+        ).delete()
+        links.objects.bulk_create(
+            [
+                links(collectionstat_id=collection_id, duplicatetrack_id=track_id)
+                for collection_id, track_id in expected_links - current_links.keys()
+            ]
+        )
+
 
 class DuplicateTrack(models.Model):
     track = models.OneToOneField(
@@ -106,6 +391,12 @@ class DuplicateTrack(models.Model):
 
     frequency = models.PositiveSmallIntegerField(default=2)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the duplicate tracks list
+            models.Index(fields=['-frequency', 'track'], name='dt_frequency_track_idx'),
+        ]
+
     def __str__(self):
         return "{} - {}".format(self.track, self.frequency)
 
@@ -137,23 +428,18 @@ class CollectionStat(models.Model):
 
         :return: updated artist frequency counts of this collection stat
         """
-        frequency_counts = defaultdict(int)
-        unique_artists = dict()
-
-        artists = [a for track in self.collection.tracks for a in track.artists]
-        for artist in artists:
-            frequency_counts[artist.id] += 1
-            unique_artists[artist.id] = artist
-
-        for artist_id, frequency in frequency_counts.items():
-            artist = unique_artists[artist_id]
-            afc = ArtistFrequencyCollection.objects.get_or_create(
-                artist=artist,
-                collection_stat=self,
-            )[0]
-            afc.frequency = frequency
-            afc.save()
-            self.artistfrequencycollection_set.add(afc)
+        frequencies = _artist_frequencies(collection_id=self.collection_id)
+        artist_names = _artist_names(frequencies.keys())
+        _sync_frequencies(
+            self.artistfrequencycollection_set.all(),
+            ("artist",),
+            frequencies,
+            lambda artist_id, frequency: ArtistFrequencyCollection(
+                artist_id=artist_id, artist_name=artist_names[artist_id], collection_stat=self, frequency=frequency,
+            ),
+            unique_fields=("artist", "collection_stat"),
+            update_fields=("frequency", "artist_name"),
+        )
         return self.artistfrequencycollection_set.all()
 
 
@@ -167,19 +453,40 @@ class ArtistFrequencyCollection(models.Model):
         on_delete=models.CASCADE
     )
     frequency = models.PositiveSmallIntegerField(default=1)
+    # Copy of the artist name, so that the list is paged by an index of the frequency and the name without a join;
+    # Kept current on the artist save
+    artist_name = models.CharField(max_length=200, default="", editable=False)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=['artist', 'collection_stat'], name='Artist And Collection')
         ]
+        indexes = [
+            # Keyset pagination of the list, which is by frequency and then the artist name
+            models.Index(F('frequency').desc(), Upper('artist_name'), F('id'), name='afc_frequency_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.artist_name:
+            self.artist_name = self.artist.name
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return "{} - {}".format(self.artist.name, self.frequency)
 
     @property
     def tracks(self):
-        return [t for t in self.collection_stat.collection.tracks if t.artist == self.artist]
+        tracks_in_collection = (
+            TrackInCollection.objects
+            .filter(collection_id=self.collection_stat_id)
+            .filter(models.Q(track__artist=self.artist_id) | models.Q(track__featuring=self.artist_id))
+            .distinct()
+            .order_by("ordinal")
+            .select_related("track")
+            .prefetch_related("track__artist", "track__featuring")
+        )
+        return [t.track for t in tracks_in_collection]
 
 
 class ArtistFrequencyLibrary(models.Model):
@@ -192,12 +499,24 @@ class ArtistFrequencyLibrary(models.Model):
         on_delete=models.CASCADE
     )
     frequency = models.PositiveSmallIntegerField(default=1)
+    # Copy of the artist name, so that the list is paged by an index of the frequency and the name without a join;
+    # Kept current on the artist save
+    artist_name = models.CharField(max_length=200, default="", editable=False)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=['artist', 'library_stat'], name='Artist And Library')
         ]
+        indexes = [
+            # Keyset pagination of the list, which is by frequency and then the artist name
+            models.Index(F('frequency').desc(), Upper('artist_name'), F('id'), name='afl_frequency_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.artist_name:
+            self.artist_name = self.artist.name
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return "{} - {}".format(self.artist.name, self.frequency)
@@ -205,3 +524,27 @@ class ArtistFrequencyLibrary(models.Model):
     @property
     def tracks(self):
         return self.artist.tracks
+
+
+@receiver(collection_tracks_changed, sender=Collection)
+def update_stats_on_tracks_changed(sender, collection: Collection, added: List[int], removed: List[int], **kwargs):
+    LibraryStat.load().apply_tracks_delta(collection, added, removed)
+    bump_library_version_on_commit()
+
+
+@receiver(models.signals.post_save, sender=Artist)
+def update_artist_names_on_artist_save(sender, instance: Artist, created: bool, **kwargs):
+    if not created:
+        for model in (ArtistFrequencyCollection, ArtistFrequencyLibrary):
+            model.objects.filter(artist=instance).exclude(artist_name=instance.name).update(artist_name=instance.name)
+
+
+@receiver(models.signals.post_save)
+@receiver(models.signals.post_delete)
+@receiver(models.signals.m2m_changed)
+def bump_library_version_on_write(sender, **kwargs):
+    """
+    Invalidates the cached pages on any write of library models, e.g. from the admin
+    """
+    if sender._meta.app_label == "musik_lib":
+        bump_library_version_on_commit()
@@ -0,0 +1,157 @@
+"""
+Keyset (seek) pagination for list views.
+
+A page starts right after the sort key of the last row of the previous page, instead of skipping an OFFSET of rows,
+so with an index on the sort keys a deep page costs the same as the first one
+"""
+import base64
+import binascii
+import json
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from django.db.models import F, OrderBy, Q
+from django.http import Http404
+
+
+class KeysetPage(NamedTuple):
+    object_list: List
+    next_cursor: Optional[str]
+    previous_cursor: Optional[str]
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> List:
+    """
+    :raise ValueError: when the cursor was not made by encode_cursor for a keyset of that size
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor}") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Invalid cursor {cursor}")
+    return values
+
+
+def seek_filter(keys: List[Tuple[str, bool]], values: List, forward: bool = True) -> Q:
+    """
+    :param keys: (name, descending) of each sort key, the last key must be unique
+    :param values: the sort key values of the row to seek from
+    :param forward: when true, rows after that row in the sort order, otherwise rows before it
+    :return: lexicographic comparison of the sort keys with values
+    """
+    condition = Q()
+    equal = Q()
+    for (name, descending), value in zip(keys, values):
+        lookup = "lt" if descending == forward else "gt"
+        condition |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def keyset_keys(keyset: Tuple[OrderBy, ...]) -> List[Tuple[str, bool]]:
+    """
+    :return: (name, descending) of each sort key of keyset, as annotate_keyset names them
+    """
+    return [(f"keyset_{i}", order_by.descending) for i, order_by in enumerate(keyset)]
+
+
+def annotate_keyset(queryset, keyset: Tuple[OrderBy, ...]):
+    """
+    :return: the queryset with the sort keys of keyset annotated as keyset_<i>, and their keyset_keys
+    """
+    keys = keyset_keys(keyset)
+    queryset = queryset.annotate(
+        **{name: order_by.expression for (name, _), order_by in zip(keys, keyset)}
+    )
+    return queryset, keys
+
+
+def row_cursor(row, keys: List[Tuple[str, bool]]) -> str:
+    """
+    :param row: a row of a queryset annotated by annotate_keyset
+    """
+    return encode_cursor(getattr(row, name) for name, _ in keys)
+
+
+def iter_keyset(
+        queryset,
+        keyset: Tuple[OrderBy, ...],
+        values: Optional[List] = None,
+        chunk_size=1000,
+) -> Iterator[List]:
+    """
+    Iterates the rows of the queryset in the keyset order, a chunk at a time;
+    Every chunk is a query that seeks past the last row of the previous chunk, so only one chunk is held in memory
+    :param values: the sort key values of the row to start after, e.g. a decoded cursor; None starts at the first row
+    :return: chunks of rows, annotated by annotate_keyset
+    """
+    queryset, keys = annotate_keyset(queryset, keyset)
+    queryset = queryset.order_by(*[F(name).desc() if descending else F(name).asc() for name, descending in keys])
+    while True:
+        chunk_queryset = queryset if values is None else queryset.filter(seek_filter(keys, values))
+        rows = list(chunk_queryset[:chunk_size])
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        values = [getattr(rows[-1], name) for name, _ in keys]
+
+
+class KeysetPaginationMixin:
+    """
+    Paginates a ListView by keyset, see the module docs.
+    The page after a row is requested with ?after=<cursor> and the page before it with ?before=<cursor>
+    """
+    paginate_by = 100
+    # Sort order of the list, as OrderBy expressions; The last one must be unique, e.g. the id
+    keyset: Tuple[OrderBy, ...] = ()
+
+    def paginate_queryset(self, queryset, page_size):
+        queryset, keys = annotate_keyset(queryset, self.keyset)
+
+        after = self.request.GET.get("after")
+        before = self.request.GET.get("before")
+        forward = before is None
+        try:
+            if after is not None:
+                queryset = queryset.filter(seek_filter(keys, decode_cursor(after, len(keys))))
+            if before is not None:
+                queryset = queryset.filter(seek_filter(keys, decode_cursor(before, len(keys)), forward=False))
+        except ValueError as e:
+            raise Http404(str(e))
+
+        order = [
+            F(name).desc() if descending == forward else F(name).asc()
+            for name, descending in keys
+        ]
+        # One more row than the page tells whether there is another page
+        rows = list(queryset.order_by(*order)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if not forward:
+            rows.reverse()
+
+        has_next = has_more if forward else True
+        has_previous = (after is not None) if forward else has_more
+        page = KeysetPage(
+            object_list=rows,
+            next_cursor=row_cursor(rows[-1], keys) if rows and has_next else None,
+            previous_cursor=row_cursor(rows[0], keys) if rows and has_previous else None,
+        )
+        return None, page, page.object_list, page.has_other_pages
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from typing import List
 
 from musik_lib.models.stats import *
 
@@ -80,3 +81,43 @@ def collection_stat(collection=None) -> CollectionStat:
     return CollectionStat.objects.get_or_create(
             collection=collection or collection_1(),
     )[0]
+
+
+def bulk_library(num_collections=10, tracks_per_collection=300, num_artists=200, shared_tracks=20) -> List[Collection]:
+    """
+    A library big enough to show per row queries in the views.
+    Every track has a main and a featured artist, and the first tracks are shared by all collections.
+
+    :return: the collections of the library, with their stats updated
+    """
+    artists = Artist.objects.bulk_create(
+        [Artist(name=f"Bulk Artist {i}") for i in range(num_artists)]
+    )
+    num_tracks = shared_tracks + num_collections * (tracks_per_collection - shared_tracks)
+    tracks = Track.objects.bulk_create(
+        [
+            Track(name=f"Bulk Track {i}", duration=timedelta(minutes=3, seconds=i % 60), released_year=2000)
+            for i in range(num_tracks)
+        ]
+    )
+    Track.artist.through.objects.bulk_create(
+        [
+            Track.artist.through(track_id=t.id, artist_id=artists[i % num_artists].id)
+            for i, t in enumerate(tracks)
+        ]
+    )
+    Track.featuring.through.objects.bulk_create(
+        [
+            Track.featuring.through(track_id=t.id, artist_id=artists[(i + 1) % num_artists].id)
+            for i, t in enumerate(tracks)
+        ]
+    )
+
+    shared, own = tracks[:shared_tracks], tracks[shared_tracks:]
+    own_per_collection = tracks_per_collection - shared_tracks
+    collections = []
+    for c in range(num_collections):
+        collection = collection_1(name=f"Bulk Collection {c}", ordinal=c + 1)
+        collection_tracks = shared + own[c * own_per_collection:(c + 1) * own_per_collection]
+        collections.append(collection.add_track_ids([t.id for t in collection_tracks]))
+    return collections
@@ -0,0 +1,157 @@
+import json
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from musik_lib import api
+from musik_lib.cache import bump_library_version
+from musik_lib.models.stats import *
+from musik_lib.tests import fixtures
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def ndjson(response):
+    return [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.t1, cls.t2, cls.t3 = fixtures.track_1(), fixtures.track_2(), fixtures.track_3()
+        cls.c1 = fixtures.collection_1().add_tracks([cls.t1, cls.t2])
+        cls.c2 = fixtures.collection_2().add_tracks([cls.t2, cls.t3])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index(self):
+        response = self.client.get("/lib/api/")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("/lib/api/tracks/", response.json()["resources"]["tracks"])
+
+    def test_collection_detail(self):
+        data = self.client.get(f"/lib/api/collections/{self.c1.id}/").json()
+
+        self.assertEqual(self.c1.name, data["name"])
+        self.assertEqual(2, data["track_count"])
+        self.assertEqual([{"id": self.t1.id, "album": None}, {"id": self.t2.id, "album": None}], data["tracks"])
+
+    def test_track_detail(self):
+        data = self.client.get(f"/lib/api/tracks/{self.t1.id}/").json()
+
+        self.assertEqual(self.t1.name, data["name"])
+        self.assertEqual(self.t1.duration.total_seconds(), data["duration"])
+        self.assertEqual([a.id for a in self.t1.artist.all()], data["artists"])
+
+    def test_unknown_resource_and_object(self):
+        self.assertEqual(404, self.client.get("/lib/api/songs/").status_code)
+        self.assertEqual(404, self.client.get("/lib/api/tracks/0/").status_code)
+
+    def test_pages_hold_all_rows_in_order(self):
+        ids = []
+        url = "/lib/api/tracks/?limit=2"
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(t["id"] for t in data["results"])
+            url = f"/lib/api/tracks/?limit=2&after={data['next']}" if data["next"] else None
+        self.assertEqual(sorted(Track.objects.values_list("id", flat=True)), ids)
+
+    def test_invalid_page_arguments(self):
+        self.assertEqual(404, self.client.get("/lib/api/tracks/?after=nope").status_code)
+        self.assertEqual(404, self.client.get("/lib/api/tracks/?limit=0").status_code)
+        self.assertEqual(404, self.client.get("/lib/api/tracks/?limit=many").status_code)
+
+    def test_ndjson_stream(self):
+        response = self.client.get("/lib/api/artists/?format=ndjson")
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(api.NDJSON_CONTENT_TYPE, response["Content-Type"])
+        self.assertEqual(
+            list(Artist.objects.order_by("id").values("id", "name")),
+            ndjson(response),
+        )
+
+    def test_ndjson_stream_after_cursor(self):
+        first_page = self.client.get("/lib/api/tracks/?limit=1").json()
+        rows = ndjson(self.client.get(f"/lib/api/tracks/?format=ndjson&after={first_page['next']}"))
+        self.assertEqual(Track.objects.count() - 1, len(rows))
+
+    def test_stats(self):
+        data = self.client.get("/lib/api/stats/").json()
+        self.assertEqual((2, 3), (data["num_collections"], data["num_tracks"]))
+
+    def test_export(self):
+        response = self.client.get("/lib/api/export/")
+        records = ndjson(response)
+
+        self.assertTrue(response.streaming)
+        counts = Counter(r["resource"] for r in records)
+        self.assertEqual(2, counts["collections"])
+        self.assertEqual(3, counts["tracks"])
+        self.assertEqual(Artist.objects.count(), counts["artists"])
+        self.assertEqual(DuplicateTrack.objects.count(), counts["duplicate_tracks"])
+        # Resource after resource, in their order
+        exported = list(dict.fromkeys(r["resource"] for r in records))
+        self.assertEqual([name for name in api.RESOURCES if name in exported], exported)
+
+    def test_conditional_get(self):
+        response = self.client.get("/lib/api/tracks/")
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        self.assertEqual(304, self.client.get("/lib/api/tracks/", HTTP_IF_NONE_MATCH=etag).status_code)
+        self.assertEqual(304, self.client.get("/lib/api/tracks/", HTTP_IF_MODIFIED_SINCE=last_modified).status_code)
+        bump_library_version()
+        self.assertEqual(200, self.client.get("/lib/api/tracks/", HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_read_only(self):
+        self.assertEqual(405, self.client.post("/lib/api/tracks/").status_code)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApiStreamTest(TestCase):
+    """
+    Streams query a chunk at a time, so their memory and the cost of every query do not grow with the library
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        fixtures.bulk_library(num_collections=2, tracks_per_collection=100, num_artists=20, shared_tracks=10)
+
+    @contextmanager
+    def chunk_size(self, size):
+        chunk_size = api.STREAM_CHUNK_SIZE
+        api.STREAM_CHUNK_SIZE = size
+        try:
+            yield
+        finally:
+            api.STREAM_CHUNK_SIZE = chunk_size
+
+    def test_stream_queries_by_chunk(self):
+        with self.chunk_size(50), CaptureQueriesContext(connection) as context:
+            rows = ndjson(self.client.get("/lib/api/tracks/?format=ndjson"))
+
+        self.assertEqual(Track.objects.count(), len(rows))
+        self.assertEqual(list(Track.objects.order_by("id").values_list("id", flat=True)), [r["id"] for r in rows])
+        # Every chunk is a query of tracks, and its artists and featuring artists
+        chunks = -(-len(rows) // 50)
+        track_queries = [q for q in context.captured_queries if 'FROM "musik_lib_track"' in q["sql"]]
+        self.assertEqual(chunks, len(track_queries))
+        for q in track_queries:
+            self.assertIn("LIMIT 50", q["sql"])
+
+    def test_export_holds_every_row(self):
+        with self.chunk_size(50):
+            records = ndjson(self.client.get("/lib/api/export/"))
+
+        counts = Counter(r["resource"] for r in records)
+        self.assertEqual(Track.objects.count(), counts["tracks"])
+        self.assertEqual(ArtistFrequencyCollection.objects.count(), counts["artist_frequency_collection"])
+        collections = [r["object"] for r in records if r["resource"] == "collections"]
+        self.assertEqual([100, 100], [len(c["tracks"]) for c in collections])
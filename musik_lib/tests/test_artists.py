@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase
+
+from musik_lib import artists
+from musik_lib.artists import ArtistIndex, ParsedArtists, artist_key, parse_artists
+
+
+class ParseArtistsTest(SimpleTestCase):
+
+    def setUp(self):
+        artists.clear_caches()
+
+    def test_main_and_featuring_artists(self):
+        self.assertEqual(ParsedArtists(("A1", "A2"), ("A3",)), parse_artists("A1 & A2 feat. A3"))
+        self.assertEqual(ParsedArtists(("A1",), ("A2", "A3")), parse_artists("A1 featuring A2 and A3"))
+        self.assertEqual(ParsedArtists(("A1", "A&B"), ()), parse_artists("A1, A\\&B"))
+        self.assertEqual(("A1", "A2", "A3"), parse_artists("A1 מארח את A2, A3").all)
+
+    def test_repeated_fields_are_parsed_once(self):
+        first = parse_artists("A1 & A2")
+        second = parse_artists("A1 & A2")
+
+        self.assertIs(first, second)
+        self.assertEqual(1, parse_artists.cache_info().hits)
+
+
+class ArtistKeyTest(SimpleTestCase):
+
+    def test_spellings_of_an_artist_have_the_same_key(self):
+        self.assertEqual(artist_key("Guns N' Roses"), artist_key("guns  n roses"))
+        self.assertEqual(artist_key("BEYONCÉ"), artist_key("Beyoncé"))
+        self.assertEqual(artist_key("ＡＢＢＡ"), artist_key("abba"))
+        self.assertNotEqual(artist_key("A1"), artist_key("A2"))
+
+    def test_punctuation_only_names_are_kept_apart(self):
+        self.assertNotEqual(artist_key("!!!"), artist_key("?"))
+
+    def test_index_finds_any_spelling(self):
+        index = ArtistIndex([("AC/DC", 1), ("Tabarnak", 2)])
+
+        self.assertEqual(1, index["acdc"])
+        self.assertIn("TABARNAK", index)
+        self.assertIsNone(index.get("Other"))
+        self.assertEqual(2, len(index))
@@ -1,7 +1,12 @@
 
 from datetime import timedelta
+from importlib import import_module
 
+from django.apps import apps
+from django.db import connection
+from django.forms import modelform_factory
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from musik_lib.models.base import *
 from musik_lib.tests import fixtures
@@ -24,6 +29,10 @@ class LibraryTest(TestCase):
 
 class CollectionTest(TestCase):
 
+    def test_derived_fields_are_not_editable(self):
+        form_fields = modelform_factory(Collection, fields="__all__").base_fields
+        self.assertFalse({"fingerprint", "track_count", "total_duration"} & form_fields.keys())
+
     def test_empty_collection_duration(self):
         c = fixtures.collection_1()
         self.assertEqual(c.duration.seconds, 0)
@@ -57,6 +66,33 @@ class CollectionTest(TestCase):
 
         self.assertEqual(c.number_of_tracks(), 2)
 
+    def test_totals_are_stored(self):
+        t1, t2, t3 = fixtures.track_1(), fixtures.track_2(), fixtures.track_3()
+        fixtures.collection_1().add_tracks([t1, t2, t3]).set_track_ids([t3.id, t1.id])
+
+        c = Collection.objects.get(name="C1")
+        with self.assertNumQueries(0):
+            self.assertEqual(2, c.number_of_tracks())
+            self.assertEqual(t3.duration + t1.duration, c.duration)
+
+    def test_library_duration_sums_collections(self):
+        t1, t2 = fixtures.track_1(), fixtures.track_2()
+        fixtures.collection_1().add_tracks([t1, t2])
+        fixtures.collection_2().add_tracks([t1])
+
+        library = Library.load()
+        with self.assertNumQueries(1):
+            self.assertEqual(t1.duration * 2 + t2.duration, library.duration)
+
+    def test_update_totals_repairs_stored_totals(self):
+        c = fixtures.collection_1().add_tracks([fixtures.track_1()])
+        Collection.objects.filter(pk=c.pk).update(track_count=0, total_duration=timedelta())
+
+        c = Collection.objects.get(pk=c.pk).update_totals()
+
+        self.assertEqual(1, Collection.objects.get(pk=c.pk).track_count)
+        self.assertEqual(fixtures.track_1().duration, c.duration)
+
     def test_track_add_ordinal(self):
         c = fixtures.collection_1()
         t2, t1 = fixtures.track_2(), fixtures.track_1()
@@ -75,6 +111,113 @@ class CollectionTest(TestCase):
         self.assertEqual([t for t in c.tracks], [t1, t2, t3])
 
 
+class CollectionEditTest(TestCase):
+
+    def setUp(self):
+        self.t1, self.t2, self.t3 = fixtures.track_1(), fixtures.track_2(), fixtures.track_3()
+        self.t4 = fixtures.track_1(name="Track4")
+        self.c = fixtures.collection_1().add_tracks([self.t1, self.t2, self.t3])
+
+    def assertTracks(self, expected):
+        c = Collection.objects.get(pk=self.c.pk)
+        self.assertEqual(expected, c.tracks)
+        self.assertEqual(
+            list(range(1, len(expected) + 1)),
+            list(c.trackincollection_set.order_by("ordinal").values_list("ordinal", flat=True)),
+        )
+        self.assertEqual(len(expected), c.track_count)
+        self.assertEqual(total_durations(t.duration for t in expected), c.total_duration)
+
+    def test_insert_in_the_middle(self):
+        self.c.insert_track_ids([self.t4.id, self.t1.id], position=2)
+
+        self.assertTracks([self.t1, self.t4, self.t1, self.t2, self.t3])
+
+    def test_insert_first_and_last(self):
+        self.c.insert_track_ids([self.t4.id], position=1)
+        self.c.insert_track_ids([self.t4.id])
+
+        self.assertTracks([self.t4, self.t1, self.t2, self.t3, self.t4])
+
+    def test_remove(self):
+        self.c.remove_tracks(1, count=2)
+        self.assertTracks([self.t3])
+
+        self.c.remove_tracks(1)
+        self.assertTracks([])
+
+    def test_move_back_and_forth(self):
+        self.c.insert_track_ids([self.t4.id])
+
+        self.c.move_tracks(3, 1, count=2)
+        self.assertTracks([self.t3, self.t4, self.t1, self.t2])
+
+        self.c.move_tracks(1, 3)
+        self.assertTracks([self.t4, self.t1, self.t3, self.t2])
+
+    def test_out_of_range_edits_change_nothing(self):
+        for edit in (
+                lambda: self.c.insert_track_ids([self.t4.id], position=5),
+                lambda: self.c.remove_tracks(3, count=2),
+                lambda: self.c.move_tracks(1, 3, count=2),
+        ):
+            with self.assertRaises(ValueError):
+                edit()
+
+        self.assertTracks([self.t1, self.t2, self.t3])
+
+    def test_edits_cost_the_same_queries_whatever_the_collection_size(self):
+        large = fixtures.collection_2().add_tracks([fixtures.track_1(name=f"Large{i}") for i in range(60)])
+
+        num_queries = []
+        for c in (self.c, large):
+            new_track = fixtures.track_1(name=f"New{c.pk}")
+            with CaptureQueriesContext(connection) as queries:
+                c.insert_track_ids([new_track.id], position=1)
+                c.move_tracks(1, 2)
+                c.remove_tracks(1)
+            num_queries.append(len(queries))
+
+        self.assertEqual(num_queries[0], num_queries[1])
+
+    def test_edits_after_compacting_gapped_ordinals(self):
+        compact_ordinals = import_module("musik_lib.migrations.0012_compact_collection_ordinals").compact_ordinals
+        gapped = fixtures.collection_2()
+        for ordinal, track in ((0, self.t1), (4, self.t2), (9, self.t3)):
+            TrackInCollection.objects.create(track=track, collection=gapped, ordinal=ordinal)
+        gapped.update_totals()
+
+        compact_ordinals(apps, None)
+
+        self.c = gapped
+        self.assertTracks([self.t1, self.t2, self.t3])
+        self.c.insert_track_ids([self.t4.id], position=2)
+        self.c.move_tracks(1, 4)
+        self.c.remove_tracks(3)
+        self.assertTracks([self.t4, self.t2, self.t1])
+
+    def test_album_delete_keeps_ordinals_gapless(self):
+        album = fixtures.album_1()
+        self.c.set_track_ids(
+            [self.t1.id, self.t2.id, self.t3.id, self.t4.id],
+            [None, album.id, None, album.id],
+        )
+
+        album.delete()
+
+        self.assertTracks([self.t1, self.t3])
+
+    def test_edits_keep_the_stats(self):
+        stat = fixtures.library_stat()
+        stat.update()
+
+        self.c.insert_track_ids([self.t2.id], position=1)
+        self.c.move_tracks(1, 3)
+        self.c.remove_tracks(2)
+
+        self.assertFalse(stat.verify())
+
+
 class TrackTest(TestCase):
     def test_artist_names_single(self):
         t = fixtures.track_1(name="t1")
@@ -112,6 +255,48 @@ class TrackTest(TestCase):
 
         self.assertEqual(t.collections, [c1, c2])
 
+    def test_identity_key_follows_name_and_artists(self):
+        t = fixtures.track_1(name="t1")
+        a1, a2 = fixtures.artist_1(), fixtures.artist_2()
+        self.assertEqual(track_identity_key("t1", []), t.identity_key)
+
+        t.artist.add(a1)
+        t.featuring.add(a2)
+        self.assertEqual(track_identity_key("t1", [a1.id, a2.id]), Track.objects.get(pk=t.pk).identity_key)
+
+        t.name = "T1 "
+        t.save()
+        a2.featured_artist.clear()
+        self.assertEqual(track_identity_key("t1", [a1.id]), Track.objects.get(pk=t.pk).identity_key)
+
+        a2.main_artist.add(t)
+        self.assertEqual(track_identity_key("t1", [a1.id, a2.id]), Track.objects.get(pk=t.pk).identity_key)
+
+    def test_save_only_queries_the_artists_when_the_name_changed(self):
+        t = fixtures.track_1(name="t1")
+        t.artist.add(fixtures.artist_1())
+        t = Track.objects.get(pk=t.pk)
+
+        t.released_year = 2001
+        with CaptureQueriesContext(connection) as context:
+            t.save()
+        self.assertEqual(1, len(context.captured_queries))
+
+        t.name = "t2"
+        with CaptureQueriesContext(connection) as context:
+            t.save()
+        self.assertEqual(3, len(context.captured_queries))
+        self.assertEqual(track_identity_key("t2", [t.artist.get().id]), Track.objects.get(pk=t.pk).identity_key)
+
+    def test_save_keeps_the_key_of_artists_changed_from_the_other_side(self):
+        t = fixtures.track_1(name="t1")
+        a1 = fixtures.artist_1()
+        a1.main_artist.add(t)
+
+        t.released_year = 2001
+        t.save()
+        self.assertEqual(track_identity_key("t1", [a1.id]), Track.objects.get(pk=t.pk).identity_key)
+
 
 class TrackInCollectionTest(TestCase):
 
@@ -133,6 +318,10 @@ class TrackInCollectionTest(TestCase):
 
 class AlbumTest(TestCase):
 
+    def test_derived_fields_are_not_editable(self):
+        form_fields = modelform_factory(Album, fields="__all__").base_fields
+        self.assertFalse({"track_count", "total_duration"} & form_fields.keys())
+
     def test_empty_album_no_tracks(self):
         a = fixtures.album_1()
         self.assertEqual(0, a.number_of_tracks())
@@ -144,7 +333,7 @@ class AlbumTest(TestCase):
         a: Album = Album.objects.create(
             name="test",
             created_year=2000,
-            spotify_id="some_id",
+            spotify_id="other_id",
             album_type=Album.AlbumType.COMPILATION,
         )
         c = fixtures.collection_1()
@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from musik_lib import collections
+from musik_lib.collections import LazyCollections, Manifest, collection_fingerprint, compact
+
+
+class ManifestTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, "from_spotify")
+        os.makedirs(self.directory)
+        self.path = os.path.join(self.tmp_dir.name, "manifest.json")
+        self.content = {"name": "First", "spotify_id": "s1", "snapshot_id": "v1", "tracks": [{"name": "a"}]}
+        self.write("first.json", self.content)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, file_name, content, keep_stat=False):
+        path = os.path.join(self.directory, file_name)
+        stat = os.stat(path) if keep_stat else None
+        with open(path, "w") as f:
+            json.dump(content, f)
+        if keep_stat:
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def manifest(self) -> Manifest:
+        return Manifest(self.path, {"spotify": self.directory})
+
+    def test_entries_describe_files(self):
+        entry = self.manifest().entries("spotify")["first.json"]
+
+        self.assertEqual(("First", "s1", "v1", 1), entry[:4])
+        self.assertEqual(collection_fingerprint(self.content), entry.fingerprint)
+
+    def test_unchanged_files_are_not_read_again(self):
+        manifest = self.manifest()
+        manifest.entries("spotify")
+        # Same size and mtime, so the manifest cannot tell and keeps the entry
+        self.write("first.json", {**self.content, "snapshot_id": "v2"}, keep_stat=True)
+
+        self.assertEqual("v1", manifest.entries("spotify")["first.json"].snapshot_id)
+        self.assertEqual("v1", self.manifest().entries("spotify")["first.json"].snapshot_id)
+
+    def test_changed_new_and_deleted_files_are_refreshed(self):
+        manifest = self.manifest()
+        manifest.entries("spotify")
+        self.write("first.json", {**self.content, "snapshot_id": "v22"})
+        self.write("second.json", {"name": "Second", "spotify_id": "s2", "tracks": []})
+
+        entries = manifest.entries("spotify")
+        self.assertEqual(["v22", None], [e.snapshot_id for e in entries.values()])
+
+        os.remove(os.path.join(self.directory, "first.json"))
+        self.assertEqual(["second.json"], list(manifest.entries("spotify")))
+
+    def test_collections_are_read_on_access(self):
+        entries = self.manifest().entries("spotify")
+        os.remove(os.path.join(self.directory, "first.json"))
+        lazy = LazyCollections(self.directory, entries)
+
+        self.assertEqual(["First"], list(lazy))
+        with self.assertRaises(FileNotFoundError):
+            lazy["First"]
+
+
+class CompactFormatTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.content = next(collections.get_local_spotify_collections_content())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip_is_lossless(self):
+        text = compact.dumps(self.content)
+
+        self.assertEqual(self.content, compact.loads(text))
+        self.assertEqual(self.content["tracks"], list(compact.iter_tracks(text.split("\n"))))
+        self.assertEqual(collection_fingerprint(self.content), collection_fingerprint(compact.loads(text)))
+
+    def test_artists_and_albums_are_written_once(self):
+        artist = {"id": "a1", "name": "Artist", "href": "https://api.spotify.com/v1/artists/a1"}
+        album = {"album_name": "Album", "spotify_id": "l1"}
+        content = {
+            "name": "Shared",
+            "tracks": [
+                {"name": f"Track {i}", "spotify_id": f"t{i}", "artist": [artist], "album": album} for i in range(3)
+            ] + [{"name": "Manual", "artist": "Artist", "duration": "3:00"}],
+        }
+
+        text = compact.dumps(content)
+
+        record_types = [line[2] for line in text.splitlines()]
+        self.assertEqual(["C", "A", "L", "T", "T", "T", "T"], record_types)
+        self.assertEqual(content, compact.loads(text))
+
+    def test_files_are_read_by_extension(self):
+        json_path = os.path.join(self.tmp_dir.name, "collection.json")
+        compact_path = os.path.join(self.tmp_dir.name, f"collection{compact.COMPACT_EXTENSION}")
+        collections.write_collection_file(self.content, json_path)
+        collections.write_collection_file(self.content, compact_path)
+
+        self.assertEqual(self.content, collections.load_collection_file(json_path))
+        self.assertEqual(self.content, collections.load_collection_file(compact_path))
+        self.assertLess(os.path.getsize(compact_path), os.path.getsize(json_path))
+
+
+class CollectionFileWriterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.content = next(collections.get_local_spotify_collections_content())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_streamed_file_equals_written_file(self):
+        for extension in (".json", compact.COMPACT_EXTENSION):
+            for content in (self.content, {**self.content, "tracks": []}):
+                with self.subTest(extension=extension, num_tracks=len(content["tracks"])):
+                    expected_path = os.path.join(self.tmp_dir.name, f"expected{extension}")
+                    streamed_path = os.path.join(self.tmp_dir.name, f"streamed{extension}")
+                    collections.write_collection_file(content, expected_path)
+
+                    writer = collections.CollectionFileWriter(streamed_path)
+                    for track in content["tracks"]:
+                        writer.write_track(track)
+                    writer.close({**content, "tracks": []})
+
+                    with open(expected_path, "rb") as expected, open(streamed_path, "rb") as streamed:
+                        self.assertEqual(expected.read(), streamed.read())
+
+    def test_discarded_writer_leaves_former_file(self):
+        path = os.path.join(self.tmp_dir.name, "collection.json")
+        collections.write_collection_file(self.content, path)
+
+        writer = collections.CollectionFileWriter(path)
+        writer.write_track(self.content["tracks"][0])
+        writer.discard()
+
+        self.assertEqual(self.content, collections.load_collection_file(path))
+        self.assertEqual(["collection.json"], os.listdir(self.tmp_dir.name))
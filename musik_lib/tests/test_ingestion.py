@@ -0,0 +1,344 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from musik_lib.models.base import *
+from musik_lib.tests import fixtures
+from scripts import parsing
+from scripts import utility
+
+
+def manual_collection(name="C1", ordinal=1, tracks=None):
+    return {
+        "name": name,
+        "nick_name": f"{name} nick",
+        "description": f"{name} description",
+        "created_year": 2001,
+        "ordinal": ordinal,
+        "tracks": tracks or [
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "A1"},
+            {"name": "Track2", "duration": "4:21", "released_year": 2000, "artist": "A1 & A2"},
+            {"name": "Track3", "duration": "3:27", "released_year": 2000, "artist": "A2 feat. A3"},
+        ],
+    }
+
+
+class SplitTrackArtistsTest(TestCase):
+
+    def test_single_artist(self):
+        self.assertEqual((["A1"], []), parsing.split_track_artists("A1"))
+
+    def test_several_artists(self):
+        self.assertEqual((["A1", "A2", "A3"], []), parsing.split_track_artists("A1 & A2, A3"))
+
+    def test_featuring_artists(self):
+        self.assertEqual((["A1"], ["A2", "A3"]), parsing.split_track_artists("A1 feat. A2 and A3"))
+
+
+class ParseSpotifyCollectionTest(TestCase):
+
+    def test_parse(self):
+        parsed = parsing.parse_spotify_collection(
+            {
+                "name": "S1",
+                "spotify_id": "s1",
+                "created_date": "2021-06-12",
+                "description": "S1 description",
+                "tracks": [
+                    {
+                        "name": "Track1",
+                        "spotify_id": "t1",
+                        "duration_ms": 76106,
+                        "artist": [{"id": "a1", "name": "A1"}, {"id": "a2", "name": "A2"}],
+                        "album": {
+                            "album_name": "Album1",
+                            "album_type": "single",
+                            "released": "2020-01-12",
+                            "spotify_id": "al1",
+                        },
+                    },
+                ],
+            }
+        )
+
+        self.assertEqual("S1", parsed.name)
+        self.assertEqual(2021, parsed.fields["created_year"])
+        self.assertIsNone(parsed.fields["ordinal"])
+        track = parsed.tracks[0]
+        self.assertEqual(["A1", "A2"], track.main_artists)
+        self.assertEqual("76.106", track.duration)
+        self.assertEqual(2020, track.released_year)
+        self.assertEqual(parsing.ParsedAlbum("al1", "Album1", "single", 2020), track.album)
+
+
+class CollectionIngestorTest(TestCase):
+
+    def test_ingest_collection(self):
+        utility.ingest_collection(manual_collection())
+
+        c = Collection.objects.get(name="C1")
+        self.assertEqual(["Track1", "Track2", "Track3"], [t.name for t in c.tracks])
+        self.assertEqual({"A1", "A2", "A3"}, set(Artist.objects.values_list("name", flat=True)))
+
+        track3 = Track.objects.get(name="Track3")
+        self.assertEqual("A2 Feat. A3", track3.artist_names)
+
+    def test_ingest_same_collection_twice(self):
+        utility.ingest_collection(manual_collection())
+        utility.ingest_collection(manual_collection())
+
+        c = Collection.objects.get(name="C1")
+        self.assertEqual(3, c.number_of_tracks())
+        self.assertEqual(3, Track.objects.count())
+        self.assertEqual(3, Artist.objects.count())
+
+    def test_tracks_are_shared_between_collections(self):
+        ingestor = utility.CollectionIngestor()
+        utility.ingest_collection(manual_collection(name="C1", ordinal=1), ingestor)
+        utility.ingest_collection(manual_collection(name="C2", ordinal=2), ingestor)
+
+        self.assertEqual(3, Track.objects.count())
+        self.assertEqual(6, TrackInCollection.objects.count())
+
+    def test_same_name_with_different_artists_is_another_track(self):
+        tracks = [
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "A1"},
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "A2"},
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "A1"},
+        ]
+        utility.ingest_collection(manual_collection(tracks=tracks))
+
+        self.assertEqual(2, Track.objects.count())
+        c = Collection.objects.get(name="C1")
+        self.assertEqual(
+            ["A1", "A2", "A1"],
+            [t.artist_names for t in c.tracks],
+        )
+
+    def test_spellings_of_an_artist_are_one_artist(self):
+        tracks = [
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "The Artist"},
+            {"name": "Track2", "duration": "4:21", "released_year": 2000, "artist": "the artist."},
+        ]
+        utility.ingest_collection(manual_collection(tracks=tracks))
+        utility.ingest_collection(manual_collection(name="C2", ordinal=2, tracks=[
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "THE ARTIST"},
+        ]))
+
+        self.assertEqual(["The Artist"], list(Artist.objects.values_list("name", flat=True)))
+        self.assertEqual(2, Track.objects.count())
+
+    def test_existing_tracks_are_found_by_identity_key(self):
+        track = fixtures.track_1(name="Track1")
+        track.artist.add(fixtures.artist_1(name="A1"))
+        tracks = [
+            {"name": "track1", "duration": "6:18", "released_year": 2000, "artist": "A1"},
+            {"name": "Track2", "duration": "4:21", "released_year": 2000, "artist": "A1 & A2"},
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            utility.ingest_collection(manual_collection(tracks=tracks))
+
+        self.assertEqual(2, Track.objects.count())
+        self.assertEqual(track, Collection.objects.get(name="C1").tracks[0])
+        self.assertEqual(1, sum('"identity_key" IN' in q["sql"] for q in queries.captured_queries))
+
+    def test_bad_duration_does_not_leave_partial_collection(self):
+        tracks = [
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "A1"},
+            {"name": "Track2", "duration": "not a duration", "released_year": 2000, "artist": "A2"},
+        ]
+        ingestor = utility.CollectionIngestor()
+        with self.assertRaises(ValueError):
+            utility.ingest_collection(manual_collection(tracks=tracks), ingestor)
+
+        self.assertEqual(0, Track.objects.count())
+        self.assertEqual(0, Artist.objects.count())
+        self.assertFalse(ingestor.artist_ids)
+
+
+class IncrementalIngestionTest(TestCase):
+
+    def test_unchanged_collection_is_skipped(self):
+        _, written = utility.ingest_collection(manual_collection())
+        self.assertTrue(written)
+        tic_ids = set(TrackInCollection.objects.values_list("id", flat=True))
+
+        with self.assertNumQueries(1):
+            _, written = utility.ingest_collection(manual_collection())
+
+        self.assertFalse(written)
+        self.assertEqual(tic_ids, set(TrackInCollection.objects.values_list("id", flat=True)))
+
+    def test_forced_ingestion_of_unchanged_collection(self):
+        utility.ingest_collection(manual_collection())
+        _, written = utility.ingest_parsed_collection(
+            parsing.parse_manual_collection(manual_collection()),
+            force=True,
+        )
+        self.assertTrue(written)
+
+    def test_changed_collection_writes_only_changed_ordinals(self):
+        utility.ingest_collection(manual_collection())
+        c = Collection.objects.get(name="C1")
+        unchanged_tic = c.trackincollection_set.get(ordinal=1)
+
+        tracks = [
+            {"name": "Track1", "duration": "6:18", "released_year": 2000, "artist": "A1"},
+            {"name": "Track4", "duration": "1:00", "released_year": 2000, "artist": "A4"},
+        ]
+        _, written = utility.ingest_collection(manual_collection(tracks=tracks))
+
+        self.assertTrue(written)
+        c.refresh_from_db()
+        self.assertEqual(["Track1", "Track4"], [t.name for t in c.tracks])
+        self.assertEqual(unchanged_tic, c.trackincollection_set.get(ordinal=1))
+
+    def test_changed_description_updates_collection(self):
+        utility.ingest_collection(manual_collection())
+        d = manual_collection()
+        d["description"] = "new description"
+        utility.ingest_collection(d)
+
+        c = Collection.objects.get(name="C1")
+        self.assertEqual("new description", c.description)
+        self.assertEqual(3, c.number_of_tracks())
+
+    def test_same_name_of_another_year_is_another_collection(self):
+        utility.ingest_collection(manual_collection())
+        d = manual_collection(ordinal=2)
+        d["created_year"] = 2002
+        utility.ingest_collection(d)
+
+        self.assertEqual(
+            [(2001, 1), (2002, 2)],
+            list(Collection.objects.filter(name="C1").order_by("id").values_list("created_year", "ordinal")),
+        )
+        self.assertEqual(3, Track.objects.count())
+
+
+def spotify_collection(name="S1", tracks=None):
+    def track(track_name, album_id, album_type="album"):
+        return {
+            "name": track_name,
+            "spotify_id": f"{track_name} id",
+            "duration_ms": 60000,
+            "artist": [{"id": "a1", "name": "A1"}],
+            "album": {
+                "album_name": f"Album {album_id}",
+                "album_type": album_type,
+                "released": "2020-01-12",
+                "spotify_id": album_id,
+            },
+        }
+
+    return {
+        "name": name,
+        "spotify_id": f"{name} id",
+        "created_date": "2021-06-12",
+        "description": f"{name} description",
+        "tracks": [track(*t) for t in tracks or [("Track1", "al1"), ("Track2", "al1"), ("Track3", "al2", "single")]],
+    }
+
+
+class AlbumIngestionTest(TestCase):
+
+    def test_albums_are_linked_to_tracks_in_collection(self):
+        utility.ingest_spotify_collection(spotify_collection())
+
+        album1, album2 = Album.objects.get(spotify_id="al1"), Album.objects.get(spotify_id="al2")
+        self.assertEqual(
+            [album1.id, album1.id, album2.id],
+            list(TrackInCollection.objects.order_by("ordinal").values_list("album_id", flat=True)),
+        )
+        self.assertEqual((Album.AlbumType.STUDIO, 2020), (album1.album_type, album1.created_year))
+        self.assertEqual(Album.AlbumType.SINGLE, album2.album_type)
+
+    def test_albums_have_totals(self):
+        utility.ingest_spotify_collection(spotify_collection())
+
+        album1 = Album.objects.get(spotify_id="al1")
+        self.assertEqual(2, album1.number_of_tracks())
+        self.assertEqual(datetime.timedelta(minutes=2), album1.duration)
+        self.assertEqual(["Track1", "Track2"], [t.name for t in album1.tracks])
+
+    def test_albums_are_upserted(self):
+        utility.ingest_spotify_collection(spotify_collection(name="S1"))
+        Album.objects.filter(spotify_id="al1").update(name="Old name")
+        # Another run, with its own ingestor
+        utility.ingest_spotify_collection(spotify_collection(name="S2", tracks=[("Track1", "al1"), ("Track4", "al1")]))
+
+        self.assertEqual(2, Album.objects.count())
+        album1 = Album.objects.get(spotify_id="al1")
+        self.assertEqual("Album al1", album1.name)
+        # Track1 is in both collections, and counts once
+        self.assertEqual(3, album1.number_of_tracks())
+
+    def test_albums_are_created_in_one_query(self):
+        ingestor = utility.CollectionIngestor()
+        with CaptureQueriesContext(connection) as context:
+            ingestor._upsert_albums(parsing.parse_spotify_collection(spotify_collection()).tracks)
+        self.assertEqual(2, len(context))
+
+    def test_removed_tracks_update_totals(self):
+        ingestor = utility.CollectionIngestor()
+        utility.ingest_spotify_collection(spotify_collection(), ingestor)
+        utility.ingest_spotify_collection(spotify_collection(tracks=[("Track1", "al1")]), ingestor)
+
+        self.assertEqual(1, Album.objects.get(spotify_id="al1").number_of_tracks())
+        self.assertEqual(0, Album.objects.get(spotify_id="al2").number_of_tracks())
+
+    def test_track_without_album_id(self):
+        collection = spotify_collection(tracks=[("Track1", None)])
+        utility.ingest_spotify_collection(collection)
+
+        self.assertFalse(Album.objects.exists())
+        self.assertIsNone(TrackInCollection.objects.get().album)
+
+
+class CollectionSetTracksTest(TestCase):
+
+    def test_set_track_ids(self):
+        t1, t2, t3 = fixtures.track_1(), fixtures.track_2(), fixtures.track_3()
+        c = fixtures.collection_1().add_tracks([t1, t2, t3])
+
+        c.set_track_ids([t3.id, t2.id])
+
+        self.assertEqual([t3, t2], c.tracks)
+        self.assertEqual((2, t3.duration + t2.duration), (c.track_count, c.total_duration))
+
+    def test_head_insert_keeps_the_rows(self):
+        tracks = Track.objects.bulk_create(
+            [Track(name=f"T{i}", duration=datetime.timedelta(minutes=3), released_year=2000) for i in range(101)]
+        )
+        rest = tracks[1:]
+        c = fixtures.collection_1().add_tracks(rest)
+        tic_ids = list(c.trackincollection_set.order_by("ordinal").values_list("id", flat=True))
+
+        with CaptureQueriesContext(connection) as context:
+            c.set_track_ids([t.id for t in tracks])
+
+        self.assertEqual(tracks, c.tracks)
+        self.assertEqual(
+            tic_ids,
+            list(c.trackincollection_set.filter(ordinal__gt=1).order_by("ordinal").values_list("id", flat=True)),
+        )
+        # The old rows move by a renumber of two statements, and only the new track is written
+        writes = [q["sql"] for q in context.captured_queries if q["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+        tic_writes = [sql for sql in writes if '"musik_lib_trackincollection"' in sql.split(" WHERE ")[0]]
+        self.assertEqual(3, len(tic_writes), "\n".join(tic_writes))
+        self.assertEqual((101, datetime.timedelta(minutes=303)), (c.track_count, c.total_duration))
+
+    def test_head_removal_and_replacement_keep_the_rows(self):
+        t1, t2, t3 = fixtures.track_1(), fixtures.track_2(), fixtures.track_3()
+        t4 = fixtures.track_1(name="Track4")
+        c = fixtures.collection_1().add_tracks([t1, t2, t3])
+        tic_ids = list(c.trackincollection_set.order_by("ordinal").values_list("id", flat=True))
+
+        c.set_track_ids([t2.id, t4.id])
+
+        self.assertEqual([t2, t4], c.tracks)
+        # Track2 moved with its row, and Track3 was replaced in its row
+        self.assertEqual(tic_ids[1:], list(c.trackincollection_set.order_by("ordinal").values_list("id", flat=True)))
+        c.refresh_from_db()
+        self.assertEqual((2, t2.duration + t4.duration), (c.track_count, c.total_duration))
@@ -1,11 +1,25 @@
 import datetime
+from collections import Counter
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
+from musik_lib.models.stats import *
 from musik_lib.tests import fixtures
 
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 
+
+@override_settings(CACHES=LOCMEM_CACHES)
 class CollectionStatTest(TestCase):
+    """
+    Library totals are cached values, and the writes of a test bump the library version only if they commit
+    """
+
+    def setUp(self):
+        cache.clear()
 
     def test_empty_collections_stat_empty_stats(self):
         c_stat = fixtures.collection_stat()
@@ -75,11 +89,12 @@ class CollectionStatTest(TestCase):
     def test_duration_for_single_track(self):
         track = fixtures.track_1()
         collection = fixtures.collection_1()
-        collection.add_tracks(
-            [
-                track,
-            ]
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            collection.add_tracks(
+                [
+                    track,
+                ]
+            )
         expected_duration = track.duration
         actual_duration = fixtures.library_stat().duration
         self.assertEqual(expected_duration, actual_duration)
@@ -87,16 +102,18 @@ class CollectionStatTest(TestCase):
     def test_duration_for_several_tracks(self):
         track = fixtures.track_1()
         collection = fixtures.collection_1()
-        collection.add_tracks(
-            [
-                track,
-                track,
-            ]
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            collection.add_tracks(
+                [
+                    track,
+                    track,
+                ]
+            )
         expected_duration = track.duration + track.duration
         actual_duration = fixtures.library_stat().duration
         self.assertEqual(expected_duration, actual_duration)
 
+
 class LibraryStatTest(TestCase):
 
     def test_update_artist_frequency_counts_when_empty(self):
@@ -159,3 +176,190 @@ class LibraryStatTest(TestCase):
         track_ids = {dt.track_id for dt in duplicate_tracks}
         expected = {t2.id, t4.id}
         self.assertEqual(expected, track_ids)
+
+
+class IncrementalStatsTest(TestCase):
+
+    def setUp(self):
+        self.a1, self.a2 = fixtures.artist_1(), fixtures.artist_2()
+        self.t1, self.t2, self.t3 = fixtures.track_1(), fixtures.track_2(), fixtures.track_3()
+        self.t1.artist.add(self.a1)
+        self.t2.artist.add(self.a1)
+        self.t2.featuring.add(self.a2)
+        self.t3.artist.add(self.a2)
+        self.c1, self.c2 = fixtures.collection_1(), fixtures.collection_2()
+
+    def afl(self):
+        return dict(fixtures.library_stat().artistfrequencylibrary_set.values_list("artist__name", "frequency"))
+
+    def test_add_tracks_updates_stats(self):
+        self.c1.add_tracks([self.t1, self.t2])
+        self.c2.add_tracks([self.t2])
+
+        afc = dict(self.c1.collectionstat.artistfrequencycollection_set.values_list("artist__name", "frequency"))
+        self.assertEqual({"A1": 2, "A2": 1}, afc)
+        self.assertEqual({"A1": 3, "A2": 2}, self.afl())
+
+        dt = DuplicateTrack.objects.get()
+        self.assertEqual(self.t2.id, dt.track_id)
+        self.assertEqual(2, dt.frequency)
+        self.assertEqual({self.c1.id, self.c2.id}, set(dt.collectionstat_set.values_list("collection_id", flat=True)))
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_set_tracks_updates_stats(self):
+        self.c1.add_tracks([self.t1, self.t2])
+        self.c2.add_tracks([self.t2])
+
+        self.c1.set_track_ids([self.t3.id])
+
+        self.assertEqual({"A1": 1, "A2": 2}, self.afl())
+        self.assertFalse(DuplicateTrack.objects.exists())
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_delete_collection_updates_stats(self):
+        self.c1.add_tracks([self.t1, self.t2])
+        self.c2.add_tracks([self.t2, self.t3])
+
+        self.c1.delete()
+
+        self.assertEqual({"A1": 1, "A2": 2}, self.afl())
+        self.assertFalse(DuplicateTrack.objects.exists())
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_artists_change_updates_stats(self):
+        a3 = fixtures.artist_3()
+        self.c1.add_tracks([self.t1, self.t2])
+        self.c2.add_tracks([self.t1])
+
+        self.t1.artist.add(a3)
+        self.assertEqual({"A1": 3, "A2": 1, "A3": 2}, self.afl())
+        self.t2.featuring.remove(self.a2)
+        self.assertEqual({"A1": 3, "A3": 2}, self.afl())
+        self.t1.artist.clear()
+        self.assertEqual({"A1": 1}, self.afl())
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_artists_change_from_the_artist_updates_stats(self):
+        a3 = fixtures.artist_3()
+        self.c1.add_tracks([self.t1, self.t3])
+
+        a3.main_artist.add(self.t1, self.t3)
+        self.assertEqual({"A1": 1, "A2": 1, "A3": 2}, self.afl())
+        self.a1.main_artist.clear()
+        self.assertEqual({"A2": 1, "A3": 2}, self.afl())
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_delete_artist_updates_stats(self):
+        self.c1.add_tracks([self.t1, self.t2, self.t3])
+
+        self.a2.delete()
+
+        self.assertEqual({"A1": 2}, self.afl())
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_delete_track_updates_stats(self):
+        self.c1.add_tracks([self.t2, self.t1, self.t2, self.t3])
+        self.c2.add_tracks([self.t2])
+
+        self.t2.delete()
+
+        self.c1.refresh_from_db()
+        self.assertEqual([self.t1, self.t3], self.c1.tracks)
+        self.assertEqual(
+            [1, 2],
+            list(self.c1.trackincollection_set.order_by("ordinal").values_list("ordinal", flat=True)),
+        )
+        self.assertEqual((2, self.t1.duration + self.t3.duration), (self.c1.track_count, self.c1.total_duration))
+        self.assertEqual({"A1": 1, "A2": 1}, self.afl())
+        self.assertFalse(DuplicateTrack.objects.exists())
+        self.assertFalse(fixtures.library_stat().verify())
+
+    def test_verify_reports_drift(self):
+        self.c1.add_tracks([self.t1, self.t2])
+        ArtistFrequencyLibrary.objects.filter(artist=self.a1).update(frequency=7)
+
+        drift = fixtures.library_stat().verify()
+
+        self.assertTrue(drift)
+        self.assertEqual([(self.a1.id, 7, 2)], drift.artist_frequency_library)
+        self.assertFalse(drift.artist_frequency_collection)
+
+    def test_repair_collection_totals_drift(self):
+        self.c1.add_tracks([self.t1, self.t2])
+        Collection.objects.filter(pk=self.c1.pk).update(track_count=5)
+
+        l_stat = fixtures.library_stat()
+        drift = l_stat.verify()
+        expected = (2, self.t1.duration + self.t2.duration)
+        self.assertEqual([(self.c1.id, (5, expected[1]), expected)], drift.collection_totals)
+
+        l_stat.update()
+        self.assertFalse(l_stat.verify())
+
+
+def per_row_stats():
+    """
+    The stats counted a track at a time, as they were before the aggregation queries
+    :return: artist frequency by (collection id, artist id), by artist id, and duplicate track frequency by track id
+    """
+    afc, afl, tracks = Counter(), Counter(), Counter()
+    for collection in Collection.objects.all():
+        for track in collection.tracks:
+            tracks[track.id] += 1
+            for artist in track.artists:
+                afc[collection.id, artist.id] += 1
+                afl[artist.id] += 1
+    return dict(afc), dict(afl), {track_id: frequency for track_id, frequency in tracks.items() if frequency > 1}
+
+
+def statements(captured_queries):
+    """
+    :return: the queries, with the batches that the backend splits a bulk insert into counted as one statement
+    """
+    sqls = [q["sql"] for q in captured_queries]
+    return [
+        sql for i, sql in enumerate(sqls)
+        if not (i and sql.startswith("INSERT") and sql.split("(", 1)[0] == sqls[i - 1].split("(", 1)[0])
+    ]
+
+
+class LibraryStatQueriesTest(TestCase):
+    """
+    A full update and a verify cost the same statements whatever the size of the library
+    """
+
+    def num_queries(self, num_collections, tracks_per_collection):
+        """
+        :return: the statements of an update that recreates lost and drifted stats on a library of that size,
+        after checking them against the stats counted a track at a time; The library is rolled back after
+        """
+        with transaction.atomic():
+            fixtures.bulk_library(num_collections=num_collections, tracks_per_collection=tracks_per_collection)
+            l_stat = fixtures.library_stat()
+            ArtistFrequencyCollection.objects.filter(frequency__gt=2).delete()
+            ArtistFrequencyLibrary.objects.update(frequency=1)
+            DuplicateTrack.objects.all().delete()
+
+            with CaptureQueriesContext(connection) as update_queries:
+                l_stat.update()
+            # The stored and the expected stats of artists in collections, artists, duplicate tracks and totals
+            with self.assertNumQueries(4 + 6):
+                drift = l_stat.verify()
+
+            self.assertFalse(drift)
+            afc, afl, duplicate_tracks = per_row_stats()
+            self.assertEqual(
+                afc,
+                {
+                    (collection_id, artist_id): frequency
+                    for collection_id, artist_id, frequency
+                    in ArtistFrequencyCollection.objects.values_list("collection_stat_id", "artist_id", "frequency")
+                },
+            )
+            self.assertEqual(afl, dict(ArtistFrequencyLibrary.objects.values_list("artist_id", "frequency")))
+            self.assertEqual(duplicate_tracks, dict(DuplicateTrack.objects.values_list("track_id", "frequency")))
+            transaction.set_rollback(True)
+        return len(statements(update_queries.captured_queries))
+
+    def test_update_and_verify_statements_do_not_grow_with_the_library(self):
+        self.assertEqual(self.num_queries(2, 30), self.num_queries(6, 90))
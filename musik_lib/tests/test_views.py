@@ -0,0 +1,350 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from integrations.spotify.feature_store import FeatureStore
+from integrations.spotify.models import SpotifyTrack
+from integrations.tests.fake_spotify import make_audio_features
+from musik_lib import collections
+from musik_lib.cache import library_version
+from musik_lib.models.stats import *
+from musik_lib.tests import fixtures
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ViewQueriesTest(TestCase):
+    """
+    Every page should cost a bounded number of queries, no matter the size of the library
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.collections = fixtures.bulk_library()
+        cls.collection = cls.collections[0]
+        cls.shared_track = cls.collection.tracks[0]
+        cls.artist = cls.shared_track.artist.get()
+        cls.afc = ArtistFrequencyCollection.objects.filter(artist=cls.artist).first()
+        cls.afl = ArtistFrequencyLibrary.objects.get(artist=cls.artist)
+        cls.album = Album.objects.create(name="Bulk Album", created_year=2000, spotify_id="bulk")
+        track_ids = list(cls.collection.trackincollection_set.order_by("ordinal").values_list("track_id", flat=True))
+        cls.collection.set_track_ids(track_ids, [cls.album.id] * len(track_ids))
+
+    def setUp(self):
+        # Budgets are for rendering the pages, not for serving them from the cache
+        cache.clear()
+
+    @contextmanager
+    def assertMaxQueries(self, max_queries):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        self.assertLessEqual(
+            len(context),
+            max_queries,
+            "{} queries executed, at most {} expected:\n{}".format(
+                len(context),
+                max_queries,
+                "\n".join(q["sql"] for q in context.captured_queries),
+            ),
+        )
+
+    def assertPageQueries(self, url, max_queries):
+        with self.assertMaxQueries(max_queries):
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return response
+
+    def test_index(self):
+        self.assertPageQueries("/lib/", 2)
+
+    def test_collection_list(self):
+        response = self.assertPageQueries("/lib/collection/", 2)
+        self.assertContains(response, "Bulk Collection 9")
+
+    def test_collection_detail(self):
+        response = self.assertPageQueries(f"/lib/collection/{self.collection.id}/", 5)
+        self.assertContains(response, "<li>", count=self.collection.number_of_tracks())
+
+    def test_track_list(self):
+        response = self.assertPageQueries("/lib/track/", 5)
+        self.assertContains(response, "Feat.")
+
+    def test_track_detail(self):
+        response = self.assertPageQueries(f"/lib/track/{self.shared_track.id}/", 5)
+        self.assertContains(response, "Bulk Collection 9")
+
+    def test_artist_list(self):
+        self.assertPageQueries("/lib/artist/", 3)
+
+    def test_artist_detail(self):
+        response = self.assertPageQueries(f"/lib/artist/{self.artist.id}/", 10)
+        self.assertContains(response, self.shared_track.name)
+
+    def test_album_list(self):
+        response = self.assertPageQueries("/lib/album/", 3)
+        self.assertContains(response, f"{self.collection.number_of_tracks()} tracks")
+
+    def test_album_detail(self):
+        response = self.assertPageQueries(f"/lib/album/{self.album.id}/", 5)
+        self.assertContains(response, "<li>", count=self.collection.number_of_tracks())
+
+    def test_lib_stat(self):
+        self.assertPageQueries("/lib/stats/", 6)
+
+    def test_collection_stat_list(self):
+        self.assertPageQueries("/lib/collection_stat/", 2)
+
+    def test_collection_stat_detail(self):
+        response = self.assertPageQueries(f"/lib/collection_stat/{self.collection.id}/", 4)
+        self.assertContains(response, self.shared_track.name)
+
+    def test_afc_list(self):
+        self.assertPageQueries("/lib/afc/", 2)
+
+    def test_afc_detail(self):
+        self.assertPageQueries(f"/lib/afc/{self.afc.id}/", 5)
+
+    def test_dt_list(self):
+        self.assertPageQueries("/lib/dt/", 4)
+
+    def test_dt_detail(self):
+        response = self.assertPageQueries(f"/lib/dt/{self.shared_track.id}/", 5)
+        self.assertContains(response, "Bulk Collection 9")
+
+    def test_afl_list(self):
+        self.assertPageQueries("/lib/afl/", 2)
+
+    def test_afl_detail(self):
+        response = self.assertPageQueries(f"/lib/afl/{self.afl.id}/", 10)
+        self.assertContains(response, "Bulk Collection 9")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedPagesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.track = fixtures.track_1()
+        self.collection = fixtures.collection_1().add_tracks([self.track])
+
+    def test_cached_page_needs_no_queries(self):
+        self.client.get("/lib/collection/")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/lib/collection/")
+        self.assertContains(response, "C1 nick")
+
+    def test_tracks_change_invalidates_pages(self):
+        self.client.get("/lib/stats/")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fixtures.collection_2().add_tracks([self.track])
+
+        response = self.client.get("/lib/stats/")
+        self.assertContains(response, "12:36 minutes")
+
+    def test_collection_save_invalidates_pages(self):
+        self.client.get("/lib/collection/")
+
+        self.collection.nick_name = "new nick"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.save()
+
+        self.assertContains(self.client.get("/lib/collection/"), "new nick")
+
+    def test_stats_update_invalidates_pages(self):
+        self.client.get("/lib/afl/")
+        ArtistFrequencyLibrary.objects.create(
+            artist=fixtures.artist_1(), library_stat=fixtures.library_stat(), frequency=3,
+        )
+        cache_version = library_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fixtures.library_stat().update()
+
+        self.assertNotEqual(cache_version, library_version())
+        self.assertNotContains(self.client.get("/lib/afl/"), "A1 - 3")
+
+    def test_pages_are_invalidated_after_commit(self):
+        """
+        A request during the write transaction reads the rows before the write, so it must cache them
+        under the version before the write, for the commit to invalidate them
+        """
+        self.client.get("/lib/collection/")
+        cache_version = library_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.collection.nick_name = "new nick"
+                self.collection.save()
+                fixtures.collection_2().add_tracks([self.track])
+                self.collection.move_tracks(1, 1)
+                self.assertEqual(cache_version, library_version())
+
+        self.assertNotEqual(cache_version, library_version())
+        self.assertContains(self.client.get("/lib/collection/"), "new nick")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        fixtures.bulk_library(num_collections=3, tracks_per_collection=120, shared_tracks=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url, context_object_name):
+        pages = []
+        query = ""
+        while True:
+            response = self.client.get(url + query)
+            pages.append(list(response.context[context_object_name]))
+            page = response.context["page_obj"]
+            if not page.has_next:
+                return pages
+            query = f"?after={page.next_cursor}"
+
+    def test_pages_hold_all_rows_in_order(self):
+        pages = self.walk("/lib/track/", "tracks")
+
+        self.assertEqual(4, len(pages))
+        tracks = [t for page in pages for t in page]
+        self.assertEqual(list(Track.objects.order_by("name", "id")), tracks)
+
+    def test_artists_are_ordered_by_upper_name(self):
+        fixtures.artist_1(name="bulk artist lowercase")
+
+        artists = [a for page in self.walk("/lib/artist/", "artists") for a in page]
+
+        self.assertEqual(Artist.objects.count(), len(artists))
+        self.assertEqual(sorted(artists, key=lambda a: (a.name.upper(), a.id)), artists)
+
+    def test_frequency_lists_are_ordered(self):
+        afls = [a for page in self.walk("/lib/afl/", "afls") for a in page]
+
+        self.assertEqual(ArtistFrequencyLibrary.objects.count(), len(afls))
+        self.assertEqual(sorted(afls, key=lambda a: (-a.frequency, a.artist.name.upper(), a.id)), afls)
+
+        afcs = [a for page in self.walk("/lib/afc/", "afcs") for a in page]
+
+        self.assertEqual(ArtistFrequencyCollection.objects.count(), len(afcs))
+        self.assertEqual(sorted(afcs, key=lambda a: (-a.frequency, a.artist.name.upper(), a.id)), afcs)
+
+    def test_frequency_lists_follow_artist_renames(self):
+        artist = ArtistFrequencyLibrary.objects.order_by("-frequency", "id").last().artist
+        artist.name = "0 renamed"
+        artist.save()
+
+        afls = [a for page in self.walk("/lib/afl/", "afls") for a in page]
+
+        self.assertEqual(sorted(afls, key=lambda a: (-a.frequency, a.artist.name.upper(), a.id)), afls)
+        self.assertEqual(
+            {"0 renamed"},
+            set(ArtistFrequencyCollection.objects.filter(artist=artist).values_list("artist_name", flat=True)),
+        )
+
+    def test_deep_frequency_page_costs_as_first_page(self):
+        for url in ("/lib/afl/", "/lib/afc/"):
+            with CaptureQueriesContext(connection) as first_queries:
+                page = self.client.get(url).context["page_obj"]
+            with CaptureQueriesContext(connection) as deep_queries:
+                self.client.get(f"{url}?after={page.next_cursor}")
+
+            self.assertEqual(len(first_queries), len(deep_queries))
+            self.assertNotIn("OFFSET", " ".join(q["sql"] for q in deep_queries.captured_queries))
+
+    @skipUnless(connection.vendor == "sqlite", "Reads the SQLite query plan")
+    def test_frequency_lists_are_ordered_by_their_index(self):
+        first = self.client.get("/lib/afc/").context["page_obj"]
+        for url in ("/lib/afl/", f"/lib/afc/?after={first.next_cursor}"):
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(url)
+            sql = next(q["sql"] for q in context.captured_queries if "ORDER BY" in q["sql"])
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = " ".join(row[-1] for row in cursor.fetchall())
+
+            self.assertRegex(plan, r"USING INDEX af[cl]_frequency_name_idx")
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_previous_page(self):
+        first = self.client.get("/lib/track/").context["page_obj"]
+        second = self.client.get(f"/lib/track/?after={first.next_cursor}").context["page_obj"]
+
+        previous = self.client.get(f"/lib/track/?before={second.previous_cursor}").context["page_obj"]
+
+        self.assertEqual(first.object_list, previous.object_list)
+        self.assertFalse(previous.has_previous)
+
+    def test_deep_page_costs_as_first_page(self):
+        with CaptureQueriesContext(connection) as first_queries:
+            page = self.client.get("/lib/track/").context["page_obj"]
+        for _ in range(2):
+            page = self.client.get(f"/lib/track/?after={page.next_cursor}").context["page_obj"]
+
+        with CaptureQueriesContext(connection) as deep_queries:
+            self.client.get(f"/lib/track/?after={page.next_cursor}")
+
+        self.assertEqual(len(first_queries), len(deep_queries))
+        self.assertNotIn("OFFSET", " ".join(q["sql"] for q in deep_queries.captured_queries))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(404, self.client.get("/lib/track/?after=nonsense").status_code)
+
+
+class FeaturesStatTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "features.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_no_store(self):
+        with override_settings(SPOTIFY_FEATURES_PATH=self.path):
+            response = self.client.get("/lib/stats/features/")
+
+        self.assertContains(response, "No audio features are available")
+
+    def test_library_and_collections_stats(self):
+        local_collection = next(collections.get_local_spotify_collections_content())
+        tracks = [SpotifyTrack.from_dict(t) for t in local_collection["tracks"]]
+        FeatureStore(self.path).put_many([(t, make_audio_features(t.spotify_id)) for t in tracks])
+
+        with override_settings(SPOTIFY_FEATURES_PATH=self.path):
+            response = self.client.get("/lib/stats/features/")
+
+        self.assertEqual(len({t.spotify_id for t in tracks}), response.context["library"].num_tracks)
+        self.assertContains(response, local_collection["name"])
+        self.assertContains(response, "120.50")
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_page_is_cached_until_the_store_changes(self):
+        local_collection = next(collections.get_local_spotify_collections_content())
+        tracks = [SpotifyTrack.from_dict(t) for t in local_collection["tracks"]]
+        store = FeatureStore(self.path)
+        store.put_many([(tracks[0], make_audio_features(tracks[0].spotify_id))])
+
+        with override_settings(SPOTIFY_FEATURES_PATH=self.path):
+            self.assertEqual(1, self.client.get("/lib/stats/features/").context["library"].num_tracks)
+            # Served from the cache, without reading the collection files
+            with mock.patch("musik_lib.collections.load_collection_file", side_effect=AssertionError):
+                cached = self.client.get("/lib/stats/features/")
+            self.assertEqual(200, cached.status_code)
+            self.assertIsNone(cached.context)
+
+            store.put_many([(t, make_audio_features(t.spotify_id)) for t in tracks[1:]])
+            os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 1))
+            response = self.client.get("/lib/stats/features/")
+
+        self.assertEqual(len({t.spotify_id for t in tracks}), response.context["library"].num_tracks)
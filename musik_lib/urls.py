@@ -1,5 +1,5 @@
 from django.urls import path
-from musik_lib import views
+from musik_lib import api, views
 
 app_name = 'lib'
 urlpatterns = [
@@ -21,9 +21,17 @@ urlpatterns = [
     # ex: /artist/5/
     path('artist/<int:pk>/', views.ArtistDetailView.as_view(), name='artist'),
 
+    # ex: /album/
+    path('album/', views.AlbumListView.as_view(), name='albums'),
+    # ex: /album/5/
+    path('album/<int:pk>/', views.AlbumDetailView.as_view(), name='album'),
+
     # ex: /lib_stat/
     path('stats/', views.lib_stat, name='stats'),
 
+    # ex: /stats/features/
+    path('stats/features/', views.features_stat, name='features_stats'),
+
     # ex: /collection_stat/
     path('collection_stat/', views.CollectionStatListView.as_view(), name='collections_stats'),
     # ex: /collection_stat/5/
@@ -39,6 +47,17 @@ urlpatterns = [
     # ex: /dt/5/
     path('dt/<int:pk>/', views.DuplicateTrackDetailView.as_view(), name='dt'),
 
+    # ex: /api/
+    path('api/', api.index, name='api'),
+    # ex: /api/stats/
+    path('api/stats/', api.stats, name='api_stats'),
+    # ex: /api/export/
+    path('api/export/', api.export, name='api_export'),
+    # ex: /api/tracks/?after=<cursor>&limit=100 or /api/tracks/?format=ndjson
+    path('api/<str:resource>/', api.resource_list, name='api_list'),
+    # ex: /api/tracks/5/
+    path('api/<str:resource>/<int:pk>/', api.resource_detail, name='api_detail'),
+
     # ex: /afl/
     path('afl/', views.ArtistFrequencyLibraryListView.as_view(), name='afls'),
     # ex: /afl/5/
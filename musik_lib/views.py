@@ -1,11 +1,44 @@
 
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.db.models import F, Prefetch
 from django.db.models.functions import Upper
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
 from django.views import generic
 
+from musik_lib import collections
+from musik_lib.cache import cached_page, cached_value
 from musik_lib.models.stats import *
+from musik_lib.pagination import KeysetPaginationMixin
+
+
+# Lookups to prefetch so that rendering a track (name, artists and collections) needs no more queries
+TRACK_PREFETCH = (
+    "artist",
+    "featuring",
+    Prefetch("trackincollection_set", queryset=TrackInCollection.objects.select_related("collection")),
+)
+
+
+def track_prefetch(prefix=""):
+    """
+    :param prefix: path to the tracks from the prefetched model, e.g. 'track__'
+    :return: TRACK_PREFETCH lookups relative to the prefetched model
+    """
+    return [
+        Prefetch(prefix + lookup.prefetch_through, queryset=lookup.queryset) if isinstance(lookup, Prefetch)
+        else prefix + lookup
+        for lookup in TRACK_PREFETCH
+    ]
 
 
+@method_decorator(cached_page, name="dispatch")
 class IndexView(generic.ListView):
     template_name = 'musik_lib/lib.html'
     context_object_name = 'collections'
@@ -14,6 +47,7 @@ class IndexView(generic.ListView):
         return Collection.objects.order_by('ordinal')
 
 
+@cached_page
 def lib_stat(request):
     context = {
         "stats": LibraryStat.load(),
@@ -21,11 +55,82 @@ def lib_stat(request):
     return render(request, 'musik_lib/lib_stat.html', context)
 
 
+def features_stat(request):
+    """
+    Audio features stats of the local spotify collections, from the feature store that collect_spotify_features fills;
+    The page is cached by the fingerprints of the collection files in the manifest and the stat of the store file,
+    as they change without a write to the library
+    """
+    path = settings.SPOTIFY_FEATURES_PATH
+    if not os.path.exists(path):
+        return render(request, 'musik_lib/features_stat.html', _features_stat_context(None, None))
+    manifest = collections.get_spotify_manifest()
+    store_stat = os.stat(path)
+    key = hashlib.sha1(json.dumps([
+        path,
+        store_stat.st_mtime_ns,
+        store_stat.st_size,
+        [entry.fingerprint for entry in manifest.values()],
+    ]).encode()).hexdigest()
+    content = cached_value(
+        f"features_stat:{key}",
+        lambda: render_to_string('musik_lib/features_stat.html', _features_stat_context(path, manifest), request),
+    )
+    return HttpResponse(content)
+
+
+def _features_stat_context(path, manifest):
+    """
+    :param path: of the feature store; No stats when None
+    :param manifest: manifest entries of the spotify collection files
+    """
+    # The spotify integration is imported only by this page, so that the other pages do not depend on it
+    from integrations.spotify import feature_stats, helpers
+    from integrations.spotify.feature_store import FeatureStore
+
+    context = {
+        "features": feature_stats.STAT_FEATURES,
+        "percentiles": feature_stats.PERCENTILES,
+        "library": None,
+    }
+    if path is not None:
+        library, collections_stats = helpers.get_library_stats(
+            FeatureStore(path),
+            {
+                name: [t["spotify_id"] for t in content["tracks"]]
+                for name, content in collections.LazyCollections(collections.SPOTIFY_COLLECTION_DIR, manifest).items()
+            },
+        )
+        context["library"] = library
+        # Rows of values in the order of the features, since templates cannot look up a dict by a variable
+        context["library_features"] = [
+            (feature, summary, [summary.percentiles[p] for p in feature_stats.PERCENTILES])
+            for feature, summary in library.features.items()
+        ]
+        context["collections_medians"] = [
+            (name, stats.num_tracks, [stats.features[feature].median for feature in feature_stats.STAT_FEATURES])
+            for name, stats in sorted(collections_stats.items())
+            if stats.num_tracks
+        ]
+    return context
+
+
 class CollectionDetailView(generic.DetailView):
     model = Collection
     template_name = 'musik_lib/collection.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["tracks_in_collection"] = (
+            self.object.trackincollection_set
+            .order_by('ordinal')
+            .select_related('track')
+            .prefetch_related('track__artist', 'track__featuring')
+        )
+        return context
+
 
+@method_decorator(cached_page, name="dispatch")
 class CollectionListView(generic.ListView):
     template_name = 'musik_lib/collection_list.html'
     context_object_name = 'collections'
@@ -39,36 +144,77 @@ class TrackDetailView(generic.DetailView):
     model = Track
     template_name = 'musik_lib/track.html'
 
+    def get_queryset(self):
+        return Track.objects.prefetch_related(*TRACK_PREFETCH)
+
 
-class TrackListView(generic.ListView):
+@method_decorator(cached_page, name="dispatch")
+class TrackListView(KeysetPaginationMixin, generic.ListView):
     template_name = 'musik_lib/track_list.html'
     context_object_name = 'tracks'
+    keyset = (F('name').asc(), F('id').asc())
 
     def get_queryset(self):
-        """Return the last five published questions."""
-        return Track.objects.order_by('name')
+        return Track.objects.prefetch_related('artist', 'featuring')
 
 
 class ArtistDetailView(generic.DetailView):
     model = Artist
     template_name = 'musik_lib/artist.html'
 
+    def get_queryset(self):
+        return Artist.objects.prefetch_related(
+            *track_prefetch('main_artist__'),
+            *track_prefetch('featured_artist__'),
+        )
+
 
-class ArtistListView(generic.ListView):
+@method_decorator(cached_page, name="dispatch")
+class ArtistListView(KeysetPaginationMixin, generic.ListView):
     template_name = 'musik_lib/artist_list.html'
     context_object_name = 'artists'
-    paginate_by = 100
+    keyset = (Upper('name').asc(), F('id').asc())
 
     def get_queryset(self):
-        return Artist.objects.order_by(Upper('name'))
+        return Artist.objects.all()
+
 
+class AlbumDetailView(generic.DetailView):
+    model = Album
+    template_name = 'musik_lib/album.html'
 
-class CollectionStatListView(generic.ListView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["tracks"] = (
+            Track.objects.filter(trackincollection__album=self.object)
+            .distinct()
+            .order_by('name', 'id')
+            .prefetch_related('artist', 'featuring')
+        )
+        return context
+
+
+@method_decorator(cached_page, name="dispatch")
+class AlbumListView(KeysetPaginationMixin, generic.ListView):
+    """
+    Albums with their stored totals, so the list needs no query per album
+    """
+    template_name = 'musik_lib/album_list.html'
+    context_object_name = 'albums'
+    keyset = (F('name').asc(), F('id').asc())
+
+    def get_queryset(self):
+        return Album.objects.all()
+
+
+@method_decorator(cached_page, name="dispatch")
+class CollectionStatListView(KeysetPaginationMixin, generic.ListView):
     template_name = 'musik_lib/collections_stat_list.html'
     context_object_name = 'collections_stats'
+    keyset = (F('collection_id').asc(),)
 
     def get_queryset(self):
-        return CollectionStat.objects.order_by('collection_id')
+        return CollectionStat.objects.select_related('collection')
 
 
 class CollectionStatDetailView(generic.DetailView):
@@ -76,20 +222,36 @@ class CollectionStatDetailView(generic.DetailView):
     template_name = 'musik_lib/collection_stat.html'
     context_object_name = 'c_stat'
 
+    def get_queryset(self):
+        return CollectionStat.objects.select_related('collection')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        c_stat = self.object
+        context["afcs"] = c_stat.artistfrequencycollection_set.select_related('artist')
+        context["dts"] = c_stat.duplicate_tracks.select_related('track')
+        return context
+
 
 class DuplicateTrackDetailView(generic.DetailView):
     model = DuplicateTrack
     template_name = 'musik_lib/duplicate_track.html'
     context_object_name = 'dt'
 
+    def get_queryset(self):
+        return DuplicateTrack.objects.select_related('track').prefetch_related(*track_prefetch('track__'))
+
 
-class DuplicateTrackListView(generic.ListView):
+@method_decorator(cached_page, name="dispatch")
+class DuplicateTrackListView(KeysetPaginationMixin, generic.ListView):
     template_name = 'musik_lib/dt_list.html'
     context_object_name = 'dts'
+    keyset = (F('frequency').desc(), F('track_id').asc())
 
     def get_queryset(self):
-        """Return the last five published questions."""
-        return DuplicateTrack.objects.all()
+        return DuplicateTrack.objects.select_related('track').prefetch_related(
+            'track__artist', 'track__featuring',
+        )
 
 
 class ArtistFrequencyCollectionDetailView(generic.DetailView):
@@ -97,13 +259,18 @@ class ArtistFrequencyCollectionDetailView(generic.DetailView):
     template_name = 'musik_lib/afc.html'
     context_object_name = 'afc'
 
+    def get_queryset(self):
+        return ArtistFrequencyCollection.objects.select_related('artist', 'collection_stat__collection')
+
 
-class ArtistFrequencyCollectionListView(generic.ListView):
+@method_decorator(cached_page, name="dispatch")
+class ArtistFrequencyCollectionListView(KeysetPaginationMixin, generic.ListView):
     template_name = 'musik_lib/afc_list.html'
     context_object_name = 'afcs'
+    keyset = (F('frequency').desc(), Upper('artist_name').asc(), F('id').asc())
 
     def get_queryset(self):
-        return ArtistFrequencyCollection.objects.order_by('-frequency', Upper("artist__name"))
+        return ArtistFrequencyCollection.objects.select_related('artist', 'collection_stat__collection')
 
 
 class ArtistFrequencyLibraryDetailView(generic.DetailView):
@@ -111,10 +278,18 @@ class ArtistFrequencyLibraryDetailView(generic.DetailView):
     template_name = 'musik_lib/afl.html'
     context_object_name = 'afl'
 
+    def get_queryset(self):
+        return ArtistFrequencyLibrary.objects.select_related('artist').prefetch_related(
+            *track_prefetch('artist__main_artist__'),
+            *track_prefetch('artist__featured_artist__'),
+        )
+
 
-class ArtistFrequencyLibraryListView(generic.ListView):
+@method_decorator(cached_page, name="dispatch")
+class ArtistFrequencyLibraryListView(KeysetPaginationMixin, generic.ListView):
     template_name = 'musik_lib/afl_list.html'
     context_object_name = 'afls'
+    keyset = (F('frequency').desc(), Upper('artist_name').asc(), F('id').asc())
 
     def get_queryset(self):
-        return ArtistFrequencyLibrary.objects.order_by('-frequency', Upper("artist__name"))
+        return ArtistFrequencyLibrary.objects.select_related('artist')
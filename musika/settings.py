@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -86,6 +87,26 @@ DATABASES = {
     }
 }
 
+# Feature store that scripts/collect_spotify_features.py fills, for the audio features stats page
+SPOTIFY_FEATURES_PATH = os.environ.get(
+    "MUSIKA_SPOTIFY_FEATURES_PATH",
+    os.path.join(BASE_DIR, 'integrations', 'spotify', 'features', 'features.sqlite3'),
+)
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# File based by default so that the ingestion scripts and the web workers share the library version
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get("MUSIKA_CACHE_BACKEND", 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get("MUSIKA_CACHE_LOCATION", os.path.join(tempfile.gettempdir(), 'musika_cache')),
+        'TIMEOUT': int(os.environ.get("MUSIKA_CACHE_TIMEOUT", 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
 
 
 # Password validation
@@ -0,0 +1,71 @@
+"""
+Times the parsing of every artist field of the local collections, see musik_lib.artists
+
+Manual collections have the artist field as is, and spotify collections as ingestion builds it
+from the artist names. Compares parsing without the cache to cached parsing over the same fields
+"""
+import argparse
+import time
+
+from musik_lib import artists, collections
+from scripts.parsing import modify_spotify_track
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--rounds',
+        type=int,
+        default=20,
+        help='number of times every artist field is parsed. Default is 20'
+    )
+    return parser.parse_args()
+
+
+def get_artist_fields():
+    fields = [
+        track["artist"]
+        for content in collections.get_local_manual_collections_by_name().values()
+        for track in content["tracks"]
+    ]
+    fields.extend(
+        modify_spotify_track(track)["artist"]
+        for content in collections.get_local_spotify_collections_content()
+        for track in content["tracks"]
+    )
+    return fields
+
+
+def time_parsing(parse, fields, rounds) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for field in fields:
+            parse(field)
+    return time.perf_counter() - start
+
+
+def main():
+    print("Start benchmarking artist parsing")
+    args = read_args()
+
+    fields = get_artist_fields()
+    print(f"Parsing {len(fields)} artist fields, {len(set(fields))} distinct, {args.rounds} rounds")
+
+    def parse_uncached(field):
+        return [artists.artist_key.__wrapped__(name) for name in artists.parse_artists.__wrapped__(field).all]
+
+    def parse_cached(field):
+        return [artists.artist_key(name) for name in artists.parse_artists(field).all]
+
+    artists.clear_caches()
+    uncached = time_parsing(parse_uncached, fields, args.rounds)
+    artists.clear_caches()
+    cached = time_parsing(parse_cached, fields, args.rounds)
+
+    print(f"Uncached {uncached * 1000:.1f} ms, cached {cached * 1000:.1f} ms, {uncached / cached:.1f}x")
+    print(f"Parse cache {artists.parse_artists.cache_info()}")
+    print("Finish benchmarking artist parsing")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Collect the audio features of the tracks in the local spotify collections into the local feature store
+Only tracks that are not in the store yet are fetched, in batches of 100 tracks per request
+"""
+import argparse
+
+import integrations.spotify.client
+import integrations.spotify.helpers
+from integrations.spotify.feature_store import DEFAULT_STORE_PATH, FeatureStore
+from integrations.spotify.models import SpotifyTrack
+from musik_lib import collections
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--store',
+        default=DEFAULT_STORE_PATH,
+        help=f'path of the feature store. Default is {DEFAULT_STORE_PATH}'
+    )
+    return parser.parse_args()
+
+
+def main():
+    print("Start collecting spotify audio features")
+    args = read_args()
+
+    client = integrations.spotify.client.SpotifyClient.make_default()
+    store = FeatureStore(args.store)
+
+    tracks = [
+        SpotifyTrack.from_dict(track)
+        for collection in collections.get_local_spotify_collections_content()
+        for track in collection["tracks"]
+    ]
+    number_of_fetched = integrations.spotify.helpers.fetch_tracks_features(client, tracks, store)
+
+    print(f"Fetched features of {number_of_fetched} tracks, store has {len(store)} tracks")
+    print("Finish collecting spotify audio features")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Converts the local spotify collection files to a collection format, see musik_lib.collections.compact
+
+A file is replaced only after the converted file reads back equal to it, so the conversion is lossless
+Set MUSIKA_COLLECTION_FORMAT to the same format so that sync writes new collections in it
+"""
+import argparse
+import os
+
+from musik_lib import collections
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--format',
+        choices=sorted(collections.COLLECTION_FORMATS),
+        default="compact",
+        help='format to convert the collection files to. Default is compact'
+    )
+    return parser.parse_args()
+
+
+def convert_file(path: str, collection_format: str) -> str:
+    """
+    :return: path of the converted file, which is path when it is in the format already
+    """
+    extension = collections.COLLECTION_FORMATS[collection_format]
+    if path.endswith(extension):
+        return path
+    content = collections.load_collection_file(path)
+    converted_path = f"{os.path.splitext(path)[0]}{extension}"
+    collections.write_collection_file(content, converted_path)
+    if collections.load_collection_file(converted_path) != content:
+        os.remove(converted_path)
+        raise ValueError(f"Converted {path} does not read back equal, kept it as is")
+    os.remove(path)
+    return converted_path
+
+
+def main():
+    print("Start converting collection files")
+    args = read_args()
+
+    size_before = size_after = 0
+    number_of_converted = 0
+    for path in collections.get_local_spotify_collection_paths():
+        size_before += os.path.getsize(path)
+        converted_path = convert_file(path, args.format)
+        size_after += os.path.getsize(converted_path)
+        number_of_converted += converted_path != path
+
+    print(f"Converted {number_of_converted} files, {size_before} bytes to {size_after} bytes")
+    print("Finish converting collection files")
+
+
+if __name__ == '__main__':
+    main()
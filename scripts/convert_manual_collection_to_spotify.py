@@ -5,12 +5,15 @@ The songs appear in the manual collections and need to be mapped to spotify coll
 The script here tries to find the matching tracks in Spotify and this is not a 1:1 mapping all the time,
 so there are some fuzzy logic matchers
 
-
+Track searches are kept between runs and run concurrently, see integrations.spotify.resolution;
+a rerun only searches the tracks it did not search before and skips the collections that were converted
 """
-
+import argparse
 from typing import Dict
 
 from integrations.spotify.client import SpotifyClient
+from integrations.spotify.http_cache import DEFAULT_CACHE_PATH
+from integrations.spotify.resolution import ResolutionStore, resolve_tracks
 from musik_lib import collections
 
 
@@ -22,87 +25,117 @@ def get_manual_collections_to_sync():
     print(f"Found {len(local_manual_collections)} local manual collections")
 
     only_on_manual = {
-        name: col_content for name, col_content in local_manual_collections.items()
+        name: local_manual_collections[name] for name in local_manual_collections
         if name not in local_spotify_collections
     }
 
     return only_on_manual
 
 
-def create_or_update_collections(client: SpotifyClient, collections: Dict):
+def create_or_update_collections(
+        client: SpotifyClient,
+        collections_to_convert: Dict,
+        store: ResolutionStore,
+        workers: int,
+        retry_unresolved: bool,
+):
+    """
+    Writes a playlist for every collection whose tracks all resolved; Collections with unresolved tracks are reported
+    and left for the next run, and collections that were written with the same content are skipped
+    """
     playlist_name_to_id = {
         p["name"]: p["id"]
         for p in client.playlists()
     }
 
-    def find_tracks(collection: Dict):
-        try:
-            spotify_tracks = [
-                client.search_track(track["name"], track["artist"], track["duration"])
-                for track in collection["tracks"]
-                # if track["name"].lower() == "empty boat"
-            ]
-        except ValueError as ve:
-            print(f"Failed to convert collection {collection['name']}")
-            print(ve)
-            return None
-
-        return [
-            t.uri for t in spotify_tracks
-        ]
-
-    for col_name, col_content in collections.items():
-        tracks = find_tracks(col_content)
-        if tracks is None:
-            break
+    number_of_unresolved_collections = 0
+    for col_name, col_content in collections_to_convert.items():
+        fingerprint = collections.collection_fingerprint(col_content)
+        if store.is_done(col_name, fingerprint):
+            print(f"Skip converted collection {col_name}")
+            continue
+
+        resolution = resolve_tracks(
+            client=client,
+            tracks=col_content["tracks"],
+            store=store,
+            workers=workers,
+            retry_unresolved=retry_unresolved,
+        )
+        if not resolution.is_complete:
+            number_of_unresolved_collections += 1
+            print(f"Failed to convert collection {col_name}, {len(resolution.unresolved)} tracks are unresolved")
+            for (name, artist, duration), reason in resolution.unresolved.items():
+                print(f"  {name}, {artist}, {duration} : {reason.splitlines()[0]}")
+            continue
         print("---------------------")
 
         playlist_name = col_content["name"]
         if (playlist_id := playlist_name_to_id.get(col_name)) is not None:
             client.update_playlist(
                 playlist_id=playlist_id,
-                uris=tracks,
+                uris=resolution.uris,
                 collection=col_content,
             )
             print(f"updated playlist : {playlist_name}")
         else:
             client.create_playlist(
                 playlist_name=playlist_name,
-                uris=tracks,
+                uris=resolution.uris,
                 description=col_content.get("description"),
             )
             print(f"Created playlist {playlist_name}")
+        store.mark_done(col_name, fingerprint)
+
+    if number_of_unresolved_collections:
+        print(f"{number_of_unresolved_collections} collections have unresolved tracks, see them with --review")
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help='number of concurrent track searches. Default is 8'
+    )
+    parser.add_argument(
+        '--retry-unresolved',
+        action='store_true',
+        help='when provided, tracks that did not match in former runs are searched again. Default is false'
+    )
+    parser.add_argument(
+        '--review',
+        action='store_true',
+        help='when provided, only lists the tracks that did not match in former runs'
+    )
+    return parser.parse_args()
 
 
 def main():
     print("Start convert manual collection to spotify")
+    args = read_args()
+    store = ResolutionStore()
+
+    if args.review:
+        for (name, artist, duration), reason in store.unresolved():
+            print(f"{name}, {artist}, {duration} : {reason}")
+        return
 
     only_on_manual = get_manual_collections_to_sync()
     if not only_on_manual:
         print("no collection left to convert")
         return
-    skip_cols = {
-        "My 2nd Album",  # missing international airport
-        "To Assaf",  # missing im only sleeping from I am sam
-        "Silence in the Studio",  # Did not find a match for Empty Boat, The Birdwatcher in items
-        "The Cork",  # Did not find a match for Something New, The Dove in items
-        "An Album",
-
-    }
-    cols = {
-        n: c for n, c
-        in only_on_manual.items()
-        if n not in skip_cols
-    }
 
     client = SpotifyClient.make_default(
         extra_scope=[
             "playlist-modify-public",
             "playlist-modify-private",
-        ]
+        ],
+        cache_path=DEFAULT_CACHE_PATH,
     )
 
-    create_or_update_collections(client, cols)
+    create_or_update_collections(client, only_on_manual, store, args.workers, args.retry_unresolved)
 
     print("Finish convert manual collection to spotify")
 
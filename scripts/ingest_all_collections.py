@@ -1,6 +1,10 @@
 """
 Reads all local collections, including the ones from spotify ingestion
 and gives priority to Spotify collections
+
+With --workers N, only the reading and parsing of the collection files runs in a pool of N processes.
+The resolution of artists and tracks and the DB writes stay serialized in this process, as artist names and
+collection ordinals are unique and the resolution reads the artists and tracks from the DB
 """
 
 import django
@@ -10,9 +14,13 @@ django.setup()
 from musik_lib import collections
 from musik_lib.models.base import Library
 from musik_lib.models.stats import LibraryStat
+from scripts import parsing
 from scripts import utility
 
 import argparse
+import time
+
+from concurrent.futures import ProcessPoolExecutor
 
 
 def read_args():
@@ -22,38 +30,113 @@ def read_args():
         action='store_true',
         help='when true, the db will be cleaned before ingesting the files. default is false'
     )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='when true, collections are ingested even if their files did not change. default is false'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='number of processes that read and parse the collection files; only parsing runs in parallel, '
+             'artist and track resolution and the DB writes stay in this process. default is 0, parse in this process'
+    )
     return parser.parse_args()
 
 
-def main():
-    print("Start DB ingest script")
-    args = read_args()
-
-    if args.clear:
-        print("Clearing DB")
-        utility.clear_db()
-
+def ingest_serial(ingestor: utility.CollectionIngestor, force: bool):
     local_spotify_collections = collections.get_local_spotify_collections_by_name()
     print(f"Found {len(local_spotify_collections)} local spotify collections")
 
     local_manual_collections = collections.get_local_manual_collections_by_name()
-    only_on_manual = set(local_manual_collections.keys()) - set(local_spotify_collections.keys())
-    _ = Library.load()
+    # Keep the files order so that the serial and the parallel runs create the same tracks
+    only_on_manual = [
+        name for name in local_manual_collections
+        if name not in local_spotify_collections
+    ]
 
     print("Reading first manual collections")
     for manual_collection_name in only_on_manual:
         print(f"Reading manual collection name {manual_collection_name}")
         collection = local_manual_collections[manual_collection_name]
-        utility.ingest_collection(collection)
+        _timed_ingest(parsing.parse_manual_collection(collection), ingestor, force)
 
     # There is no concept of ordinal in spotify
     for spotify_collection in local_spotify_collections.values():
         print(f"Reading spotify collection name {spotify_collection['name']}")
-        utility.ingest_spotify_collection(spotify_collection)
+        _timed_ingest(parsing.parse_spotify_collection(spotify_collection), ingestor, force)
+
+
+def ingest_parallel(ingestor: utility.CollectionIngestor, workers: int, force: bool):
+    spotify_paths = collections.get_local_spotify_collection_paths()
+    manual_paths = collections.get_local_manual_collection_paths()
 
-    l_stat = LibraryStat.load()
-    print("Updating stats")
-    l_stat.update()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        spotify_futures = [
+            executor.submit(_timed_parse, "spotify", path) for path in spotify_paths
+        ]
+        manual_futures = [
+            executor.submit(_timed_parse, "manual", path) for path in manual_paths
+        ]
+
+        # Manual collections are ingested only when there is no spotify collection by that name,
+        # so need all spotify names first
+        spotify_parsed = [f.result() for f in spotify_futures]
+        spotify_names = {parsed.name for parsed, _ in spotify_parsed}
+        print(f"Found {len(spotify_parsed)} local spotify collections")
+
+        print("Reading first manual collections")
+        for future in manual_futures:
+            parsed, parse_time = future.result()
+            if parsed.name in spotify_names:
+                continue
+            print(f"Reading manual collection name {parsed.name}")
+            _timed_ingest(parsed, ingestor, force, parse_time)
+
+    for parsed, parse_time in spotify_parsed:
+        print(f"Reading spotify collection name {parsed.name}")
+        _timed_ingest(parsed, ingestor, force, parse_time)
+
+
+def _timed_parse(kind, path):
+    start = time.perf_counter()
+    parsed = parsing.load_and_parse_collection_file(kind, path)
+    return parsed, time.perf_counter() - start
+
+
+def _timed_ingest(parsed: parsing.ParsedCollection, ingestor: utility.CollectionIngestor, force: bool, parse_time=None):
+    start = time.perf_counter()
+    _, written = utility.ingest_parsed_collection(parsed, ingestor, force=force)
+    write_time = time.perf_counter() - start
+    parse_msg = f"parsed in {parse_time:.3f}s, " if parse_time is not None else ""
+    write_msg = f"written in {write_time:.3f}s" if written else "unchanged, skipped"
+    print(f"  {len(parsed.tracks)} tracks, {parse_msg}{write_msg}")
+
+
+def main():
+    print("Start DB ingest script")
+    args = read_args()
+
+    if args.clear:
+        print("Clearing DB")
+        utility.clear_db()
+
+    _ = Library.load()
+    # Shared by all collections so artists and tracks are loaded from the DB only once
+    ingestor = utility.CollectionIngestor()
+
+    start = time.perf_counter()
+    if args.workers > 0:
+        ingest_parallel(ingestor, args.workers, args.force)
+    else:
+        ingest_serial(ingestor, args.force)
+    print(f"Ingested collections in {time.perf_counter() - start:.2f}s")
+
+    # Stats are updated along with the collections; a full recompute is only needed to repair drift
+    if drift := LibraryStat.load().verify():
+        counts = ", ".join(f"{len(entries)} {name}" for name, entries in drift._asdict().items())
+        print(f"Stats drifted ({counts}), run 'python manage.py verify_stats --repair'")
 
     print("Finish DB ingest script")
 
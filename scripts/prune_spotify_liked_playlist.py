@@ -10,14 +10,16 @@ Read the songs from liked playlist
 Removed all songs that are in both
 """
 from integrations.spotify.client import SpotifyClient
+from integrations.spotify.http_cache import DEFAULT_CACHE_PATH
+from integrations.spotify.models import SpotifyCollection
 from musik_lib import collections
 
 
 def _get_tracks_to_remove(remote_tracks, local_collections):
     local_tracks_by_track_id = {
-        track["spotify_id"]: track
+        track.spotify_id: track
         for collection in local_collections
-        for track in collection["tracks"]
+        for track in collection.tracks
     }
     track_name_by_track_id_to_remove = {
         track["id"]: track["name"] for track in remote_tracks
@@ -29,10 +31,12 @@ def _get_tracks_to_remove(remote_tracks, local_collections):
 def main():
     print("Start Prune Saved Tracks")
 
-    client = SpotifyClient.make_default()
+    client = SpotifyClient.make_default(cache_path=DEFAULT_CACHE_PATH)
 
     saved_tracks = client.saved_tracks()
-    local_collections = collections.get_local_spotify_collections_content()
+    local_collections = (
+        SpotifyCollection.from_dict(content) for content in collections.get_local_spotify_collections_content()
+    )
     track_name_by_track_id_to_remove = _get_tracks_to_remove(
         remote_tracks=saved_tracks,
         local_collections=local_collections,
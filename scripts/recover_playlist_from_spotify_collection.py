@@ -8,6 +8,7 @@ since there is no way to recover a deleted playlist from the UI
 from typing import Dict
 
 from integrations.spotify.client import SpotifyClient
+from integrations.spotify.models import SpotifyCollection
 from musik_lib import collections
 
 
@@ -16,37 +17,32 @@ def get_spotify_collections_to_sync(spotify_collection_names):
     print(f"Found {len(local_spotify_collections)} local spotify collections")
 
     collections_to_sync = {
-        name: col_content for name, col_content in local_spotify_collections.items()
+        name: SpotifyCollection.from_dict(local_spotify_collections[name]) for name in local_spotify_collections
         if name in spotify_collection_names
     }
 
     return collections_to_sync
 
 
-def recover_collections(client: SpotifyClient, collections: Dict):
+def recover_collections(client: SpotifyClient, collections: Dict[str, SpotifyCollection]):
     playlist_name_to_id = {
         p["name"]: p["id"]
         for p in client.playlists()
     }
 
-    def get_uri(track: Dict):
-        if (uri := track.get("uri")) is not None:
-            return uri
-        return f"spotify:track:{track['spotify_id']}"
-
-    for col_name, col_content in collections.items():
+    for col_name, collection in collections.items():
         if playlist_name_to_id.get(col_name):
             print(f"Error: Already have col name {col_name} on remote, cannot recover")
             continue
 
-        tracks = [get_uri(track) for track in col_content['tracks']]
+        tracks = [track.uri for track in collection.tracks]
         if not tracks:
             print(f"Error: no tracks found in collection {col_name}")
 
         client.create_playlist(
             playlist_name=col_name,
             uris=tracks,
-            description=col_content.get("description"),
+            description=collection.description,
         )
         print(f"Created playlist {col_name}")
 
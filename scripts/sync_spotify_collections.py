@@ -1,10 +1,12 @@
 """
 Sync spotify collections from UI into local disk
-Only sync collecitons that are new , not currently on disk, and compare by name
+Only sync collecitons that are new or changed; A playlist changed when its snapshot id differs from the one on disk,
+so the items of unchanged playlists are not fetched
 
 If clear is provided, then will clear local storage before, so all remote will be downloaded
 """
 import argparse
+import os
 
 import integrations.spotify.client
 import integrations.spotify.helpers
@@ -18,6 +20,12 @@ def read_args():
         action='store_true',
         help='when provided, all local collections will be deleted before sync. Default is false'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help='number of threads that fetch playlist pages concurrently. Default is 8, 1 fetches serially'
+    )
     return parser.parse_args()
 
 
@@ -25,31 +33,42 @@ def main():
     print("Start Spotify sync")
     args = read_args()
 
-    client = integrations.spotify.client.SpotifyClient.make_default()
+    client = integrations.spotify.client.SpotifyClient.make_default(workers=args.workers)
 
     if args.clear:
         print("Removing local spotify collections")
         collections.clear_spotify_local_collections()
 
-    local_collections = collections.get_local_spotify_collection_ids()
-    remote_collections = integrations.spotify.helpers.get_remote_collections(
+    local_snapshots = collections.get_local_spotify_snapshots()
+    local_paths = collections.get_local_spotify_collection_paths_by_id()
+    # Playlist pages are written to the collection files as they arrive
+    written_collections = integrations.spotify.helpers.write_remote_collections(
         client=client,
+        local_snapshots=local_snapshots,
     )
     number_of_new_written_collections = 0
-    for collection in remote_collections:
-        if collection.spotify_id in local_collections:
-            print(f"Skipping existing collection : {collection.name}")
+    number_of_updated_collections = 0
+    for collection in written_collections:
+        path = collection.path
+        if collection.spotify_id not in local_snapshots:
+            number_of_new_written_collections += 1
+            print(f"New collection written : {collection.name}")
             continue
-        collections.write_spotify_collection(
-            collection=collection,
-        )
-        number_of_new_written_collections += 1
-        print(f"New collection written : {collection.name}")
 
-    if number_of_new_written_collections:
-        print(f"Wrote {number_of_new_written_collections} of new collections ")
+        # A renamed playlist is written to a new file
+        old_path = local_paths[collection.spotify_id]
+        if os.path.basename(old_path) != os.path.basename(path):
+            os.remove(old_path)
+        number_of_updated_collections += 1
+        print(f"Changed collection written : {collection.name}")
+
+    if number_of_new_written_collections or number_of_updated_collections:
+        print(
+            f"Wrote {number_of_new_written_collections} of new collections "
+            f"and {number_of_updated_collections} of changed collections"
+        )
     else:
-        print("No new collections written")
+        print("No new or changed collections written")
 
     print("Finish spotify ingest script")
 
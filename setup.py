@@ -20,6 +20,7 @@ install_requires = [
     'django-extensions>=3.2.3',
     'gunicorn',
     'spotipy',
+    'numpy',
 ]
 
 setup(